@@ -0,0 +1,71 @@
+# Times RPG Maker MV/MZ CommonEvents with and without page coalescing against a stub API
+# Every request is answered after a fixed latency, nothing is sent anywhere. Prints the wall time, the number of
+# requests and the most requests that were out at once for each setting.
+# Run from the repo root:
+# python benchmarks/coalesce.py [pages] [lines] [threads] [latency]
+import json, os, re, sys, tempfile, threading, time
+from concurrent.futures import Future
+from pathlib import Path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+PAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+LINES = int(sys.argv[2]) if len(sys.argv) > 2 else 80
+THREADS = sys.argv[3] if len(sys.argv) > 3 else '10'
+LATENCY = float(sys.argv[4]) if len(sys.argv) > 4 else 0.2
+
+# Settings that never reach an API, read when the modules are imported
+os.chdir(tempfile.mkdtemp(prefix='coalesce-'))
+Path('prompt.txt').write_text('Translate the Japanese text to English.', encoding='utf-8')
+Path('vocab.txt').write_text('', encoding='utf-8')
+os.environ.update({'api': 'http://127.0.0.1:9/v1', 'key': 'stub', 'org': '', 'model': 'gpt-4-1106-preview',
+                   'language': 'English', 'timeout': '30', 'fileThreads': '1', 'threads': THREADS, 'width': '60',
+                   'listWidth': '80', 'noteWidth': '60', 'cache': 'false', 'journal': 'false',
+                   'tokenizer': 'approximate', 'adaptiveBatch': 'false'})
+import modules.coalesce as coalesce
+import modules.ratelimit as ratelimit
+import modules.rpgmakermvmz as mvmz
+from modules.client import createResponse
+
+LOCK = threading.Lock()
+STATE = {'sent': 0, 'inFlight': 0, 'most': 0}
+
+# Answers every line of the request after LATENCY seconds
+def submitCompletion(**kwargs):
+    future = Future()
+    with LOCK:
+        STATE['sent'] += 1
+        STATE['inFlight'] += 1
+        STATE['most'] = max(STATE['most'], STATE['inFlight'])
+    lines = re.findall(r'<Line(\d+)>', kwargs['messages'][-1]['content'])
+    content = '\n'.join(f'<Line{i}>Line {i} of the batch.</Line{i}>' for i in lines) or 'A string.'
+
+    def answer():
+        with LOCK:
+            STATE['inFlight'] -= 1
+        future.set_result(createResponse(kwargs['model'], content))
+    threading.Timer(LATENCY, answer).start()
+    return future
+
+ratelimit.submitCompletion = submitCompletion
+ratelimit.createCompletion = lambda **kwargs: submitCompletion(**kwargs).result()
+
+# Every line is its own 401 group, the wait command between them keeps searchCodes from joining them
+events = [None]
+for p in range(PAGES):
+    codeList = []
+    for i in range(LINES):
+        codeList.append({'code': 401, 'indent': 0, 'parameters': [f'イベント{p}の{i}行目です。']})
+        codeList.append({'code': 230, 'indent': 0, 'parameters': [1]})
+    codeList.append({'code': 0, 'indent': 0, 'parameters': []})
+    events.append({'id': p + 1, 'list': codeList, 'name': f'Event {p}', 'switchId': 1, 'trigger': 0})
+Path('files').mkdir()
+Path('files/CommonEvents.json').write_text(json.dumps(events, ensure_ascii=False), encoding='utf-8')
+
+print(f'{PAGES} pages x {LINES} lines, threads={THREADS}, {LATENCY}s per request')
+print(f'{"coalescePages":<16}{"time":>8}{"requests":>10}{"in flight":>11}')
+for setting in [False, True]:
+    coalesce.COALESCE = setting
+    STATE.update({'sent': 0, 'inFlight': 0, 'most': 0})
+    start = time.perf_counter()
+    mvmz.handleMVMZ('CommonEvents.json', False)
+    print(f'{str(setting):<16}{time.perf_counter() - start:>7.2f}s{STATE["sent"]:>10}{STATE["most"]:>11}')
@@ -0,0 +1,68 @@
+# Times reading and writing game data with each installed JSON backend and checks they agree
+# Every .json file in the folder (default /files) is parsed with orjson, ujson and the json module and parsed data
+# has to match what json reads. Files are dumped with dumpJSON, which has to give the same bytes the MV/MZ module's
+# json.dump(data, f, ensure_ascii=False) on a UTF-8 text file wrote before. Compact dumps (jsonCompact) from every
+# backend have to match the json module's compact dump. Any file where they don't is listed.
+# Run from the repo root:
+# python benchmarks/jsonio.py [folder] [repeats]
+import io, json, os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from modules.jsonio import BACKEND, BACKENDS, dumpJSON, parseJSON
+
+FOLDER = sys.argv[1] if len(sys.argv) > 1 else 'files'
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+paths = sorted(os.path.join(FOLDER, f) for f in os.listdir(FOLDER) if f.endswith('.json'))
+if len(paths) == 0:
+    sys.exit(f'Put some .json game files in /{FOLDER} first')
+raw = {}
+for path in paths:
+    with open(path, 'rb') as f:
+        raw[path] = f.read()
+reference = {path: parseJSON(data, 'json') for path, data in raw.items()}
+print(f'{len(paths)} files, {round(sum(len(data) for data in raw.values()) / 2 ** 20, 1)} MB, '
+      f'largest {max(paths, key=lambda p: len(raw[p]))}. Default backend: {BACKEND}')
+
+# Best of REPEATS, in seconds over every file
+def best(function):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for path in paths:
+            function(path)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def oldLoad(path):
+    return json.load(io.TextIOWrapper(io.BytesIO(raw[path]), encoding='utf-8-sig'))
+
+def oldDump(path):
+    outFile = io.BytesIO()
+    with io.TextIOWrapper(outFile, encoding='utf-8', write_through=True) as f:
+        json.dump(reference[path], f, ensure_ascii=False)
+        return outFile.getvalue()
+
+print(f'{"load":<12}{"time":>10}  mismatches')
+print(f'{"json.load":<12}{best(oldLoad):>9.3f}s  (text files, before)')
+for name, backend in BACKENDS.items():
+    if backend is None:
+        print(f'{name:<12}{"not installed":>20}')
+        continue
+    loadTime = best(lambda path: parseJSON(raw[path], name))
+    mismatches = [os.path.basename(path) for path in paths if parseJSON(raw[path], name) != reference[path]]
+    print(f'{name:<12}{loadTime:>9.3f}s  {", ".join(mismatches) or "none"}')
+
+print(f'\n{"dump":<12}{"time":>10}  mismatches')
+print(f'{"json.dump":<12}{best(oldDump):>9.3f}s  (text files, before)')
+mismatches = [os.path.basename(path) for path in paths if dumpJSON(reference[path], compact=False) != oldDump(path)]
+print(f'{"dumpJSON":<12}{best(lambda path: dumpJSON(reference[path], compact=False)):>9.3f}s  '
+      f'{", ".join(mismatches) or "none"}')
+
+print(f'\n{"compact":<12}{"time":>10}  mismatches')
+expected = {path: dumpJSON(data, 'json', True) for path, data in reference.items()}
+for name, backend in BACKENDS.items():
+    if backend is None:
+        print(f'{name:<12}{"not installed":>20}')
+        continue
+    dumpTime = best(lambda path: dumpJSON(reference[path], name, True))
+    mismatches = [os.path.basename(path) for path in paths if dumpJSON(reference[path], name, True) != expected[path]]
+    print(f'{name:<12}{dumpTime:>9.3f}s  {", ".join(mismatches) or "none"}')
@@ -0,0 +1,163 @@
+# Microbenchmark for subVars/resubVars
+# Compares the old one regex pass per code type version against the single scan tokenizer in modules/placeholders.py
+# on typical 401 Show Text lines. Run from the repo root: python benchmarks/subvars.py
+import os, re, sys, timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from modules.placeholders import compileVars, restoreVars, substituteVars
+
+PLACEHOLDERS = compileVars('[]', r'[\\]+[\w]+\[[a-zA-Z0-9\\\[\]\_,\s-]+\]')
+LINES = [
+    '\\C[2]アリス\\C[0]「おはよう、\\N[1]。今日もいい天気だね！」',
+    '\\I[64]ポーションを\\V[12]個手に入れた！',
+    '……え？　ちょっと待って、\\C[6]それ\\C[0]って本当なの？',
+    '\\FS[24]\\C[2]【魔王】\\C[0]\\SE[Darkness1]ふはははは！\\!\\.よく来たな勇者よ。',
+    'ねえ、\\N[\\V[3]]ちゃん。明日は\\C[3]東の森\\C[0]に行こうよ。',
+    '村の外には魔物がいるから気をつけてね。',
+    '\\AA[7]\\I[87]\\C[4]伝説の剣\\C[0]を装備した！\\I[87]',
+    'お金が\\V[5]G足りないみたい……。',
+]
+TRANSLATED = '[Color_0]Alice[Color_1] "Good morning, [Noun_0]. [Ascii_0] [Var_0] [FCode_0] [ Nested_0 ]"'
+
+# Old Version
+def oldSubVars(jaString):
+    jaString = jaString.replace('\u3000', ' ')
+
+    # Nested
+    count = 0
+    nestedList = re.findall(r'[\\]+[\w]+\[[\\]+[\w]+\[[0-9]+\]\]', jaString)
+    nestedList = set(nestedList)
+    if len(nestedList) != 0:
+        for icon in nestedList:
+            jaString = jaString.replace(icon, '[Nested_' + str(count) + ']')
+            count += 1
+
+    # Icons
+    count = 0
+    iconList = re.findall(r'[\\]+[iIkKwWaA]+\[[0-9]+\]', jaString)
+    iconList = set(iconList)
+    if len(iconList) != 0:
+        for icon in iconList:
+            jaString = jaString.replace(icon, '[Ascii_' + str(count) + ']')
+            count += 1
+
+    # Colors
+    count = 0
+    colorList = re.findall(r'[\\]+[cC]\[[0-9]+\]', jaString)
+    colorList = set(colorList)
+    if len(colorList) != 0:
+        for color in colorList:
+            jaString = jaString.replace(color, '[Color_' + str(count) + ']')
+            count += 1
+
+    # Names
+    count = 0
+    nameList = re.findall(r'[\\]+[nN]\[.+?\]+', jaString)
+    nameList = set(nameList)
+    if len(nameList) != 0:
+        for name in nameList:
+            jaString = jaString.replace(name, '[Noun_' + str(count) + ']')
+            count += 1
+
+    # Variables
+    count = 0
+    varList = re.findall(r'[\\]+[vV]\[[0-9]+\]', jaString)
+    varList = set(varList)
+    if len(varList) != 0:
+        for var in varList:
+            jaString = jaString.replace(var, '[Var_' + str(count) + ']')
+            count += 1
+
+    # Formatting
+    count = 0
+    formatList = re.findall(r'[\\]+[\w]+\[[a-zA-Z0-9\\\[\]\_,\s-]+\]', jaString)
+    formatList = set(formatList)
+    if len(formatList) != 0:
+        for var in formatList:
+            jaString = jaString.replace(var, '[FCode_' + str(count) + ']')
+            count += 1
+
+    # Put all lists in list and return
+    allList = [nestedList, iconList, colorList, nameList, varList, formatList]
+    return [jaString, allList]
+
+def oldResubVars(translatedText, allList):
+    # Fix Spacing and ChatGPT Nonsense
+    matchList = re.findall(r'\[\s?.+?\s?\]', translatedText)
+    if len(matchList) > 0:
+        for match in matchList:
+            text = match.strip()
+            translatedText = translatedText.replace(match, text)
+
+    # Nested
+    count = 0
+    if len(allList[0]) != 0:
+        for var in allList[0]:
+            translatedText = translatedText.replace('[Nested_' + str(count) + ']', var)
+            count += 1
+
+    # Icons
+    count = 0
+    if len(allList[1]) != 0:
+        for var in allList[1]:
+            translatedText = translatedText.replace('[Ascii_' + str(count) + ']', var)
+            count += 1
+
+    # Colors
+    count = 0
+    if len(allList[2]) != 0:
+        for var in allList[2]:
+            translatedText = translatedText.replace('[Color_' + str(count) + ']', var)
+            count += 1
+
+    # Names
+    count = 0
+    if len(allList[3]) != 0:
+        for var in allList[3]:
+            translatedText = translatedText.replace('[Noun_' + str(count) + ']', var)
+            count += 1
+
+    # Vars
+    count = 0
+    if len(allList[4]) != 0:
+        for var in allList[4]:
+            translatedText = translatedText.replace('[Var_' + str(count) + ']', var)
+            count += 1
+    
+    # Formatting
+    count = 0
+    if len(allList[5]) != 0:
+        for var in allList[5]:
+            translatedText = translatedText.replace('[FCode_' + str(count) + ']', var)
+            count += 1
+
+    return translatedText
+
+# New Version
+def newSubVars(jaString):
+    return substituteVars(jaString, PLACEHOLDERS)
+
+def newResubVars(translatedText, allList):
+    return restoreVars(translatedText, allList, PLACEHOLDERS)
+
+def run(subVars, resubVars):
+    for line in LINES:
+        response = subVars(line)
+        resubVars(response[0], response[1])
+        resubVars(TRANSLATED, response[1])
+
+if __name__ == '__main__':
+    # The new version must give back the original line, the old one loses codes when they overlap
+    for line in LINES:
+        response = newSubVars(line)
+        assert newResubVars(response[0], response[1]) == line.replace('\u3000', ' '), line
+        response = oldSubVars(line)
+        if oldResubVars(response[0], response[1]) != line.replace('\u3000', ' '):
+            print(f'Old version does not restore: {line}')
+
+    number = 20000
+    old = min(timeit.repeat(lambda: run(oldSubVars, oldResubVars), number=number, repeat=3))
+    new = min(timeit.repeat(lambda: run(newSubVars, newResubVars), number=number, repeat=3))
+    lines = number * len(LINES)
+    print(f'Old: {old / lines * 1e6:.2f}us per line')
+    print(f'New: {new / lines * 1e6:.2f}us per line')
+    print(f'Speedup: {old / new:.1f}x')
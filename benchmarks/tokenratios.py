@@ -0,0 +1,34 @@
+# Calibrates the approximate token counter and checks it
+# Measures tokens per character for ASCII, kana, kanji and everything else with the real tokenizer on the files in
+# /files, saves them to tokenRatios and then compares approximate counts against exact ones line by line.
+# Needs the tokenizer to load, either online or through tokenizerCache. Run from the repo root:
+# python benchmarks/tokenratios.py [model]
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from modules.tokens import RATIOFILE, approximateCount, calibrateRatios, countList
+
+MODEL = sys.argv[1] if len(sys.argv) > 1 else os.getenv('model', 'gpt-4')
+texts = []
+for filename in os.listdir('files'):
+    with open(os.path.join('files', filename), 'r', encoding='utf-8', errors='ignore') as f:
+        texts.append(f.read())
+if len(texts) == 0:
+    sys.exit('Put some game files in /files first')
+
+print(f'Ratios for {MODEL}: {calibrateRatios(MODEL, texts)} saved to {RATIOFILE}')
+
+# Accuracy, per line and over everything
+lines = [line for text in texts for line in text.splitlines() if line.strip() != '']
+start = time.perf_counter()
+exact = countList(MODEL, lines)
+exactTime = time.perf_counter() - start
+start = time.perf_counter()
+approximate = [approximateCount(line) for line in lines]
+approximateTime = time.perf_counter() - start
+
+errors = sorted(abs(a - e) / e for a, e in zip(approximate, exact) if e > 0)
+print(f'{len(lines)} lines, {sum(exact)} tokens exact, {sum(approximate)} approximate '
+      f'({round((sum(approximate) - sum(exact)) / sum(exact) * 100, 1)}% total)')
+print(f'Per line error: median {round(errors[len(errors) // 2] * 100, 1)}%, '
+      f'90th percentile {round(errors[int(len(errors) * 0.9)] * 100, 1)}%')
+print(f'tiktoken {round(exactTime, 3)}s, approximate {round(approximateTime, 3)}s')
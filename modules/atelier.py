@@ -5,12 +5,18 @@ import textwrap
 import threading
 import time
 import traceback
-import tiktoken
 from colorama import Fore
 from dotenv import load_dotenv
 import openai
-from retry import retry
 from tqdm import tqdm
+from modules.cache import translationMemory
+from modules.extract import textUnits
+from modules.placeholders import compileVars, restoreVars, substituteVars
+from modules.normalize import normalizeText
+from modules.tokens import countStatic, countText
+from modules.calibration import calibrateEstimate
+from modules.ratelimit import requestCompletion
+from modules.writer import writeText
 
 # Open AI
 load_dotenv()
@@ -65,17 +71,16 @@ def handleAtelier(filename, estimate):
 
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='utf-8') as outFile:
-                start = time.time()
-                translatedData = openFiles(filename)
-                outFile.writelines(translatedData[0])
-
-                # Print Result
-                end = time.time()
-                tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    totalTokens[0] += translatedData[1][0]
-                    totalTokens[1] += translatedData[1][1]
+            start = time.time()
+            translatedData = openFiles(filename)
+            writeText('translated/' + filename, ''.join(translatedData[0]))
+
+            # Print Result
+            end = time.time()
+            tqdm.write(getResultString(translatedData, end - start, filename))
+            with LOCK:
+                totalTokens[0] += translatedData[1][0]
+                totalTokens[1] += translatedData[1][1]
         except Exception:
             return 'Fail'
 
@@ -170,126 +175,17 @@ def translateText(data, pbar):
         pbar.update()
     return [data, totalTokens]
         
+# Placeholders
+PLACEHOLDERS = compileVars('{}', r'[\\]+[\w]+\[.+?\]', ['Nested', 'Ascii', 'Color', 'N', 'Var', 'FCode'])
+
 def subVars(jaString):
-    jaString = jaString.replace('\u3000', ' ')
-
-    # Nested
-    count = 0
-    nestedList = re.findall(r'[\\]+[\w]+\[[\\]+[\w]+\[[0-9]+\]\]', jaString)
-    nestedList = set(nestedList)
-    if len(nestedList) != 0:
-        for icon in nestedList:
-            jaString = jaString.replace(icon, '{Nested_' + str(count) + '}')
-            count += 1
-
-    # Icons
-    count = 0
-    iconList = re.findall(r'[\\]+[iIkKwWaA]+\[[0-9]+\]', jaString)
-    iconList = set(iconList)
-    if len(iconList) != 0:
-        for icon in iconList:
-            jaString = jaString.replace(icon, '{Ascii_' + str(count) + '}')
-            count += 1
-
-    # Colors
-    count = 0
-    colorList = re.findall(r'[\\]+[cC]\[[0-9]+\]', jaString)
-    colorList = set(colorList)
-    if len(colorList) != 0:
-        for color in colorList:
-            jaString = jaString.replace(color, '{Color_' + str(count) + '}')
-            count += 1
-
-    # Names
-    count = 0
-    nameList = re.findall(r'[\\]+[nN]\[.+?\]+', jaString)
-    nameList = set(nameList)
-    if len(nameList) != 0:
-        for name in nameList:
-            jaString = jaString.replace(name, '{N_' + str(count) + '}')
-            count += 1
-
-    # Variables
-    count = 0
-    varList = re.findall(r'[\\]+[vV]\[[0-9]+\]', jaString)
-    varList = set(varList)
-    if len(varList) != 0:
-        for var in varList:
-            jaString = jaString.replace(var, '{Var_' + str(count) + '}')
-            count += 1
-
-    # Formatting
-    count = 0
-    if '笑えるよね.' in jaString:
-        print('t')
-    formatList = re.findall(r'[\\]+[\w]+\[.+?\]', jaString)
-    formatList = set(formatList)
-    if len(formatList) != 0:
-        for var in formatList:
-            jaString = jaString.replace(var, '{FCode_' + str(count) + '}')
-            count += 1
-
-    # Put all lists in list and return
-    allList = [nestedList, iconList, colorList, nameList, varList, formatList]
-    return [jaString, allList]
+    return substituteVars(jaString, PLACEHOLDERS)
 
 def resubVars(translatedText, allList):
-    # Fix Spacing and ChatGPT Nonsense
-    matchList = re.findall(r'\[\s?.+?\s?\]', translatedText)
-    if len(matchList) > 0:
-        for match in matchList:
-            text = match.strip()
-            translatedText = translatedText.replace(match, text)
-
-    # Nested
-    count = 0
-    if len(allList[0]) != 0:
-        for var in allList[0]:
-            translatedText = translatedText.replace('{Nested_' + str(count) + '}', var)
-            count += 1
-
-    # Icons
-    count = 0
-    if len(allList[1]) != 0:
-        for var in allList[1]:
-            translatedText = translatedText.replace('{Ascii_' + str(count) + '}', var)
-            count += 1
-
-    # Colors
-    count = 0
-    if len(allList[2]) != 0:
-        for var in allList[2]:
-            translatedText = translatedText.replace('{Color_' + str(count) + '}', var)
-            count += 1
-
-    # Names
-    count = 0
-    if len(allList[3]) != 0:
-        for var in allList[3]:
-            translatedText = translatedText.replace('{N_' + str(count) + '}', var)
-            count += 1
-
-    # Vars
-    count = 0
-    if len(allList[4]) != 0:
-        for var in allList[4]:
-            translatedText = translatedText.replace('{Var_' + str(count) + '}', var)
-            count += 1
-    
-    # Formatting
-    count = 0
-    if len(allList[5]) != 0:
-        for var in allList[5]:
-            translatedText = translatedText.replace('{FCode_' + str(count) + '}', var)
-            count += 1
-
-    # Remove Color Variables Spaces
-    # if '\\c' in translatedText:
-    #     translatedText = re.sub(r'\s*(\\+c\[[1-9]+\])\s*', r' \1', translatedText)
-    #     translatedText = re.sub(r'\s*(\\+c\[0+\])', r'\1', translatedText)
-    return translatedText
-
-@retry(exceptions=Exception, tries=5, delay=5)
+    return restoreVars(translatedText, allList, PLACEHOLDERS)
+
+@textUnits
+@translationMemory
 def translateGPT(t, history, fullPromptFlag):
     # Sub Vars
     varResponse = subVars(t)
@@ -301,7 +197,6 @@ def translateGPT(t, history, fullPromptFlag):
     
     # If ESTIMATE is True just count this as an execution and return.
     if ESTIMATE:
-        enc = tiktoken.encoding_for_model(MODEL)
         historyRaw = ''
         if isinstance(history, list):
             for line in history:
@@ -309,9 +204,9 @@ def translateGPT(t, history, fullPromptFlag):
         else:
             historyRaw = history
 
-        inputTotalTokens = len(enc.encode(historyRaw)) + len(enc.encode(PROMPT))
-        outputTotalTokens = len(enc.encode(t)) * 2   # Estimating 2x the size of the original text
-        totalTokens = [inputTotalTokens, outputTotalTokens]
+        inputTotalTokens = countText(MODEL, historyRaw) + countStatic(MODEL, PROMPT)
+        outputTotalTokens = countText(MODEL, t) * 2   # Estimating 2x the size of the original text
+        totalTokens = calibrateEstimate(MODEL, __name__, [inputTotalTokens, outputTotalTokens])
         return (t, totalTokens)
 
     # Characters
@@ -342,40 +237,29 @@ def translateGPT(t, history, fullPromptFlag):
         msg.append({"role": "user", "content": history})
     msg.append({"role": "user", "content": user})
 
-    response = openai.ChatCompletion.create(
+    # Rate Limit and Retry
+    response = requestCompletion(
+        lambda: [countText(MODEL, ''.join([m['content'] for m in msg])), countText(MODEL, t) * 2],
         temperature=0,
         frequency_penalty=0.2,
         presence_penalty=0.2,
         model=MODEL,
         messages=msg,
-        request_timeout=TIMEOUT,
     )
 
     # Save Translated Text
     translatedText = response.choices[0].message.content
     totalTokens = [response.usage.prompt_tokens, response.usage.completion_tokens]
 
+    # Refused, keep the original text
+    if translatedText == '':
+        return [t, totalTokens]
+
     # Resub Vars
     translatedText = resubVars(translatedText, varResponse[1])
 
     # Remove Placeholder Text
-    translatedText = translatedText.replace(LANGUAGE +' Translation: ', '')
-    translatedText = translatedText.replace('Translation: ', '')
-    translatedText = translatedText.replace('Line to Translate = ', '')
-    translatedText = translatedText.replace('Translation = ', '')
-    translatedText = translatedText.replace('Translate = ', '')
-    translatedText = translatedText.replace(LANGUAGE +' Translation:', '')
-    translatedText = translatedText.replace('Translation:', '')
-    translatedText = translatedText.replace('Line to Translate =', '')
-    translatedText = translatedText.replace('Translation =', '')
-    translatedText = translatedText.replace('Translate =', '')
-    translatedText = translatedText.replace('っ', '')
-    translatedText = translatedText.replace('ッ', '')
-    translatedText = translatedText.replace('ぁ', '')
-    translatedText = translatedText.replace('。', '.')
-    translatedText = translatedText.replace('、', ',')
-    translatedText = translatedText.replace('？', '?')
-    translatedText = translatedText.replace('！', '!')
+    translatedText = normalizeText(translatedText, 'atelier')
 
     # Return Translation
     if len(translatedText) > 15 * len(t) or "I'm sorry, but I'm unable to assist with that translation" in translatedText:
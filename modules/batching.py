@@ -0,0 +1,258 @@
+# Libraries
+import json, os, threading, time
+from collections import deque
+from pathlib import Path
+from dotenv import load_dotenv
+from tqdm import tqdm
+import modules.batchjob as batchjob
+from modules.cache import journalTranslations
+import modules.ratelimit as ratelimit
+from modules.shutdown import isStopping
+from modules.tokens import countList
+
+# Batch Helpers
+# Shared by every module's translateGPT. The module supplies the function that actually sends a batch,
+# these only decide what gets sent and how the results are put back together.
+load_dotenv()
+BATCHTOKENS = int(os.getenv('batchTokens', '2000') or 0)                # Input tokens per batch, 0 for no limit
+BATCHOUTPUTTOKENS = int(os.getenv('batchOutputTokens', '1500') or 0)    # Estimated output tokens per batch, 0 for no limit
+LINEOVERHEAD = 8    # Tokens added to each line by the <LineN> tags
+ADAPTIVE = os.getenv('adaptiveBatch', 'true').lower() not in ['false', '0', 'no', '']
+PROFILEFILE = os.getenv('batchProfile', 'cache/batchprofile.json')
+WINDOWSIZE = 20     # Batches kept per model
+MINSAMPLES = 5      # Batches needed before the size is changed
+MISMATCHTARGET = 0.1    # Shrink when more than this share of batches mismatch
+RETRYTARGET = 0.5       # Shrink when batches need more than this many extra requests on average
+CONCURRENTBATCHES = int(os.getenv('concurrentBatches', '1') or 1)    # Batches of one translateGPT call sent at once
+HISTORYLINES = 10   # Lines of history given to each batch
+LOCAL = threading.local()   # Set by dispatchTogether() and keepInstructions() for the thread they run on
+PROFILELOCK = threading.Lock()
+PROFILE = None
+WINDOWS = {}
+
+# Packs lines into batches that stay under the token budgets. maxLines is still a hard cap on the number of lines
+# so short choices don't end up in a 200 line batch. A line that is over the budget on its own gets its own batch.
+# Output is estimated the same way countTokens does it.
+def packBatches(inputList, maxLines, model):
+    batches = []
+    batch = []
+    inputTokens = 0
+    for line, tokens in zip(inputList, countList(model, inputList)):
+        tokens += LINEOVERHEAD
+        overInput = BATCHTOKENS > 0 and inputTokens + tokens > BATCHTOKENS
+        overOutput = BATCHOUTPUTTOKENS > 0 and (inputTokens + tokens) / 1.5 > BATCHOUTPUTTOKENS
+        if len(batch) > 0 and (len(batch) >= maxLines or overInput or overOutput):
+            batches.append(batch)
+            batch = []
+            inputTokens = 0
+        batch.append(line)
+        inputTokens += tokens
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+# Turns the (index, text) pairs pulled out of a response into {index: text}. Indexes outside the batch or
+# returned more than once can't be trusted so they are dropped and those lines count as missing.
+def indexTranslations(matchList, size):
+    translatedDict = {}
+    duplicates = set()
+    for index, text in matchList:
+        index = int(index)
+        if index >= size or index in duplicates:
+            continue
+        if index in translatedDict:
+            del translatedDict[index]
+            duplicates.add(index)
+            continue
+        translatedDict[index] = text
+    return translatedDict
+
+# Sends the batches of one translateGPT call. translateChunk(batch, history) returns [translatedList, tokens].
+# One at a time each batch gets the previous batch's translation as history. With concurrentBatches above 1
+# they are sent together and each one gets the source lines before it instead, results come back in order.
+def dispatchBatches(batches, history, translateChunk):
+    translateChunk = skipWhenStopping(addInstructions(translateChunk, getattr(LOCAL, 'instructions', [])))
+    limit = max(CONCURRENTBATCHES, getattr(LOCAL, 'limit', 1))
+    if limit <= 1 or len(batches) < 2:
+        responses = []
+        for batch in batches:
+            response = translateChunk(batch, history)
+            history = response[0][-HISTORYLINES:]
+            responses.append(response)
+        return responses
+
+    histories = [history] + [batch[-HISTORYLINES:] for batch in batches[:-1]]
+    return gatherBatches(list(zip(batches, histories)), translateChunk, limit)
+
+# Keeps up to limit batches out at once without a thread for each. The next batches are run up to their first request,
+# which is sent without waiting, then the batch at the front is run for real and picks up its response. Retries and
+# mismatch requests go out during that second run.
+def gatherBatches(calls, translateChunk, limit):
+    started = {}
+    responses = []
+    try:
+        for i, call in enumerate(calls):
+            for j in range(i, min(i + limit, len(calls))):
+                if j not in started:
+                    started[j] = ratelimit.prefetch(translateChunk, *calls[j])
+            key, response = started[i]
+            responses.append(translateChunk(*call) if key is not None else response)
+    finally:
+        ratelimit.dropPrefetched([key for key, response in started.values()])
+    return responses
+
+# Runs function(*args) with every translateGPT call in it sending up to limit batches at once, like concurrentBatches
+def dispatchTogether(limit, function, *args):
+    previous = getattr(LOCAL, 'limit', 1)
+    LOCAL.limit = limit
+    try:
+        return function(*args)
+    finally:
+        LOCAL.limit = previous
+
+# Runs function(*args) with instructions put ahead of the history of every batch its translateGPT calls send, so they
+# aren't lost when the history moves on to the previous batch's lines
+def keepInstructions(instructions, function, *args):
+    previous = getattr(LOCAL, 'instructions', [])
+    LOCAL.instructions = instructions
+    try:
+        return function(*args)
+    finally:
+        LOCAL.instructions = previous
+
+def addInstructions(translateChunk, instructions):
+    if len(instructions) == 0:
+        return translateChunk
+    def wrapper(batch, history):
+        return translateChunk(batch, instructions + list(history))
+    return wrapper
+
+# Batches that haven't gone out by the time the program is stopping come back untranslated
+def skipWhenStopping(translateChunk):
+    def wrapper(batch, history):
+        if isStopping():
+            return [list(batch), [0, 0]]
+        return translateChunk(batch, history)
+    return wrapper
+
+# Mismatch recovery. translateBatch(batch) returns [{index: translation}, tokens]. Lines that come back are kept,
+# the missing ones are split in half and sent again until they are down to single line requests.
+# Lines that still fail are returned as None. Pass the model to have the batch counted towards adaptive sizing,
+# and the prompt as well to have every request journaled as it comes back. Batch jobs answer without the API, their
+# timings say nothing about it and aren't counted.
+def bisectBatch(batch, translateBatch, model=None, prompt=None):
+    start = time.monotonic()
+    if model is not None and prompt is not None:
+        translateBatch = journalBatch(translateBatch, model, prompt)
+    translatedList, tokens, requests = bisect(batch, translateBatch)
+    if model is not None and tokens[1] > 0 and batchjob.MODE is None:
+        recordBatch(model, len(batch), requests, time.monotonic() - start, tokens[1])
+    return [translatedList, tokens]
+
+# Batch lines have no context in the translation memory, the same key is used here
+def journalBatch(translateBatch, model, prompt):
+    def wrapper(batch):
+        translatedDict, tokens = translateBatch(batch)
+        journalTranslations([(batch[i], line) for i, line in translatedDict.items()], '', model, prompt, tokens)
+        return [translatedDict, tokens]
+    return wrapper
+
+def bisect(batch, translateBatch):
+    translatedDict, tokens = translateBatch(batch)
+    translatedList = [translatedDict.get(i) for i in range(len(batch))]
+    missing = [i for i, line in enumerate(translatedList) if line is None]
+    if len(missing) == 0 or len(batch) == 1 or isStopping():
+        return [translatedList, tokens, 1]
+
+    # Retry Remainder
+    remainder = [batch[i] for i in missing]
+    if len(remainder) == 1:
+        halves = [remainder]
+    else:
+        halves = [remainder[:len(remainder) // 2], remainder[len(remainder) // 2:]]
+    tqdm.write(f'Mismatch: {len(missing)} of {len(batch)} lines missing, retrying in {len(halves)} part(s)')
+
+    retriedList = []
+    requests = 1
+    for half in halves:
+        response = bisect(half, translateBatch)
+        retriedList.extend(response[0])
+        tokens = [tokens[0] + response[1][0], tokens[1] + response[1][1]]
+        requests += response[2]
+    for i, line in zip(missing, retriedList):
+        translatedList[i] = line
+    return [translatedList, tokens, requests]
+
+# Adaptive Batch Size
+# Each model keeps a sliding window of its recent batches. When too many of them mismatch or need retries
+# the batch size is cut, when they come back clean and the time per output token isn't getting worse it grows.
+# The size stays between a quarter and twice the module's BATCHSIZE and is saved to the profile file between runs.
+def getBatchSize(model, maxSize):
+    if not ADAPTIVE:
+        return maxSize
+    with PROFILELOCK:
+        profile = getProfile()
+        if model not in profile:
+            profile[model] = {'size': maxSize, 'latency': None}
+        entry = profile[model]
+        entry['bounds'] = getBounds(maxSize)
+        entry['size'] = max(entry['bounds'][0], min(entry['bounds'][1], entry['size']))
+        return entry['size']
+
+def getBounds(maxSize):
+    return [max(1, maxSize // 4), maxSize * 2]
+
+def recordBatch(model, size, requests, seconds, outputTokens):
+    if not ADAPTIVE:
+        return
+    with PROFILELOCK:
+        entry = getProfile().get(model)
+        if entry is None or 'bounds' not in entry:
+            return
+        window = WINDOWS.setdefault(model, deque(maxlen=WINDOWSIZE))
+        window.append({'size': size, 'retries': requests - 1, 'latency': seconds / outputTokens})
+        if len(window) < MINSAMPLES:
+            return
+
+        # Mismatch rate, retries and latency over the window
+        mismatchRate = sum(1 for r in window if r['retries'] > 0) / len(window)
+        retries = sum(r['retries'] for r in window) / len(window)
+        latency = sum(r['latency'] for r in window) / len(window)
+        full = sum(1 for r in window if r['size'] >= entry['size']) / len(window)
+        best = entry.get('latency') or latency
+        low, high = entry['bounds']
+
+        # Shrink
+        if mismatchRate > MISMATCHTARGET or retries > RETRYTARGET:
+            newSize = max(low, int(entry['size'] * 0.75))
+        # Grow, only when batches are actually hitting the current size
+        elif mismatchRate == 0 and full >= 0.5 and latency <= best * 1.25:
+            newSize = min(high, entry['size'] + max(1, entry['size'] // 10))
+        else:
+            newSize = entry['size']
+        entry['latency'] = min(best, latency)
+
+        if newSize != entry['size']:
+            tqdm.write(f'Batch size for {model}: {entry["size"]} -> {newSize} '
+                       f'(mismatch {round(mismatchRate * 100)}%, {round(latency * 1000, 1)}ms/token)')
+            entry['size'] = newSize
+            window.clear()
+            saveProfile()
+
+def getProfile():
+    global PROFILE
+    if PROFILE is None:
+        try:
+            with open(PROFILEFILE, 'r', encoding='utf-8') as f:
+                PROFILE = json.load(f)
+        except (OSError, ValueError):
+            PROFILE = {}
+    return PROFILE
+
+def saveProfile():
+    Path(PROFILEFILE).parent.mkdir(parents=True, exist_ok=True)
+    profile = {model: {'size': e['size'], 'latency': e.get('latency')} for model, e in PROFILE.items()}
+    tmpFile = f'{PROFILEFILE}.tmp'
+    with open(tmpFile, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=4)
+    os.replace(tmpFile, PROFILEFILE)
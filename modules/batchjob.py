@@ -0,0 +1,149 @@
+# Libraries
+import hashlib, importlib, json, os, threading
+from pathlib import Path
+from dotenv import load_dotenv
+from openai.types.chat import ChatCompletion
+import modules.batching as batching
+import modules.cache as cache
+import modules.coalesce as coalesce
+import modules.extract as extract
+import modules.journal as journal
+from modules.client import createResponse
+from modules.writer import flushWrites
+
+# Batch Jobs
+# Export runs the parser and, instead of sending, writes every request it would have made to a JSONL file in the
+# OpenAI Batch API format. Import runs it again and answers each request from the batch output files, so the
+# responses go through the module's normal cleanup, extraction and second pass and the files are written to
+# /translated. Requests are matched on a custom_id made from the model, the prompt and the text being translated.
+# History is left out of it since it holds translations, which export doesn't have yet.
+# Export answers every request with its own text so nothing is retried and nothing is stored in the translation
+# memory. Import holds new memory entries back until every file is done so both runs see the same memory, and
+# requests without a result come back empty like a refusal, which keeps the original text. Those requests (like the
+# smaller ones a mismatched batch is split into, which export never saw) are written to a follow-up file to submit.
+load_dotenv()
+REQUESTFILE = os.getenv('batchRequests', 'batch/requests.jsonl')
+RESULTFOLDER = os.getenv('batchResults', 'batch/results')     # Every .jsonl file in it is read
+FOLLOWUPFILE = os.getenv('batchFollowUp', 'batch/followup.jsonl')     # Requests import had no result for
+LOCK = threading.Lock()
+MODE = None         # None, 'export' or 'import'
+RESULTS = {}        # custom_id -> completion body
+REQUESTS = {}       # custom_id -> request line, for the file being parsed. Only unanswered ones when importing.
+COUNTS = [0, 0]     # Requests answered from the results, requests without one
+
+def getCustomId(kwargs):
+    messages = kwargs['messages']
+    raw = json.dumps([kwargs['model'], messages[0]['content'], messages[-1]['content']], ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+# Called by requestCompletion in place of the API. kwargs are the chat completion arguments.
+def getBatchResponse(kwargs):
+    customId = getCustomId(kwargs)
+    with LOCK:
+        body = RESULTS.get(customId) if MODE == 'import' else None
+        if body is None:
+            REQUESTS.setdefault(customId, {
+                'custom_id': customId, 'method': 'POST', 'url': '/v1/chat/completions', 'body': kwargs,
+            })
+        if MODE == 'export':
+            return createResponse(kwargs['model'], kwargs['messages'][-1]['content'])
+        COUNTS[0 if body is not None else 1] += 1
+    if body is None:
+        return createResponse(kwargs['model'], '')
+    return ChatCompletion(**body)
+
+# Batch output lines are {"custom_id": ..., "response": {"status_code": 200, "body": {...}}, "error": null}
+def readResults(folder):
+    results = {}
+    for path in sorted(Path(folder).glob('*.jsonl')):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip() == '':
+                    continue
+                result = json.loads(line)
+                response = result.get('response') or {}
+                if result.get('error') is None and response.get('status_code') == 200:
+                    results[result['custom_id']] = response['body']
+    return results
+
+# Worker Process
+# Anything that depends on timing or on earlier results (coalescing, adaptive batch sizes) would change what is
+# sent between the two runs, so it is turned off. The engines were imported along with start.py before this runs,
+# so the modules are changed instead of .env.
+def initWorker(mode):
+    global MODE
+    MODE = mode
+    coalesce.COALESCE = False
+    coalesce.COALESCESTRINGS = False
+    batching.ADAPTIVE = False
+    cache.HELD = []
+    journal.JOURNAL = False     # Nothing here is paid for
+    if mode == 'import':
+        RESULTS.update(readResults(RESULTFOLDER))
+
+def runFile(moduleName, handleName, filename):
+    handle = getattr(importlib.import_module(moduleName), handleName)
+    with LOCK:
+        REQUESTS.clear()
+        COUNTS[0] = COUNTS[1] = 0
+    handle(filename, False)
+    flushWrites()
+    with cache.LOCK:
+        held = list(cache.HELD)
+        cache.HELD.clear()
+    with LOCK:
+        return [list(REQUESTS.values()), list(COUNTS), held]
+
+# Writes the requests once each, returns how many were written
+def writeRequests(path, requests):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmpFile = f'{path}.tmp'
+    written = set()
+    with open(tmpFile, 'w', encoding='utf-8') as outFile:
+        for request in requests:
+            if request['custom_id'] not in written:
+                written.add(request['custom_id'])
+                outFile.write(json.dumps(request, ensure_ascii=False) + '\n')
+    os.replace(tmpFile, path)
+    return len(written)
+
+# handle is the engine's handle function, filenames are in /files. Returns a summary string.
+def runExport(handle, filenames):
+    Path(RESULTFOLDER).mkdir(parents=True, exist_ok=True)
+    requests = []
+    failed = []
+    for filename, result, error in extract.runFiles(handle, filenames, 'export', initWorker, runFile):
+        if error is not None:
+            failed.append(f'{filename} ({error})')
+            continue
+        requests.extend(result[0])
+    total = writeRequests(REQUESTFILE, requests)
+    return extract.getSummary(f'Wrote {total} requests to {REQUESTFILE}. Submit it as a batch for '
+                      f'/v1/chat/completions, put the output file in {RESULTFOLDER} and run Batch Import', failed)
+
+def runImport(handle, filenames):
+    if not any(Path(RESULTFOLDER).glob('*.jsonl')):
+        return f'No batch output found, put the .jsonl output file of the batch in {RESULTFOLDER}'
+    counts = [0, 0]
+    requests = []
+    held = []
+    failed = []
+    for filename, result, error in extract.runFiles(handle, filenames, 'import', initWorker, runFile):
+        if error is not None:
+            failed.append(f'{filename} ({error})')
+            continue
+        requests.extend(result[0])
+        counts = [counts[0] + result[1][0], counts[1] + result[1][1]]
+        held.extend(result[2])
+    cache.storeRows(held)
+    summary = f'Applied {counts[0]} batch responses to {len(filenames) - len(failed)} files in /translated'
+
+    # Unanswered requests go in a follow-up batch, an old one is removed once everything has a response
+    if len(requests) > 0:
+        total = writeRequests(FOLLOWUPFILE, requests)
+        summary += f', {counts[1]} requests had no response and kept the original text. Submit the {total} ' \
+            f'requests in {FOLLOWUPFILE} as a batch, put its output file in {RESULTFOLDER} with the others and run ' \
+            'Batch Import again'
+    else:
+        Path(FOLLOWUPFILE).unlink(missing_ok=True)
+    return extract.getSummary(summary, failed)
@@ -0,0 +1,129 @@
+# Libraries
+import functools, hashlib, inspect, os, sqlite3, threading
+from pathlib import Path
+from dotenv import load_dotenv
+from modules.journal import JOURNAL, getJournaled, writeRecord
+
+# Translation Memory
+# Every line that comes back from the API is stored on disk so the same text is never paid for twice.
+# Entries are keyed on the source text, the context it was sent with, the model and the system prompt.
+# Editing prompt.txt, vocab.txt or the characters list changes the key so old translations won't leak through.
+load_dotenv()
+CACHE = os.getenv('cache', 'true').lower() not in ['false', '0', 'no', '']
+CACHEFILE = os.getenv('cacheFile', 'cache/translations.db')
+LOCK = threading.Lock()
+CONNECTION = None
+PROMPTHASHES = {}
+HELD = None     # While this is a list new entries go into it instead of the database, see batchjob
+
+def getConnection():
+    global CONNECTION
+    if CONNECTION is None:
+        Path(CACHEFILE).parent.mkdir(parents=True, exist_ok=True)
+        CONNECTION = sqlite3.connect(CACHEFILE, check_same_thread=False, isolation_level=None)
+        CONNECTION.execute('PRAGMA journal_mode=WAL')
+        CONNECTION.execute('PRAGMA synchronous=NORMAL')
+        CONNECTION.execute('CREATE TABLE IF NOT EXISTS memory (key TEXT PRIMARY KEY, model TEXT, source TEXT, translation TEXT)')
+    return CONNECTION
+
+def normalizeText(text):
+    return text.replace('　', ' ').strip()
+
+def getPromptHash(prompt):
+    if prompt not in PROMPTHASHES:
+        PROMPTHASHES[prompt] = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return PROMPTHASHES[prompt]
+
+def getKey(text, context, model, prompt):
+    raw = '\x00'.join([model, getPromptHash(prompt), context, normalizeText(text)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+# Lines from an interrupted run come from the journal
+def getTranslation(text, context, model, prompt):
+    key = getKey(text, context, model, prompt)
+    journaled = getJournaled(key)
+    if journaled is not None or not CACHE:
+        return journaled
+    with LOCK:
+        row = getConnection().execute('SELECT translation FROM memory WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+def setTranslations(entries, context, model, prompt):
+    rows = [(getKey(text, context, model, prompt), model, text, translation) for text, translation in entries]
+    with LOCK:
+        if HELD is not None:
+            HELD.extend(rows)
+            return
+    storeRows(rows)
+
+def storeRows(rows):
+    if len(rows) == 0 or not CACHE:
+        return
+    with LOCK:
+        connection = getConnection()
+        connection.execute('BEGIN')
+        connection.executemany('INSERT OR REPLACE INTO memory VALUES (?, ?, ?, ?)', rows)
+        connection.execute('COMMIT')
+
+# Journals the lines of one request as soon as it comes back, tokens are what the request cost
+def journalTranslations(entries, context, model, prompt, tokens):
+    writeRecord([[getKey(text, context, model, prompt), text, translation] for text, translation in entries
+                 if translation != text and hasJapanese(text)], tokens)
+
+def getPrompt(moduleGlobals, fullPromptFlag):
+    # Modules with createContext build their system prompt from it, older ones use PROMPT directly.
+    if 'createContext' in moduleGlobals:
+        characters, system, user = moduleGlobals['createContext'](fullPromptFlag, '')
+        return system + characters
+    return moduleGlobals.get('PROMPT', '') if fullPromptFlag else ''
+
+def hasJapanese(text):
+    return any('぀' <= c <= 'ヿ' or '一' <= c <= '鿿' or '＀' <= c <= '￯' for c in text)
+
+# Wraps a module's translateGPT(text, history, fullPromptFlag). Cached lines are filled in locally
+# and only the remaining lines are passed on to the API.
+def translationMemory(translateGPT):
+    @functools.wraps(translateGPT)
+    def wrapper(text, history, fullPromptFlag):
+        moduleGlobals = inspect.unwrap(translateGPT).__globals__
+        if not (CACHE or JOURNAL) or text == [] or text == '':
+            return translateGPT(text, history, fullPromptFlag)
+
+        # Lists carry rolling history which changes every batch, only a string is a real context
+        model = moduleGlobals['MODEL']
+        prompt = getPrompt(moduleGlobals, fullPromptFlag)
+        context = history if isinstance(history, str) else ''
+        estimate = moduleGlobals.get('ESTIMATE')
+
+        # Single String
+        if not isinstance(text, list):
+            cached = getTranslation(text, context, model, prompt)
+            if cached is not None:
+                return [cached, [0, 0]]
+            response = translateGPT(text, history, fullPromptFlag)
+            translatedText = response[0]
+            if not estimate and translatedText != text and hasJapanese(text):
+                journalTranslations([(text, translatedText)], context, model, prompt, response[1])
+                setTranslations([(text, translatedText)], context, model, prompt)
+            return response
+
+        # List
+        cachedList = [getTranslation(t, context, model, prompt) for t in text]
+        missList = [t for t, cached in zip(text, cachedList) if cached is None]
+        if len(missList) == 0:
+            return [cachedList, [0, 0]]
+        response = translateGPT(missList, history, fullPromptFlag)
+        translatedList = response[0]
+
+        # Mismatch, hand back the raw response so the caller can see the length is wrong
+        if len(translatedList) != len(missList):
+            return response
+
+        # Store and merge
+        if not estimate:
+            setTranslations([(t, tl) for t, tl in zip(missList, translatedList) if tl != t and hasJapanese(t)],
+                            context, model, prompt)
+        translatedIter = iter(translatedList)
+        finalList = [cached if cached is not None else next(translatedIter) for cached in cachedList]
+        return [finalList, response[1]]
+    return wrapper
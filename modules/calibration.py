@@ -0,0 +1,89 @@
+# Libraries
+import atexit, json, os, threading
+from pathlib import Path
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+# Estimate Calibration
+# Every real request records the token estimate made for it next to the usage the API reported, summed per model
+# and engine. Estimates are then scaled by actual / estimated from those sums, per engine once it has enough
+# requests and otherwise over every engine used with the model. Below that the raw estimate is used.
+load_dotenv()
+CALIBRATE = os.getenv('calibrateEstimates', 'true').lower() not in ['false', '0', 'no', '']
+STATSFILE = os.getenv('usageStats', 'cache/usagestats.json')
+MINREQUESTS = 20    # Requests needed before the ratios are used
+SAVEEVERY = 50      # Requests between saves, also saved on exit
+LOCK = threading.Lock()
+STATS = None
+UNSAVED = 0
+ANNOUNCED = set()
+
+def getStats():
+    global STATS
+    if STATS is None:
+        try:
+            with open(STATSFILE, 'r', encoding='utf-8') as f:
+                STATS = json.load(f)
+        except (OSError, ValueError):
+            STATS = {}
+    return STATS
+
+def getEngine(name):
+    return name.rsplit('.', 1)[-1]
+
+# estimate is [inputTokens, outputTokens] from countTokens, usage is response.usage
+def recordUsage(model, engine, estimate, usage):
+    global UNSAVED
+    if usage is None or len(estimate) < 2:
+        return
+    with LOCK:
+        entry = getStats().setdefault(model, {}).setdefault(getEngine(engine), {
+            'requests': 0, 'estimatedInput': 0, 'estimatedOutput': 0, 'promptTokens': 0, 'completionTokens': 0,
+        })
+        entry['requests'] += 1
+        entry['estimatedInput'] += estimate[0]
+        entry['estimatedOutput'] += estimate[1]
+        entry['promptTokens'] += usage.prompt_tokens
+        entry['completionTokens'] += usage.completion_tokens
+        UNSAVED += 1
+        if UNSAVED >= SAVEEVERY:
+            saveStats()
+
+# Returns [inputRatio, outputRatio], [1, 1] until there is enough history
+def getRatios(model, engine):
+    if not CALIBRATE:
+        return [1, 1]
+    with LOCK:
+        engines = getStats().get(model, {})
+        entry = engines.get(getEngine(engine))
+        if entry is None or entry['requests'] < MINREQUESTS:
+            entry = {key: sum(e[key] for e in engines.values()) for key in
+                     ['requests', 'estimatedInput', 'estimatedOutput', 'promptTokens', 'completionTokens']}
+        if entry['requests'] < MINREQUESTS or entry['estimatedInput'] == 0 or entry['estimatedOutput'] == 0:
+            return [1, 1]
+        ratios = [entry['promptTokens'] / entry['estimatedInput'], entry['completionTokens'] / entry['estimatedOutput']]
+        if (model, engine) not in ANNOUNCED:
+            ANNOUNCED.add((model, engine))
+            tqdm.write(f'Estimates for {model} calibrated from {entry["requests"]} requests '
+                       f'(input x{round(ratios[0], 2)}, output x{round(ratios[1], 2)})')
+        return ratios
+
+def calibrateEstimate(model, engine, estimate):
+    ratios = getRatios(model, engine)
+    return [round(estimate[0] * ratios[0]), round(estimate[1] * ratios[1])]
+
+# Must hold LOCK
+def saveStats():
+    global UNSAVED
+    UNSAVED = 0
+    Path(STATSFILE).parent.mkdir(parents=True, exist_ok=True)
+    tmpFile = f'{STATSFILE}.tmp'
+    with open(tmpFile, 'w', encoding='utf-8') as f:
+        json.dump(STATS, f, indent=4)
+    os.replace(tmpFile, STATSFILE)
+
+@atexit.register
+def flushStats():
+    with LOCK:
+        if UNSAVED > 0:
+            saveStats()
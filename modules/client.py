@@ -0,0 +1,65 @@
+# Libraries
+import asyncio, os, threading, time
+import httpx
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+from dotenv import load_dotenv
+from modules.shutdown import waitFor
+
+# Async Client
+# Every module sends its requests through one AsyncOpenAI client running on a single background event loop.
+# Connections are kept alive and pooled, and an in-flight cap limits how many requests are out at once.
+# Most requests are still waited on through createCompletion() by the thread that made them. Batches sent together
+# (concurrentBatches, coalesced pages) go out through submitCompletion() from one thread and are gathered afterwards.
+load_dotenv()
+TIMEOUT = int(os.getenv('timeout'))
+MAXREQUESTS = int(os.getenv('maxRequests', '50') or 50)    # Requests in flight at once across the whole process
+LOCK = threading.Lock()
+LOOP = None
+CLIENT = None
+SEMAPHORE = None
+
+def getLoop():
+    global LOOP, CLIENT, SEMAPHORE
+    with LOCK:
+        if LOOP is None:
+            LOOP = asyncio.new_event_loop()
+            threading.Thread(target=LOOP.run_forever, name='AsyncClient', daemon=True).start()
+
+            # Client
+            api = os.getenv('api', '').replace(' ', '')
+            limits = httpx.Limits(max_connections=MAXREQUESTS, max_keepalive_connections=MAXREQUESTS)
+            CLIENT = AsyncOpenAI(
+                api_key=os.getenv('key'),
+                organization=os.getenv('org'),
+                base_url=api if api != '' else None,
+                timeout=TIMEOUT,
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=limits, timeout=TIMEOUT),
+            )
+            SEMAPHORE = asyncio.run_coroutine_threadsafe(createSemaphore(), LOOP).result()
+    return LOOP
+
+async def createSemaphore():
+    return asyncio.Semaphore(MAXREQUESTS)
+
+async def sendCompletion(kwargs):
+    async with SEMAPHORE:
+        return await CLIENT.chat.completions.create(**kwargs)
+
+# Returns a concurrent.futures.Future that resolves to the ChatCompletion
+def submitCompletion(**kwargs):
+    loop = getLoop()
+    return asyncio.run_coroutine_threadsafe(sendCompletion(kwargs), loop)
+
+# Blocking version for code that wants the response right away. None if it was given up on while shutting down.
+def createCompletion(**kwargs):
+    return waitFor(submitCompletion(**kwargs))
+
+# A completion that was never sent, for answering a request locally
+def createResponse(model, content):
+    return ChatCompletion(**{
+        'id': 'local', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+    })
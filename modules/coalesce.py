@@ -0,0 +1,181 @@
+# Libraries
+import functools, os, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dotenv import load_dotenv
+import modules.batching as batching
+from modules.cache import hasJapanese
+
+# Page Coalescing
+# Small pages each cost a full request with the whole prompt attached. Instead of translating every page on its own
+# the dialogue of many pages, from every file being translated at the time, is collected and sent as one list.
+# translateGPT packs that list into full batches and each page gets its own lines back. The pages have nothing to do
+# with each other so the batches don't wait on each other's translations, up to threads of them are out at once.
+load_dotenv()
+COALESCE = os.getenv('coalescePages', 'true').lower() not in ['false', '0', 'no', '']
+WINDOW = float(os.getenv('coalesceWindow', '0.25') or 0)     # Seconds to wait for other pages before sending
+MAXLINES = 400      # Send right away once this many lines are waiting
+THREADS = int(os.getenv('threads', '1') or 1)     # Batches of a coalesced list sent at once
+LOCK = threading.Lock()
+PENDING = {}        # translateGPT -> [[lines, history, future], ...]
+TIMERS = {}
+EXECUTOR = ThreadPoolExecutor(thread_name_prefix='Coalesce')
+
+# String Coalescing
+# Names, notes, terms and choices are sent one string at a time with a short instruction instead of the full prompt.
+# Strings that arrive close together are held for a moment and sent as one list per instruction,
+# with the instruction attached to every batch of it. Each caller still gets back its own [translation, tokens].
+COALESCESTRINGS = os.getenv('coalesceStrings', 'true').lower() not in ['false', '0', 'no', '']
+QUIET = 0.02        # Send once no new string has come in for this long
+MAXWAIT = 0.2       # Never hold a string longer than this
+MAXSTRINGS = 50     # Send right away once this many strings are waiting
+STRINGS = {}        # translateGPT -> [[text, history, future], ...]
+STRINGTIMES = {}    # translateGPT -> [first, last] arrival
+STRINGEXECUTOR = ThreadPoolExecutor(max_workers=MAXSTRINGS, thread_name_prefix='String')
+
+# Queues the docLists of several pages, returns a future for each page that resolves to [translatedList, tokens].
+def submitPages(translateGPT, pages):
+    futures = []
+    with LOCK:
+        queue = PENDING.setdefault(translateGPT, [])
+        for lines, history in pages:
+            future = Future()
+            queue.append([lines, history, future])
+            futures.append(future)
+
+        # Flush when full, otherwise give other files a moment to add their pages
+        if sum(len(item[0]) for item in queue) >= MAXLINES:
+            flush(translateGPT)
+        elif translateGPT not in TIMERS:
+            timer = threading.Timer(WINDOW, flushLater, [translateGPT])
+            timer.daemon = True
+            TIMERS[translateGPT] = timer
+            timer.start()
+    return futures
+
+def flushLater(translateGPT):
+    with LOCK:
+        flush(translateGPT)
+
+# Must hold LOCK
+def flush(translateGPT):
+    timer = TIMERS.pop(translateGPT, None)
+    if timer is not None:
+        timer.cancel()
+    queue = PENDING.pop(translateGPT, [])
+
+    # Lists of up to MAXLINES lines, a page bigger than that goes on its own
+    groups = []
+    size = MAXLINES
+    for item in queue:
+        if size + len(item[0]) > MAXLINES:
+            groups.append([])
+            size = 0
+        groups[-1].append(item)
+        size += len(item[0])
+    if len(groups) > 0:
+        EXECUTOR.submit(sendGroups, translateGPT, groups)
+
+# One list after another, each sends up to threads batches at once
+def sendGroups(translateGPT, groups):
+    for queue in groups:
+        sendPages(translateGPT, queue)
+
+def sendPages(translateGPT, queue):
+    lines = [line for item in queue for line in item[0]]
+    try:
+        response = batching.dispatchTogether(THREADS, translateGPT, lines, queue[0][1], True)
+    except Exception as e:
+        for item in queue:
+            item[2].set_exception(e)
+        return
+
+    # Split the results back up, tokens are shared out by line count
+    translatedList = response[0]
+    start = 0
+    for item in queue:
+        size = len(item[0])
+        tokens = [round(response[1][0] * size / len(lines)), round(response[1][1] * size / len(lines))]
+        if len(translatedList) != len(lines):
+            item[2].set_result([[], tokens])
+        else:
+            item[2].set_result([translatedList[start:start + size], tokens])
+        start += size
+
+# Blocking version for a single group of pages.
+def translatePages(translateGPT, pages):
+    return [future.result() for future in submitPages(translateGPT, pages)]
+
+# Wraps a module's translateGPT(text, history, fullPromptFlag). Only single strings with an instruction
+# and without the full prompt are held back, everything else goes straight through.
+def coalesceStrings(translateGPT):
+    @functools.wraps(translateGPT)
+    def wrapper(text, history, fullPromptFlag):
+        if not COALESCESTRINGS or fullPromptFlag or not isinstance(text, str) or not isinstance(history, str) \
+                or not hasJapanese(text):
+            return translateGPT(text, history, fullPromptFlag)
+
+        future = Future()
+        with LOCK:
+            queue = STRINGS.setdefault(translateGPT, [])
+            queue.append([text, history, future])
+            now = time.monotonic()
+            if translateGPT in STRINGTIMES:
+                STRINGTIMES[translateGPT][1] = now
+            else:
+                STRINGTIMES[translateGPT] = [now, now]
+                threading.Thread(target=watchStrings, args=[translateGPT], daemon=True).start()
+            if len(queue) >= MAXSTRINGS:
+                flushStrings(translateGPT)
+        return future.result()
+    return wrapper
+
+# Sends the waiting strings once they go quiet or have waited long enough
+def watchStrings(translateGPT):
+    while True:
+        time.sleep(QUIET)
+        with LOCK:
+            if translateGPT not in STRINGTIMES:
+                return
+            first, last = STRINGTIMES[translateGPT]
+            now = time.monotonic()
+            if now - last >= QUIET or now - first >= MAXWAIT:
+                flushStrings(translateGPT)
+                return
+
+# Must hold LOCK
+def flushStrings(translateGPT):
+    STRINGTIMES.pop(translateGPT, None)
+    queue = STRINGS.pop(translateGPT, [])
+
+    # One request per instruction
+    groups = {}
+    for item in queue:
+        groups.setdefault(item[1], []).append(item)
+    for history, group in groups.items():
+        EXECUTOR.submit(sendStrings, translateGPT, history, group)
+
+def sendStrings(translateGPT, history, group):
+    try:
+        # Nothing to gain from a list of one
+        if len(group) == 1:
+            group[0][2].set_result(translateGPT(group[0][0], history, False))
+            return
+        response = batching.keepInstructions([f'Instructions for every line: {history}'], translateGPT,
+                                             [item[0] for item in group], [], True)
+    except Exception as e:
+        for item in group:
+            item[2].set_exception(e)
+        return
+
+    # Tokens are shared out evenly, a list that came back the wrong length is sent again one string at a time
+    tokens = [round(response[1][0] / len(group)), round(response[1][1] / len(group))]
+    if len(response[0]) != len(group):
+        for item in group:
+            EXECUTOR.submit(sendStrings, translateGPT, history, [item])
+        return
+    for item, translatedText in zip(group, response[0]):
+        item[2].set_result([translatedText, tokens])
+
+# Runs translateGPT on another thread so a loop can send all its strings before waiting on any of them.
+def submitString(translateGPT, text, history):
+    return STRINGEXECUTOR.submit(translateGPT, text, history, False)
@@ -0,0 +1,193 @@
+# Libraries
+import functools, hashlib, importlib, json, multiprocessing, os, re, threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from dotenv import load_dotenv
+from tqdm import tqdm
+import modules.batching as batching
+import modules.coalesce as coalesce
+from modules.cache import hasJapanese
+from modules.writer import flushWrites
+
+# Extraction and Injection
+# Runs an engine's parser over every file without sending anything. The parser is left as it is, translateGPT is
+# wrapped so when extracting it records what it was given and hands the source text back, and when injecting it hands
+# back the translation for each unit from a JSONL file instead. Injecting is a normal run otherwise, so speakers,
+# nametags, wrapping and codes are handled by the parser's second pass and the files are written to /translated.
+# Each file runs in its own process, one at a time per process, so every unit can be tied to the file being parsed.
+# The workers parse on one thread with coalescing off so units come out in the same order every run. Parsers that call
+# setLocation() as they go (RPG Maker: event/page/code index) give every unit the place in the file it came from.
+load_dotenv()
+EXTRACTFILE = os.getenv('extractFile', 'extract/units.jsonl')
+INJECTFILE = os.getenv('injectFile', 'extract/translations.jsonl')
+SPEAKER = re.compile(r'([^:\n]{1,30}): (.+)', re.DOTALL)   # Dialogue sent as 'Speaker: Line'
+LOCK = threading.Lock()
+MODE = None         # None, 'extract' or 'inject'
+FILENAME = None
+LOCATION = threading.local()
+UNITS = []
+SEEN = {}
+TRANSLATIONS = {}   # id -> translation when injecting
+INJECTED = [0, 0]   # Units translated, units left as they were
+
+# Where the parser is in the file, for units sent from this thread. Does nothing outside of extracting and injecting.
+def setLocation(*parts):
+    if MODE is not None:
+        LOCATION.value = joinLocation(parts)
+        LOCATION.lines = None
+
+# For a list of lines gathered from different places, one index for each line under the same prefix
+def setLineLocations(prefix, indexes):
+    if MODE is not None:
+        LOCATION.lines = [joinLocation([prefix, index]) for index in indexes]
+
+def joinLocation(parts):
+    return '/'.join(str(part) for part in parts if part != '')
+
+def getLocation(index, count):
+    lines = getattr(LOCATION, 'lines', None)
+    if lines is not None and len(lines) == count:
+        return lines[index]
+    return getattr(LOCATION, 'value', '')
+
+# Unit ids are stable across runs, they come from the file, the location, the text and how many times that text came
+# before it there
+def getUnitId(filename, location, text):
+    occurrence = SEEN.get((location, text), 0)
+    SEEN[(location, text)] = occurrence + 1
+    return hashlib.sha1(f'{filename}\0{location}\0{text}\0{occurrence}'.encode('utf-8')).hexdigest()[:16]
+
+def addUnit(text, location, history, dialogue):
+    speaker = ''
+    source = text
+    match = SPEAKER.fullmatch(text) if dialogue else None
+    if match:
+        speaker, source = match.groups()
+    UNITS.append({
+        'id': getUnitId(FILENAME, location, text),
+        'file': FILENAME,
+        'location': location,
+        'kind': 'dialogue' if dialogue else 'string',
+        'speaker': speaker,
+        'text': text,
+        'source': source,
+        'context': history[-batching.HISTORYLINES:] if isinstance(history, list) else history,     # As much as a batch gets
+    })
+
+# The translation replaces 'text', so dialogue keeps its 'Speaker: ' for the parser to split off again
+def getInjection(text, location):
+    translation = TRANSLATIONS.get(getUnitId(FILENAME, location, text))
+    if translation is None:
+        INJECTED[1] += 1
+        return text
+    INJECTED[0] += 1
+    return translation
+
+# Goes on top of a module's translateGPT(text, history, fullPromptFlag), does nothing outside of these modes
+def textUnits(translateGPT):
+    @functools.wraps(translateGPT)
+    def wrapper(text, history, fullPromptFlag):
+        if MODE is None:
+            return translateGPT(text, history, fullPromptFlag)
+        resultList = []
+        lines = text if isinstance(text, list) else [text]
+        with LOCK:
+            for i, line in enumerate(lines):
+                if not isinstance(line, str) or not hasJapanese(line):
+                    resultList.append(line)
+                elif MODE == 'extract':
+                    addUnit(line, getLocation(i, len(lines)), history, isinstance(text, list) and fullPromptFlag)
+                    resultList.append(line)
+                else:
+                    resultList.append(getInjection(line, getLocation(i, len(lines))))
+        return [resultList if isinstance(text, list) else resultList[0], [0, 0]]
+    return wrapper
+
+# Lines are {"id": ..., "translation": ...}, anything else on the line (like the rest of an extracted unit) is ignored
+def readTranslations(path):
+    translations = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            unit = json.loads(line)
+            if unit.get('translation') is not None:
+                translations[unit['id']] = unit['translation']
+    return translations
+
+# Worker Process
+def initWorker(mode):
+    global MODE
+    MODE = mode
+    # The engines were imported along with start.py before this runs, so the modules are changed instead of .env
+    coalesce.COALESCE = False
+    coalesce.COALESCESTRINGS = False
+    coalesce.STRINGEXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='String')
+    if mode == 'inject':
+        TRANSLATIONS.update(readTranslations(INJECTFILE))
+
+def runFile(moduleName, handleName, filename):
+    global FILENAME
+    module = importlib.import_module(moduleName)
+    handle = getattr(module, handleName)
+    if hasattr(module, 'THREADS'):
+        module.THREADS = 1
+    setLocation()
+    with LOCK:
+        FILENAME = filename
+        UNITS.clear()
+        SEEN.clear()
+        INJECTED[0] = INJECTED[1] = 0
+
+    # Extracting runs like an estimate, injecting writes the file
+    handle(filename, MODE == 'extract')
+    flushWrites()
+    with LOCK:
+        return list(UNITS) if MODE == 'extract' else list(INJECTED)
+
+# Yields [filename, result, error] in file order so the output is the same every run. worker(moduleName,
+# handleName, filename) runs in the worker processes after initializer(mode).
+def runFiles(handle, filenames, mode, initializer=initWorker, worker=runFile):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(os.cpu_count(), mp_context=context, initializer=initializer, initargs=[mode]) as executor:
+        futures = [executor.submit(worker, handle.__module__, handle.__name__, filename) for filename in filenames]
+        for filename, future in tqdm(list(zip(filenames, futures)), desc=mode.capitalize(), leave=False):
+            try:
+                yield [filename, future.result(), None]
+            except Exception as e:
+                yield [filename, None, e]
+
+def getSummary(result, failed):
+    if len(failed) > 0:
+        result += f'\nFailed: {", ".join(failed)}'
+    return result
+
+# handle is the engine's handle function, filenames are in /files. Returns a summary string.
+def runExtraction(handle, filenames):
+    Path(EXTRACTFILE).parent.mkdir(parents=True, exist_ok=True)
+    tmpFile = f'{EXTRACTFILE}.tmp'
+    total = 0
+    failed = []
+    with open(tmpFile, 'w', encoding='utf-8') as outFile:
+        for filename, units, error in runFiles(handle, filenames, 'extract'):
+            if error is not None:
+                failed.append(f'{filename} ({error})')
+                continue
+            for unit in units:
+                outFile.write(json.dumps(unit, ensure_ascii=False) + '\n')
+            total += len(units)
+    os.replace(tmpFile, EXTRACTFILE)
+    return getSummary(f'Extracted {total} units from {len(filenames) - len(failed)} files to {EXTRACTFILE}', failed)
+
+def runInjection(handle, filenames):
+    if not os.path.exists(INJECTFILE):
+        return f'{INJECTFILE} not found, it needs a line like {{"id": "...", "translation": "..."}} for each unit'
+    total = [0, 0]
+    failed = []
+    for filename, injected, error in runFiles(handle, filenames, 'inject'):
+        if error is not None:
+            failed.append(f'{filename} ({error})')
+            continue
+        total = [total[0] + injected[0], total[1] + injected[1]]
+    return getSummary(f'Injected {total[0]} units into {len(filenames) - len(failed)} files in /translated, '
+                      f'{total[1]} had no translation and were left as they were', failed)
@@ -0,0 +1,78 @@
+# Libraries
+import json, os, threading
+from pathlib import Path
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+# Checkpoint Journal
+# Every request that comes back is appended to the journal and flushed to disk before its lines are used, one record
+# per request with the translated lines and the tokens it cost. Files are only written once they are done, so if the
+# program is killed the journal is what's left of the run. The next run reads it back and the translation memory
+# answers those lines from it, nothing that was paid for is sent again. Lines are keyed like the memory, so it works
+# however the lines end up packed into requests. The journal is removed once a translation run finishes.
+load_dotenv()
+JOURNAL = os.getenv('journal', 'true').lower() not in ['false', '0', 'no', '']
+JOURNALFILE = os.getenv('journalFile', 'cache/journal.jsonl')
+LOCK = threading.Lock()
+ENTRIES = None      # key -> translation
+FILE = None
+
+# Must hold LOCK. A record cut off by a crash is dropped and cut off the file so new records start on a fresh line.
+def getEntries():
+    global ENTRIES
+    if ENTRIES is not None:
+        return ENTRIES
+    ENTRIES = {}
+    try:
+        with open(JOURNALFILE, 'rb') as f:
+            end = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                end += len(line)
+                for key, source, translation in record['lines']:
+                    ENTRIES[key] = translation
+        if end < os.path.getsize(JOURNALFILE):
+            os.truncate(JOURNALFILE, end)
+    except OSError:
+        pass
+    if len(ENTRIES) > 0:
+        tqdm.write(f'Resuming from {JOURNALFILE}, {len(ENTRIES)} translated lines won\'t be sent again')
+    return ENTRIES
+
+def getJournaled(key):
+    if not JOURNAL:
+        return None
+    with LOCK:
+        return getEntries().get(key)
+
+# rows are [key, source, translation] for the lines of one request, tokens are what it cost
+def writeRecord(rows, tokens):
+    global FILE
+    if not JOURNAL or len(rows) == 0:
+        return
+    record = json.dumps({'lines': rows, 'tokens': tokens}, ensure_ascii=False) + '\n'
+    with LOCK:
+        entries = getEntries()
+        if FILE is None:
+            Path(JOURNALFILE).parent.mkdir(parents=True, exist_ok=True)
+            FILE = open(JOURNALFILE, 'a', encoding='utf-8')
+        FILE.write(record)
+        FILE.flush()
+        os.fsync(FILE.fileno())
+        for key, source, translation in rows:
+            entries[key] = translation
+
+def clearJournal():
+    global ENTRIES, FILE
+    with LOCK:
+        if FILE is not None:
+            FILE.close()
+            FILE = None
+        ENTRIES = {}
+        if os.path.exists(JOURNALFILE):
+            os.remove(JOURNALFILE)
@@ -1,10 +1,19 @@
 # Libraries
-import json, os, re, textwrap, threading, time, traceback, tiktoken, openai
+import json, os, re, textwrap, threading, time, traceback, openai
 from pathlib import Path
 from colorama import Fore
 from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.cache import getPrompt, translationMemory
+from modules.extract import textUnits
+from modules.placeholders import compileVars, restoreVars, substituteVars
+from modules.normalize import normalizeText
+from modules.tokens import countPrompt
+from modules.calibration import calibrateEstimate
+from modules.ratelimit import requestCompletion
+from modules.batching import bisectBatch, dispatchBatches, getBatchSize, indexTranslations, packBatches
+from modules.coalesce import coalesceStrings
+from modules.writer import writeJSON
 
 # Open AI
 load_dotenv()
@@ -33,6 +42,7 @@ BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
 MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
+UNTRANSLATED = 0    # Lines that never came back from the API and were left in Japanese
 
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
@@ -40,7 +50,8 @@ POSITION = 0
 LEAVE = False
 
 # Pricing - Depends on the model https://openai.com/pricing
-# Batch Size - GPT 3.5 Struggles past 15 lines per request. GPT4 struggles past 50 lines per request
+# Batch Size - Most lines per request, batches are also kept under batchTokens in .env and adaptiveBatch tunes the size from here.
+# GPT 3.5 Struggles past 15 lines per request. GPT4 struggles past 50 lines per request
 # If you are getting a MISMATCH LENGTH error, lower the batch size.
 if 'gpt-3.5' in MODEL:
     INPUTAPICOST = .002 
@@ -70,21 +81,23 @@ def handleJSON(filename, estimate):
     
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='UTF-8') as outFile:
-                start = time.time()
-                translatedData = openFiles(filename)
-
-                # Print Result
-                end = time.time()
-                json.dump(translatedData[0], outFile, ensure_ascii=False)
-                tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    TOKENS[0] += translatedData[1][0]
-                    TOKENS[1] += translatedData[1][1]
+            start = time.time()
+            translatedData = openFiles(filename)
+
+            # Print Result
+            end = time.time()
+            writeJSON('translated/' + filename, translatedData[0])
+            tqdm.write(getResultString(translatedData, end - start, filename))
+            with LOCK:
+                TOKENS[0] += translatedData[1][0]
+                TOKENS[1] += translatedData[1][1]
         except Exception as e:
             return 'Fail'
 
-    return getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    if UNTRANSLATED > 0:
+        totalString += Fore.RED + f'\nUntranslated Lines: {UNTRANSLATED}' + Fore.RESET
+    return totalString
 
 def openFiles(filename):
     with open('files/' + filename, 'r', encoding='UTF-8-sig') as f:
@@ -276,124 +289,14 @@ def getSpeaker(speaker):
             return translateGPT(speaker, 'Reply with only the '+ LANGUAGE +' translation of the NPC name.', False)
 
 
-def subVars(jaString):
-    jaString = jaString.replace('\u3000', ' ')
-
-    # Nested
-    count = 0
-    nestedList = re.findall(r'[\\]+[\w]+\[[\\]+[\w]+\[[0-9]+\]\]', jaString)
-    nestedList = set(nestedList)
-    if len(nestedList) != 0:
-        for icon in nestedList:
-            jaString = jaString.replace(icon, '{Nested_' + str(count) + '}')
-            count += 1
-
-    # Icons
-    count = 0
-    iconList = re.findall(r'[\\]+[iIkKwWaA]+\[[0-9]+\]', jaString)
-    iconList = set(iconList)
-    if len(iconList) != 0:
-        for icon in iconList:
-            jaString = jaString.replace(icon, '{Ascii_' + str(count) + '}')
-            count += 1
-
-    # Colors
-    count = 0
-    colorList = re.findall(r'[\\]+[cC]\[[0-9]+\]', jaString)
-    colorList = set(colorList)
-    if len(colorList) != 0:
-        for color in colorList:
-            jaString = jaString.replace(color, '{Color_' + str(count) + '}')
-            count += 1
-
-    # Names
-    count = 0
-    nameList = re.findall(r'[\\]+[nN]\[.+?\]+', jaString)
-    nameList = set(nameList)
-    if len(nameList) != 0:
-        for name in nameList:
-            jaString = jaString.replace(name, '{Noun_' + str(count) + '}')
-            count += 1
-
-    # Variables
-    count = 0
-    varList = re.findall(r'[\\]+[vV]\[[0-9]+\]', jaString)
-    varList = set(varList)
-    if len(varList) != 0:
-        for var in varList:
-            jaString = jaString.replace(var, '{Var_' + str(count) + '}')
-            count += 1
+# Placeholders
+PLACEHOLDERS = compileVars('{}', r'[\\]+[\w]+\[.+?\]')
 
-    # Formatting
-    count = 0
-    formatList = re.findall(r'[\\]+[\w]+\[.+?\]', jaString)
-    formatList = set(formatList)
-    if len(formatList) != 0:
-        for var in formatList:
-            jaString = jaString.replace(var, '{FCode_' + str(count) + '}')
-            count += 1
-
-    # Put all lists in list and return
-    allList = [nestedList, iconList, colorList, nameList, varList, formatList]
-    return [jaString, allList]
+def subVars(jaString):
+    return substituteVars(jaString, PLACEHOLDERS)
 
 def resubVars(translatedText, allList):
-    # Fix Spacing and ChatGPT Nonsense
-    matchList = re.findall(r'\[\s?.+?\s?\]', translatedText)
-    if len(matchList) > 0:
-        for match in matchList:
-            text = match.strip()
-            translatedText = translatedText.replace(match, text)
-
-    # Nested
-    count = 0
-    if len(allList[0]) != 0:
-        for var in allList[0]:
-            translatedText = translatedText.replace('{Nested_' + str(count) + '}', var)
-            count += 1
-
-    # Icons
-    count = 0
-    if len(allList[1]) != 0:
-        for var in allList[1]:
-            translatedText = translatedText.replace('{Ascii_' + str(count) + '}', var)
-            count += 1
-
-    # Colors
-    count = 0
-    if len(allList[2]) != 0:
-        for var in allList[2]:
-            translatedText = translatedText.replace('{Color_' + str(count) + '}', var)
-            count += 1
-
-    # Names
-    count = 0
-    if len(allList[3]) != 0:
-        for var in allList[3]:
-            translatedText = translatedText.replace('{Noun_' + str(count) + '}', var)
-            count += 1
-
-    # Vars
-    count = 0
-    if len(allList[4]) != 0:
-        for var in allList[4]:
-            translatedText = translatedText.replace('{Var_' + str(count) + '}', var)
-            count += 1
-    
-    # Formatting
-    count = 0
-    if len(allList[5]) != 0:
-        for var in allList[5]:
-            translatedText = translatedText.replace('{FCode_' + str(count) + '}', var)
-            count += 1
-
-    return translatedText
-
-def batchList(input_list, batch_size):
-    if not isinstance(batch_size, int) or batch_size <= 0:
-        raise ValueError("batch_size must be a positive integer")
-        
-    return [input_list[i:i + batch_size] for i in range(0, len(input_list), batch_size)]
+    return restoreVars(translatedText, allList, PLACEHOLDERS)
 
 def createContext(fullPromptFlag, subbedT):
     characters = 'Game Characters:\n\
@@ -449,7 +352,10 @@ def translateText(characters, system, user, history):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+
+    # Rate Limit and Retry
+    response = requestCompletion(
+        lambda: countTokens(characters, system, user, history),
         temperature=0.1,
         frequency_penalty=0.1,
         presence_penalty=0.1,
@@ -459,19 +365,7 @@ def translateText(characters, system, user, history):
     return response
 
 def cleanTranslatedText(translatedText, varResponse):
-    placeholders = {
-        f'{LANGUAGE} Translation: ': '',
-        'Translation: ': '',
-        'っ': '',
-        '〜': '~',
-        'ー': '-',
-        'ッ': '',
-        '。': '.',
-        'Placeholder Text': ''
-        # Add more replacements as needed
-    }
-    for target, replacement in placeholders.items():
-        translatedText = translatedText.replace(target, replacement)
+    translatedText = normalizeText(translatedText, 'translation')
 
     translatedText = resubVars(translatedText, varResponse[1])
     return [line for line in translatedText.split('\n') if line]
@@ -480,54 +374,82 @@ def extractTranslation(translatedTextList, is_list):
     pattern = r'`?<Line(\d+)>([\\]*.*?[\\]*?)<\/?Line\d+>`?'
     # If it's a batch (i.e., list), extract with tags; otherwise, return the single item.
     if is_list:
-        return [re.findall(pattern, line)[0][1] for line in translatedTextList if re.search(pattern, line)]
+        return [re.findall(pattern, line)[0] for line in translatedTextList if re.search(pattern, line)]
     else:
         matchList = re.findall(pattern, translatedTextList)
         return matchList[0][1] if matchList else translatedTextList
 
 def countTokens(characters, system, user, history):
-    inputTotalTokens = 0
-    outputTotalTokens = 0
-    enc = tiktoken.encoding_for_model(MODEL)
-    
-    # Input
-    if isinstance(history, list):
-        for line in history:
-            inputTotalTokens += len(enc.encode(line))
-    else:
-        inputTotalTokens += len(enc.encode(history))
-    inputTotalTokens += len(enc.encode(system))
-    inputTotalTokens += len(enc.encode(characters))
-    inputTotalTokens += len(enc.encode(user))
-
-    # Output
-    outputTotalTokens += round(len(enc.encode(user))/1.5)
-
-    return [inputTotalTokens, outputTotalTokens]
+    return countPrompt(MODEL, characters, system, user, history)
 
 def combineList(tlist, text):
     if isinstance(text, list):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+def translateBatch(batch, history, fullPromptFlag):
+    # Before sending to translation, add the formatting
+    payload = '\n'.join([f'`<Line{i}>{item}</Line{i}>`' for i, item in enumerate(batch)])
+    payload = payload.replace('``', '`Placeholder Text`')
+    varResponse = subVars(payload)
+    subbedT = varResponse[0]
+
+    # Things to Check before starting translation
+    if not re.search(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]+', subbedT):
+        return [dict(enumerate(batch)), [0, 0]]
+
+    # Create Message
+    characters, system, user = createContext(fullPromptFlag, subbedT)
+
+    # Calculate Estimate
+    if ESTIMATE:
+        return [dict(enumerate(batch)), calibrateEstimate(MODEL, __name__, countTokens(characters, system, user, history))]
+
+    # Translating
+    response = translateText(characters, system, user, history)
+    translatedText = response.choices[0].message.content
+    totalTokens = [response.usage.prompt_tokens, response.usage.completion_tokens]
+
+    # Formatting
+    translatedTextList = cleanTranslatedText(translatedText, varResponse)
+    extractedTranslations = extractTranslation(translatedTextList, True)
+    return [indexTranslations(extractedTranslations, len(batch)), totalTokens]
+
+# Batches recover from mismatches by resending the missing lines
+def translateChunk(batch, history, fullPromptFlag):
+    global UNTRANSLATED
+    response = bisectBatch(batch, lambda batch: translateBatch(batch, history, fullPromptFlag), None if ESTIMATE else MODEL,
+                           getPrompt(globals(), fullPromptFlag))
+
+    # Lines that never came back stay untranslated
+    extractedTranslations = response[0]
+    missing = [i for i, line in enumerate(extractedTranslations) if line is None]
+    for i in missing:
+        extractedTranslations[i] = batch[i]
+    with LOCK:
+        UNTRANSLATED += len(missing)
+    return [extractedTranslations, response[1]]
+
+@textUnits
+@translationMemory
+@coalesceStrings
 def translateGPT(text, history, fullPromptFlag):
     totalTokens = [0, 0]
-    if isinstance(text, list):
-        tList = batchList(text, BATCHSIZE)
-    else:
-        tList = [text]
 
+    # Batches, sent one after another or at the same time with concurrentBatches
+    if isinstance(text, list):
+        tList = packBatches(text, getBatchSize(MODEL, BATCHSIZE), MODEL)
+        responses = dispatchBatches(tList, history, lambda batch, history: translateChunk(batch, history, fullPromptFlag))
+        for response in responses:
+            totalTokens[0] += response[1][0]
+            totalTokens[1] += response[1][1]
+        finalList = combineList([response[0] for response in responses], text)
+        return [finalList, totalTokens]
+
+    tList = [text]
     for index, tItem in enumerate(tList):
-        # Before sending to translation, if we have a list of items, add the formatting
-        if isinstance(tItem, list):
-            payload = '\n'.join([f'`<Line{i}>{item}</Line{i}>`' for i, item in enumerate(tItem)])
-            payload = payload.replace('``', '`Placeholder Text`')
-            varResponse = subVars(payload)
-            subbedT = varResponse[0]
-        else:
-            varResponse = subVars(tItem)
-            subbedT = varResponse[0]
+        varResponse = subVars(tItem)
+        subbedT = varResponse[0]
 
         # Things to Check before starting translation
         if not re.search(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]+', subbedT):
@@ -538,7 +460,7 @@ def translateGPT(text, history, fullPromptFlag):
 
         # Calculate Estimate
         if ESTIMATE:
-            estimate = countTokens(characters, system, user, history)
+            estimate = calibrateEstimate(MODEL, __name__, countTokens(characters, system, user, history))
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -549,18 +471,14 @@ def translateGPT(text, history, fullPromptFlag):
         totalTokens[0] += response.usage.prompt_tokens
         totalTokens[1] += response.usage.completion_tokens
 
+        # Refused, keep the original text
+        if translatedText == '':
+            continue
+
         # Formatting
         translatedTextList = cleanTranslatedText(translatedText, varResponse)
-        if isinstance(tItem, list):
-            extractedTranslations = extractTranslation(translatedTextList, True)
-            tList[index] = extractedTranslations
-            if len(tItem) != len(translatedTextList):
-                mismatch = True     # Just here so breakpoint can be set
-            history = extractedTranslations[-10:]  # Update history if we have a list
-        else:
-            # Ensure we're passing a single string to extractTranslation
-            extractedTranslations = extractTranslation('\n'.join(translatedTextList), False)
-            tList[index] = extractedTranslations
+        extractedTranslations = extractTranslation('\n'.join(translatedTextList), False)
+        tList[index] = extractedTranslations
 
     finalList = combineList(tList, text)
-    return [finalList, totalTokens]
\ No newline at end of file
+    return [finalList, totalTokens]
@@ -0,0 +1,64 @@
+# Libraries
+import codecs, json, os
+from dotenv import load_dotenv
+from tqdm import tqdm
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# JSON Backend
+# Game data is read and written through here. Files are read with orjson when it is installed, then ujson, then the
+# json module, or whichever jsonBackend names. They are read as bytes and a UTF-8 byte order mark is skipped, like
+# utf-8-sig. Files are written byte for byte the way json.dump(data, f, ensure_ascii=False) always wrote them.
+# jsonCompact has the fast backend write them instead, without the spaces after , and : and with its own way of
+# writing floats (1e300, not 1e+300), which is a lot faster but not the same bytes.
+# python benchmarks/jsonio.py checks all of it on real files.
+load_dotenv()
+BACKENDS = {'orjson': orjson, 'ujson': ujson, 'json': json}
+BACKEND = os.getenv('jsonBackend', 'auto').lower()     # auto, orjson, ujson or json
+if BACKEND == 'auto':
+    BACKEND = 'orjson' if orjson is not None else 'ujson' if ujson is not None else 'json'
+elif BACKENDS.get(BACKEND) is None:
+    tqdm.write(f'jsonBackend {BACKEND} isn\'t installed, using json')
+    BACKEND = 'json'
+COMPACT = os.getenv('jsonCompact', 'false').lower() not in ['false', '0', 'no', '']
+SEPARATORS = [b',', b':'] if COMPACT else [b', ', b': ']     # Between items and after keys
+
+def parseJSON(data, backend=None):
+    backend = backend or BACKEND
+    if data.startswith(codecs.BOM_UTF8):
+        data = data[len(codecs.BOM_UTF8):]
+    # Anything a fast backend won't read (integers over 64 bits, NaN) goes through json like it always did
+    try:
+        if backend == 'orjson':
+            return orjson.loads(data)
+        if backend == 'ujson':
+            return ujson.loads(data)
+    except ValueError:
+        pass
+    return json.loads(data.decode('utf-8'))
+
+def readJSON(path, backend=None):
+    with open(path, 'rb') as f:
+        return parseJSON(f.read(), backend)
+
+# Returns bytes. json.dumps builds the whole string in C, json.dump writes it out a piece at a time in Python.
+# Compact output that a fast backend can't write (integers over 64 bits, non-string keys) goes through json.
+def dumpJSON(data, backend=None, compact=None):
+    backend = backend or BACKEND
+    compact = COMPACT if compact is None else compact
+    if not compact:
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+    try:
+        if backend == 'orjson':
+            return orjson.dumps(data)
+        if backend == 'ujson':
+            return ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+    except (TypeError, ValueError, OverflowError):
+        pass
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
@@ -0,0 +1,118 @@
+# Libraries
+import json, os, re
+from pathlib import Path
+from dotenv import load_dotenv
+from modules.jsonio import SEPARATORS, dumpJSON
+
+# Streaming JSON
+# Files too big to hold in memory are never loaded whole. readItems() yields the items of the top level array or
+# object one at a time and only reads as much of the file as the next item needs, startItems() / writeItem() /
+# finishItems() write them back out as they are done. The output is the same bytes dumpJSON() gives for the whole
+# thing and is written to a temporary file that is renamed into place at the end, like the writer does.
+load_dotenv()
+THRESHOLD = float(os.getenv('streamThreshold', '20') or 0)     # Files bigger than this many MB are streamed, 0 is off
+WINDOW = int(os.getenv('streamWindow', '5000') or 1)            # Lines of pages held in memory at a time
+CHUNKSIZE = 1 << 20
+DECODER = json.JSONDecoder()
+SKIP = re.compile(r'[\s,]*')
+END = ',:]} \t\r\n'     # What can come after a value
+
+def isLarge(path):
+    return THRESHOLD > 0 and os.path.getsize(path) > THRESHOLD * 2 ** 20
+
+# Yields [index, item] for an array and [key, value] for an object
+def readItems(path):
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+
+        # Drops what was already used and reads size more characters
+        def fill(size):
+            nonlocal buffer, pos, eof
+            more = f.read(size)
+            eof = more == ''
+            buffer = buffer[pos:] + more
+            pos = 0
+
+        # Next character that isn't whitespace or a comma, None at the end of the file
+        def skip():
+            nonlocal pos
+            while True:
+                pos = SKIP.match(buffer, pos).end()
+                if pos < len(buffer):
+                    return buffer[pos]
+                if eof:
+                    return None
+                fill(CHUNKSIZE)
+
+        # Decodes the value at pos, reading twice as much each time it isn't whole yet
+        def decode():
+            nonlocal pos
+            size = CHUNKSIZE
+            while True:
+                try:
+                    value, end = DECODER.raw_decode(buffer, pos)
+                    # A number is only whole once something that can't be part of it comes after it. '0.' or '1.5e'
+                    # cut off at the end of a chunk decodes as the number before it.
+                    if eof or (end < len(buffer) and buffer[end] in END):
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill(size)
+                size *= 2
+
+        opener = skip()
+        if opener not in ['[', '{']:
+            raise ValueError(f'{path} isn\'t a JSON array or object')
+        pos += 1
+        index = 0
+        while True:
+            char = skip()
+            if char is None:
+                raise ValueError(f'{path} ends before its closing bracket')
+            if char in [']', '}']:
+                return
+            if opener == '{':
+                key = decode()
+                if skip() != ':':
+                    raise ValueError(f'{path} is missing a : after {key}')
+                pos += 1
+                skip()
+            else:
+                key = index
+            yield [key, decode()]
+            index += 1
+
+# Returns the stream to pass to writeItem() and finishItems()
+def startItems(path, isObject):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    f = open(f'{path}.tmp', 'wb')
+    f.write(b'{' if isObject else b'[')
+    return [f, path, isObject, 0]
+
+# key is only written for objects
+def writeItem(stream, key, value):
+    f, path, isObject, count = stream
+    if count > 0:
+        f.write(SEPARATORS[0])
+    if isObject:
+        f.write(dumpJSON(key) + SEPARATORS[1])
+    f.write(dumpJSON(value))
+    stream[3] += 1
+
+def finishItems(stream):
+    f, path, isObject, count = stream
+    f.write(b'}' if isObject else b']')
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(f'{path}.tmp', path)
+
+# Leaves whatever was in /translated before
+def abortItems(stream):
+    f, path, isObject, count = stream
+    f.close()
+    os.remove(f'{path}.tmp')
@@ -25,6 +25,12 @@ from modules.lune import handleLune
 from modules.atelier import handleAtelier
 from modules.anim import handleAnim
 from modules.nscript import handleNScript
+from modules.sampling import estimateSample
+from modules.extract import runExtraction, runInjection
+from modules.batchjob import runExport, runImport
+from modules.journal import clearJournal
+from modules.shutdown import installHandlers, isStopping
+from modules.writer import flushWrites
 
 # For GPT4 rate limit will be hit if you have more than 1 thread.
 # 1 Thread for each file. Controls how many files are worked on at once.
@@ -46,20 +52,31 @@ MODULES = [
 ]
 
 # Info Message
-tqdm.write(Fore.LIGHTYELLOW_EX + "WARNING: Once the translation starts do not close it unless you want to lose your \
-translated data. If a file fails or gets stuck, translated lines will remain translated so you don't have \
-to worry about being charged twice. You can simply copy the file generated in /translations back over to \
-/files and start the script again. It will skip over any translated text." + Fore.RESET, end='\n\n')
+tqdm.write(Fore.LIGHTYELLOW_EX + "WARNING: Once the translation starts try not to close it. Finished requests are \
+kept in the journal and won't be paid for again on the next run, but the ones in flight are lost. If a file \
+fails or gets stuck, translated lines will remain translated so you don't have to worry about being charged twice. \
+You can simply copy the file generated in /translations back over to /files and start the script again. \
+It will skip over any translated text." + Fore.RESET, end='\n\n')
 
 def main():
     estimate = ''
     while estimate == '':
-        estimate = input('Select Translation or Cost Estimation:\n\n 1. Translate\n 2. Estimate\n')
+        estimate = input('Select Translation or Cost Estimation:\n\n 1. Translate\n 2. Estimate\n 3. Quick Estimate (Sampled)\n 4. Extract Text (JSONL)\n 5. Inject Translations (JSONL)\n 6. Batch Export (OpenAI Batch API)\n 7. Batch Import\n')
         match estimate:
             case '1':
                 estimate = False
             case '2':
                 estimate = True
+            case '3':
+                estimate = 'sample'
+            case '4':
+                estimate = 'extract'
+            case '5':
+                estimate = 'inject'
+            case '6':
+                estimate = 'export'
+            case '7':
+                estimate = 'import'
             case _:
                 estimate = ''
     
@@ -76,10 +93,38 @@ def main():
         if version in range(len(MODULES)):
             break    
 
+    # Sampled Estimate, reads a sample of the files instead of parsing all of them
+    if estimate == 'sample':
+        paths = [os.path.join('files', filename) for filename in os.listdir('files') \
+                 if filename.endswith(MODULES[version][1])]
+        tqdm.write(estimateSample(paths, sys.modules[MODULES[version][2].__module__]))
+        return
+
+    # Extract, runs the parser without translating and writes every unit to JSONL
+    if estimate == 'extract':
+        filenames = [filename for filename in os.listdir('files') if filename.endswith(MODULES[version][1])]
+        tqdm.write(runExtraction(MODULES[version][2], filenames))
+        return
+
+    # Inject, runs the parser with translations from JSONL in place of the API and writes to /translated
+    if estimate == 'inject':
+        filenames = [filename for filename in os.listdir('files') if filename.endswith(MODULES[version][1])]
+        tqdm.write(runInjection(MODULES[version][2], filenames))
+        return
+
+    # Batch Jobs, writes the requests for the Batch API or applies its output
+    if estimate in ['export', 'import']:
+        filenames = [filename for filename in os.listdir('files') if filename.endswith(MODULES[version][1])]
+        run = runExport if estimate == 'export' else runImport
+        tqdm.write(run(MODULES[version][2], filenames))
+        return
+
     totalCost = Fore.RED + 'Translation module didn\'t return the total cost. Make sure the \
 files to translate are in the /files folder and that you picked the right game engine.'
 
     # Open File (Threads)
+    failed = False
+    installHandlers()
     with ThreadPoolExecutor(max_workers=THREADS) as executor:
         futures = [executor.submit(MODULES[version][2], filename, estimate) \
                     for filename in os.listdir("files") if filename.endswith(MODULES[version][1])]
@@ -87,15 +132,33 @@ files to translate are in the /files folder and that you picked the right game e
         for future in as_completed(futures):
             try:
                 totalCost = future.result()
+                failed = failed or totalCost == 'Fail'
             except Exception as e:
+                failed = True
                 tracebackLineNo = str(traceback.extract_tb(sys.exc_info()[2])[-1].lineno)
                 tqdm.write(Fore.RED + str(e) + '|' + tracebackLineNo + Fore.RESET)
 
+    # Files are written in the background, one that couldn't be written counts as failed
+    unwritten = flushWrites()
+    failed = failed or len(unwritten) > 0
+
+    # Stopped, /files and the journal are kept so the next run carries on from here
+    if isStopping():
+        tqdm.write(Fore.YELLOW + 'Stopped early. What was finished is in /translated, run it again with the same \
+files to translate the rest.' + Fore.RESET)
+        if totalCost != 'Fail':
+            tqdm.write(str(totalCost))
+        return
+
     if totalCost != 'Fail':
-        if estimate is False:
+        if estimate is False and len(unwritten) == 0:
             # This is to encourage people to grab what's in /translated instead
             deleteFolderFiles('files')
 
+            # Everything made it into /translated, a failed file keeps the journal for the next run
+            if not failed:
+                clearJournal()
+
         tqdm.write(str(totalCost))
 
 def deleteFolderFiles(folderPath):
@@ -0,0 +1,49 @@
+# Libraries
+import os, re
+from dotenv import load_dotenv
+
+# Text Normalization
+# Text is cleaned up before it is sent and again when the translation comes back. Each engine used to spell this out
+# as its own chain of replace() and re.sub() calls, the profiles below declare the same steps as data, in order.
+# A step is either (target, replacement) or a regex with a guard string, and is only run when its target or guard
+# is actually in the text. Most lines only hit one or two steps and the ellipsis regex almost never runs.
+load_dotenv()
+LANGUAGE = os.getenv('language').capitalize()
+ELLIPSIS = ('....', re.compile(r'\.{3}\.+'), '...')     # 4 or more dots become 3
+PROFILES = {
+    # Source text, RPG Maker MV/MZ and Ace
+    'rpgmaker': [
+        ('ﾞ', ''), ('・', '.'), ('―', '-'), ('ー', '-'), ('…', '...'), ('。', '.'), ELLIPSIS, ('　', ''),
+    ],
+    # Source text, Tyrano, Kansen and NScript
+    'script': [
+        ('ﾞ', ''), ('・', '.'), ('‶', ''), ('”', ''), ('―', '-'), ('ー', '-'), ('…', '...'), ELLIPSIS, ('　', ' '),
+    ],
+    # Translations
+    'translation': [
+        (f'{LANGUAGE} Translation: ', ''), ('Translation: ', ''), ('っ', ''), ('〜', '~'), ('ー', '-'), ('ッ', ''),
+        ('。', '.'), ('Placeholder Text', ''),
+    ],
+    'anim': [
+        (f'{LANGUAGE} Translation: ', ''), ('Translation: ', ''), ('っ', ''),
+    ],
+    'atelier': [
+        (f'{LANGUAGE} Translation: ', ''), ('Translation: ', ''), ('Line to Translate = ', ''),
+        ('Translation = ', ''), ('Translate = ', ''), (f'{LANGUAGE} Translation:', ''), ('Translation:', ''),
+        ('Line to Translate =', ''), ('Translation =', ''), ('Translate =', ''), ('っ', ''), ('ッ', ''), ('ぁ', ''),
+        ('。', '.'), ('、', ','), ('？', '?'), ('！', '!'),
+    ],
+    'sakuranbo': [
+        ('ッ', ''), ('っ', ''), ('ー', ''), ('"', ''), ('[', ''), (']', ''),
+    ],
+}
+
+def normalizeText(text, profile):
+    for step in PROFILES[profile]:
+        if step[0] not in text:
+            continue
+        if len(step) == 2:
+            text = text.replace(step[0], step[1])
+        else:
+            text = step[1].sub(step[2], text)
+    return text
@@ -0,0 +1,68 @@
+# Libraries
+import re
+
+# Regex Registry
+# searchCodes runs the same handful of patterns on every line of every event. They are compiled once here
+# and looked up by name instead of going through re's pattern cache on every call.
+REGEX = {
+    # Japanese
+    'japanese': re.compile(r'[一-龠ぁ-ゔァ-ヴー]'),
+
+    # Speakers
+    'coloredSpeaker': re.compile(r'^[\\]+[cC]\[[\d]+\](.+?)[\\]+[Cc]\[[\d]\]$'),
+    'bracketSpeaker': re.compile(r'^【(.*?)】$'),
+    'bracketName': re.compile(r'^([\\]+[cC]\[[0-9]+\]【?(.+?)】?[\\]+[cC]\[[0-9]+\])|^(【(.+)】)'),
+    'nametagAfter': re.compile(r'(.*?)([\\]+[nN][wWcC]?<(.*?)>.*)'),
+    'nametagBefore': re.compile(r'(.*[\\]+[nN][wWcC]?<(.*?)>)(.*)'),
+    'speakerPrefix': re.compile(r'(^.+?)\s?[|:]\s?'),
+
+    # Codes
+    'startCode': re.compile(r'^[\\]+[\w]+\[[a-zA-Z0-9\\\[\]\_,\s-]+\]'),
+    'startCodeAce': re.compile(r'^[\\]+[\w]+\[[a-zA-Z0-9\\\[\]\_]+\]'),
+    'faceCode': re.compile(r'[\\]+[fFaA]+\[.+?\]'),
+    'furigana': re.compile(r'([\\]+[r][b]?\[.+?,(.+?)\])'),
+    'formatCode': re.compile(r'[\\]+[!><.|#^{}]'),
+
+    # Trimming
+    'leadingSymbols': re.compile(r'^[^一-龠ぁ-ゔァ-ヴー【】（）「」a-zA-ZＡ-Ｚ０-９\\]+'),
+    'leadingCode': re.compile(r'^[^一-龠ぁ-ゔァ-ヴー\<\>【】\\]+'),
+    'trailingCode': re.compile(r'[^一-龠ぁ-ゔァ-ヴー\<\>【】。！？\\]+$'),
+    'leadingScript': re.compile(r'^[^一-龠ぁ-ゔァ-ヴー\<\>【】]+'),
+    'trailingScript': re.compile(r'[^一-龠ぁ-ゔァ-ヴー\<\>【】。！？]+$'),
+
+    # Scripts and Plugins
+    'quoted': re.compile(r"[\'\"\`](.*)[\'\"\`]"),
+    'singleQuoted': re.compile(r"'(.*?)'"),
+    'quotedScript': re.compile(r'.+"(.*?)".*[;,]$'),
+    'subject': re.compile(r'.*?subject=(.*?)\".*?'),
+    'secretText': re.compile(r'secretText:\s?(.+)'),
+    'title': re.compile(r'title:\s?(.+)'),
+    'titleJA': re.compile(r'タイトル：(.*)'),
+    'contentJA': re.compile(r'内容：(.*)'),
+    'wholeLine': re.compile(r'(.+)'),
+    'info': re.compile(r'info:(.*)'),
+    'activeMessage': re.compile(r'<ActiveMessage:(.*)>'),
+    'activeMessageOpen': re.compile(r'<ActiveMessage:(.*)>?'),
+    'tachieName': re.compile(r'Tachie showName (.+)'),
+    'dText': re.compile(r'D_TEXT\s(.+)\s|D_TEXT\s(.+)'),
+    'infoSE': re.compile(r'\_SE\[.+?\](.+)'),
+    'showInfo': re.compile(r'ShowInfo (.+)'),
+    'pushGab': re.compile(r'PushGab [0-9]+ (.+)'),
+    'addLog': re.compile(r'addLog (.+)'),
+    'namePop': re.compile(r'namePop\s\d+\s(.+?)\s.+'),
+    'infoPopup': re.compile(r'LL_InfoPopupWIndowMV\sshowWindow\s(.+?)\s.+'),
+    'ifScript': re.compile(r'(if\(.*\))'),
+    'enScript': re.compile(r'(en\(.*\))'),
+}
+
+# Most lines in an event are script calls, switches and numbers. Plain ASCII can't hold any Japanese
+# so those skip the scan, everything else is one search over a single character class.
+def isJapanese(text):
+    return not text.isascii() and REGEX['japanese'].search(text) is not None
+
+# nametagAfter and nametagBefore rescan the rest of the line from every position, which is quadratic on long
+# lines. Neither can match without a '<' so most lines skip them.
+def findNametags(regex, text):
+    if '<' not in text:
+        return []
+    return regex.findall(text)
@@ -0,0 +1,54 @@
+# Libraries
+import re
+
+# Placeholders
+# Game escape codes (\C[1], \I[64], \N[2], \V[5]...) are swapped for placeholders like [Color_0] before the text
+# is sent and put back afterwards. Every kind of code is matched by one compiled alternation in a single scan,
+# earlier kinds win when two could match at the same spot. Restoring is one more scan using the index map.
+NAMES = ['Nested', 'Ascii', 'Color', 'Noun', 'Var', 'FCode']
+PATTERNS = [
+    r'[\\]+[\w]+\[[\\]+[\w]+\[[0-9]+\]\]',  # Nested
+    r'[\\]+[iIkKwWaA]+\[[0-9]+\]',          # Icons
+    r'[\\]+[cC]\[[0-9]+\]',                 # Colors
+    r'[\\]+[nN]\[.+?\]+',                   # Names
+    r'[\\]+[vV]\[[0-9]+\]',                 # Variables
+]
+
+# brackets is the pair the placeholder is wrapped in, formatPattern matches the engine's other formatting codes.
+def compileVars(brackets, formatPattern, names=NAMES):
+    opening, closing = brackets
+    return {
+        'pattern': re.compile('|'.join(f'({pattern})' for pattern in PATTERNS + [formatPattern])),
+        'restore': re.compile(re.escape(opening) + r'\s?((?:' + '|'.join(names) + r')_\d+)\s?' + re.escape(closing)),
+        'names': names,
+        'brackets': brackets,
+    }
+
+# Returns [subbedText, allList], allList maps each placeholder name (Color_0) back to its original code.
+def substituteVars(jaString, profile):
+    jaString = jaString.replace('\u3000', ' ')
+    allList = {}
+    if '\\' not in jaString:
+        return [jaString, allList]
+
+    opening, closing = profile['brackets']
+    names = profile['names']
+    placeholders = {}
+    counts = [0] * len(names)
+    def replace(match):
+        code = match.group(0)
+        placeholder = placeholders.get(code)
+        if placeholder is None:
+            kind = match.lastindex - 1
+            placeholder = f'{names[kind]}_{counts[kind]}'
+            counts[kind] += 1
+            placeholders[code] = placeholder
+            allList[placeholder] = code
+        return opening + placeholder + closing
+    return [profile['pattern'].sub(replace, jaString), allList]
+
+# Placeholders the model made up or mangled beyond the spacing are left as they are.
+def restoreVars(translatedText, allList, profile):
+    if not allList or profile['brackets'][0] not in translatedText:
+        return translatedText
+    return profile['restore'].sub(lambda match: allList.get(match.group(1), match.group(0)), translatedText)
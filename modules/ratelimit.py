@@ -0,0 +1,231 @@
+# Libraries
+import email.utils, hashlib, json, os, random, re, threading, time
+import openai
+from dotenv import load_dotenv
+import modules.batchjob as batchjob
+from modules.calibration import recordUsage
+from modules.client import createCompletion, createResponse, submitCompletion
+from modules.shutdown import isStopping, sleep, waitFor
+from tqdm import tqdm
+
+# Rate Limiter
+# One limiter is shared by every file thread and every page thread in the process. Each request has to take
+# one request and its estimated tokens out of the buckets before it is sent. When the API answers with a 429 every
+# worker is paused until the Retry-After time has passed instead of each thread retrying on its own.
+load_dotenv()
+RPM = int(os.getenv('rpm', '0') or 0)     # Requests per minute, 0 means no limit
+TPM = int(os.getenv('tpm', '0') or 0)     # Tokens per minute, 0 means no limit
+DEFAULTPAUSE = 10   # Seconds to pause when the API doesn't tell us how long to wait
+LOCK = threading.Lock()
+BUCKETS = {'requests': float(RPM), 'tokens': float(TPM)}
+LASTREFILL = time.monotonic()
+PAUSEUNTIL = 0.0
+
+# Retries - [tries, base delay, max delay] for each kind of error. Delays double every attempt with full jitter.
+# Anything not listed here (bad request, auth) isn't retried.
+RETRIES = {
+    'timeout': [5, 2, 60],
+    'connection': [5, 2, 60],
+    'ratelimit': [8, 1, 30],    # On top of the shared pause from backoff()
+    'server': [5, 5, 120],
+    'refusal': [2, 1, 5],
+}
+
+# Prefetching
+# prefetch() runs a function up to its first request, sends that request without waiting for it and stops there. The
+# future is kept under a key made from the request. When the function is run again for real the same request picks
+# up that future instead of being sent again, so one thread can have the first request of many batches out at once.
+PREFETCHING = threading.local()
+PREFETCHED = {}     # Request key -> future
+
+class Prefetched(BaseException):
+    pass
+
+# 429s are handled by the limiter so they need to reach us instead of being retried inside the openai client.
+openai.max_retries = 0
+
+def refill(now):
+    global LASTREFILL
+    elapsed = now - LASTREFILL
+    LASTREFILL = now
+    if RPM > 0:
+        BUCKETS['requests'] = min(RPM, BUCKETS['requests'] + elapsed * RPM / 60)
+    if TPM > 0:
+        BUCKETS['tokens'] = min(TPM, BUCKETS['tokens'] + elapsed * TPM / 60)
+
+# Blocks until there is room for one more request and any 429 pause is over. estimate is
+# [inputTokens, outputTokens] like countTokens returns.
+def acquire(estimate):
+    tokens = min(sum(estimate), TPM) if TPM > 0 else 0
+
+    while True:
+        with LOCK:
+            now = time.monotonic()
+            refill(now)
+            wait = PAUSEUNTIL - now
+            if wait <= 0:
+                if RPM > 0 and BUCKETS['requests'] < 1:
+                    wait = (1 - BUCKETS['requests']) * 60 / RPM
+                elif TPM > 0 and BUCKETS['tokens'] < tokens:
+                    wait = (tokens - BUCKETS['tokens']) * 60 / TPM
+                else:
+                    if RPM > 0:
+                        BUCKETS['requests'] -= 1
+                    if TPM > 0:
+                        BUCKETS['tokens'] -= tokens
+                    return
+        if sleep(wait):
+            return
+
+# Called with the RateLimitError from the API. Pauses every worker and empties the buckets so
+# requests trickle back in when the pause is over instead of all firing at once.
+def backoff(error):
+    global PAUSEUNTIL
+    seconds = getRetryAfter(error)
+    with LOCK:
+        PAUSEUNTIL = max(PAUSEUNTIL, time.monotonic() + seconds + random.uniform(0, 1))
+        BUCKETS['requests'] = 0.0
+        BUCKETS['tokens'] = 0.0
+    tqdm.write(f'Rate limited, pausing all requests for {round(seconds, 1)}s')
+
+def getRetryAfter(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is None:
+        return DEFAULTPAUSE
+
+    # Retry-After-Ms / Retry-After
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    if headers.get('retry-after'):
+        try:
+            return float(headers['retry-after'])
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(headers['retry-after'])
+            return max(0, date.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    # OpenAI Reset Headers (e.g 1s, 6m0s, 20ms)
+    resets = [parseDuration(headers.get(h, '')) for h in ['x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens']]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if len(resets) > 0 else DEFAULTPAUSE
+
+def parseDuration(duration):
+    matchList = re.findall(r'([\d.]+)(ms|h|m|s)', duration)
+    if len(matchList) == 0:
+        return None
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    return sum(float(value) * units[unit] for value, unit in matchList)
+
+# Returns [key, None] once the first request of function(*args) is out, or [None, result] if it finished without
+# sending anything. Keys that end up unused have to be given to dropPrefetched().
+def prefetch(function, *args):
+    if getattr(PREFETCHING, 'active', False):
+        return [None, function(*args)]
+    PREFETCHING.active = True
+    try:
+        return [None, function(*args)]
+    except Prefetched as e:
+        return [e.args[0], None]
+    finally:
+        PREFETCHING.active = False
+
+def dropPrefetched(keys):
+    with LOCK:
+        futures = [PREFETCHED.pop(key, None) for key in keys if key is not None]
+    for future in futures:
+        if future is not None:
+            future.cancel()
+
+def getRequestKey(kwargs):
+    return hashlib.sha1(json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+# Sends one chat completion with the rate limit and retries. Only this request is retried so a failure
+# doesn't resend chunks that were already translated. If the model keeps refusing the response is returned
+# with empty content so the caller treats it like any other missing translation.
+# The estimate is recorded against the usage for calibration, under the engine module that made the estimate.
+# During a batch export or import nothing is sent, the response comes from batchjob. Once the program is stopping
+# nothing new is sent either and the request comes back empty. A request sent by prefetch() is only waited on.
+def requestCompletion(estimateTokens, **kwargs):
+    estimate = estimateTokens()
+    if batchjob.MODE is not None:
+        response = batchjob.getBatchResponse(kwargs)
+        if response.usage.total_tokens > 0:
+            recordUsage(kwargs['model'], estimateTokens.__module__, estimate, response.usage)
+            if getRefusal(response) is not None:
+                response.choices[0].message.content = ''
+        return response
+
+    # Prefetch
+    future = None
+    if getattr(PREFETCHING, 'active', False) or len(PREFETCHED) > 0:
+        key = getRequestKey(kwargs)
+        if getattr(PREFETCHING, 'active', False):
+            acquire(estimate)
+            if not isStopping():
+                with LOCK:
+                    PREFETCHED[key] = submitCompletion(**kwargs)
+                raise Prefetched(key)
+        with LOCK:
+            future = PREFETCHED.pop(key, None)
+
+    attempts = {}
+    while True:
+        sent, future = future, None
+        if sent is None:
+            acquire(estimate)
+            if isStopping():
+                return createResponse(kwargs['model'], '')
+        try:
+            response = waitFor(sent) if sent is not None else createCompletion(**kwargs)
+            if response is None:
+                return createResponse(kwargs['model'], '')
+            errorClass = getRefusal(response)
+            error = None
+        except openai.APIError as e:
+            errorClass = getErrorClass(e)
+            error = e
+            if errorClass is None:
+                raise
+            if errorClass == 'ratelimit':
+                backoff(e)
+        if errorClass is None:
+            recordUsage(kwargs['model'], estimateTokens.__module__, estimate, response.usage)
+            return response
+
+        # Backoff
+        tries, base, cap = RETRIES[errorClass]
+        attempts[errorClass] = attempts.get(errorClass, 0) + 1
+        if attempts[errorClass] >= tries:
+            if error is not None:
+                raise error
+            response.choices[0].message.content = ''
+            return response
+        delay = random.uniform(0, min(cap, base * 2 ** attempts[errorClass]))
+        tqdm.write(f'{errorClass.capitalize()} error, retrying in {round(delay, 1)}s ({attempts[errorClass]}/{tries - 1})')
+        sleep(delay)
+
+def getErrorClass(error):
+    if isinstance(error, openai.RateLimitError):
+        return 'ratelimit'
+    if isinstance(error, openai.APITimeoutError):
+        return 'timeout'
+    if isinstance(error, openai.APIConnectionError):
+        return 'connection'
+    if isinstance(error, openai.APIStatusError) and error.status_code >= 500:
+        return 'server'
+    return None
+
+def getRefusal(response):
+    choice = response.choices[0]
+    if choice.finish_reason == 'content_filter' or not choice.message.content:
+        return 'refusal'
+    if "I'm sorry, but I'm unable to assist" in choice.message.content:
+        return 'refusal'
+    return None
@@ -1,11 +1,21 @@
 # Libraries
-import json, os, re, textwrap, threading, time, traceback, tiktoken, openai
+import io, json, os, re, textwrap, threading, time, traceback, openai
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from colorama import Fore
 from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.cache import getPrompt, translationMemory
+from modules.extract import setLineLocations, setLocation, textUnits
+from modules.placeholders import compileVars, restoreVars, substituteVars
+from modules.normalize import normalizeText
+from modules.tokens import countPrompt
+from modules.calibration import calibrateEstimate
+from modules.patterns import REGEX, findNametags, isJapanese
+from modules.ratelimit import requestCompletion
+from modules.batching import bisectBatch, dispatchBatches, getBatchSize, indexTranslations, packBatches
+from modules.coalesce import coalesceStrings, submitString
+from modules.writer import encodeText, queueWrite
 from ruamel.yaml import YAML
 
 
@@ -36,11 +46,13 @@ BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
 MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
+UNTRANSLATED = 0    # Lines that never came back from the API and were left in Japanese
 BRACKETNAMES = False
 SKIPTRANSLATE = False
 
 # Pricing - Depends on the model https://openai.com/pricing
-# Batch Size - GPT 3.5 Struggles past 15 lines per request. GPT4 struggles past 50 lines per request
+# Batch Size - Most lines per request, batches are also kept under batchTokens in .env and adaptiveBatch tunes the size from here.
+# GPT 3.5 Struggles past 15 lines per request. GPT4 struggles past 50 lines per request
 # If you are getting a MISMATCH LENGTH error, lower the batch size.
 if 'gpt-3.5' in MODEL:
     INPUTAPICOST = .002 
@@ -93,11 +105,7 @@ def handleACE(filename, estimate):
     # Translate
     if not estimate:
         try:
-            with open('translated/' + filename, 'w', encoding='utf-8') as outFile:
-                yaml=YAML(pure=True)
-                yaml.width = 4096
-                yaml.default_style = "'"
-                yaml.dump(translatedData[0], outFile)
+            queueWrite('translated/' + filename, lambda: dumpYAML(translatedData[0]))
         except Exception:
             traceback.print_exc()
             return 'Fail'
@@ -113,11 +121,22 @@ def handleACE(filename, estimate):
     totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
 
     # Print any errors on maps
+    if UNTRANSLATED > 0:
+        totalString += Fore.RED + f'\nUntranslated Lines: {UNTRANSLATED}' + Fore.RESET
     if len(MISMATCH) > 0:
         return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
     else:
         return totalString
 
+# Runs on the writer thread
+def dumpYAML(data):
+    yaml=YAML(pure=True)
+    yaml.width = 4096
+    yaml.default_style = "'"
+    outFile = io.StringIO()
+    yaml.dump(data, outFile)
+    return encodeText(outFile.getvalue(), 'utf-8', 'strict', None)
+
 def openFiles(filename):
     yaml=YAML(pure=True)   # Need a yaml instance per thread.
     yaml.width = 4096
@@ -240,7 +259,7 @@ def parseMap(data, filename):
                     # if 'LB:' in event['note']:
                         # totalTokens += translateNote(event, r'(?<=LB:)[^u0000-u0080]+')
 
-                    futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in events[key]['pages'] if page is not None]
+                    futures = [executor.submit(searchCodes, page, pbar, [], filename, f'{key}/{p}') for p, page in enumerate(events[key]['pages']) if page is not None]
                     for future in as_completed(futures):
                         try:
                             totalTokensFuture = future.result()
@@ -312,7 +331,7 @@ def parseCommonEvents(data, filename):
         pbar.desc=filename
         pbar.total=totalLines
         with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in data if page is not None]
+            futures = [executor.submit(searchCodes, page, pbar, [], filename, i) for i, page in enumerate(data) if page is not None]
             for future in as_completed(futures):
                 try:
                     totalTokensFuture = future.result()
@@ -337,10 +356,10 @@ def parseTroops(data, filename):
     with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
-        for troop in data:
+        for t, troop in enumerate(data):
             if troop is not None:
                 with ThreadPoolExecutor(max_workers=THREADS) as executor:
-                    futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in troop['pages'] if page is not None]
+                    futures = [executor.submit(searchCodes, page, pbar, [], filename, f'{t}/{p}') for p, page in enumerate(troop['pages']) if page is not None]
                     for future in as_completed(futures):
                         try:
                             totalTokensFuture = future.result()
@@ -444,7 +463,7 @@ def parseScenario(data, filename):
         pbar.desc=filename
         pbar.total=totalLines
         with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            futures = [executor.submit(searchCodes, page[1], pbar, [], filename) for page in data.items() if page[1] is not None]
+            futures = [executor.submit(searchCodes, page[1], pbar, [], filename, page[0]) for page in data.items() if page[1] is not None]
             for future in as_completed(futures):
                 try:
                     totalTokensFuture = future.result()
@@ -788,8 +807,9 @@ def searchNames(data, pbar, context):
 
     return totalTokens
 
-def searchCodes(page, pbar, fillList, filename):
+def searchCodes(page, pbar, fillList, filename, location=''):
     docList = []
+    docLocations = []
     currentGroup = []
     textHistory = []
     match = []
@@ -825,6 +845,7 @@ def searchCodes(page, pbar, fillList, filename):
                     pbar.update(1)
                 if len(codeList) <= i:
                     break
+            setLocation(location, i)
 
             ## Event Code: 401 Show Text
             if codeList[i]['c'] in [401, 405, -1] and (CODE401 or CODE405):
@@ -840,9 +861,9 @@ def searchCodes(page, pbar, fillList, filename):
                     continue
 
                 # Check for Speaker
-                coloredSpeakerList = re.findall(r'^[\\]+[cC]\[[\d]+\](.+?)[\\]+[Cc]\[[\d]\]$', jaString)
+                coloredSpeakerList = REGEX['coloredSpeaker'].findall(jaString)
                 if len(coloredSpeakerList) == 0:
-                    coloredSpeakerList = re.findall(r'^【(.*?)】$', jaString)
+                    coloredSpeakerList = REGEX['bracketSpeaker'].findall(jaString)
                 if len(coloredSpeakerList) != 0 and codeList[i+1]['c'] in [401, 405, -1]:
                     # Get Speaker
                     response = getSpeaker(coloredSpeakerList[0])
@@ -895,12 +916,12 @@ def searchCodes(page, pbar, fillList, filename):
                     ### \\n<Speaker>
                     nCase = None
                     if finalJAString[0] != '\\':
-                        regex = r'(.*?)([\\]+[nN][wWcC]?<(.*?)>.*)'
+                        regex = REGEX['nametagAfter']
                         nCase = 0
                     else:
-                        regex = r'(.*[\\]+[nN][wWcC]?<(.*?)>)(.*)'
+                        regex = REGEX['nametagBefore']
                         nCase = 1
-                    matchList = re.findall(regex, finalJAString)
+                    matchList = findNametags(regex, finalJAString)
                     if len(matchList) > 0:  
                         if nCase == 0:
                             nametag = matchList[0][1]
@@ -927,8 +948,7 @@ def searchCodes(page, pbar, fillList, filename):
                             codeList[i]['p'] = [nametag + finalJAString]
                             
                     ### Brackets
-                    matchList = re.findall\
-                        (r'^([\\]+[cC]\[[0-9]+\]【?(.+?)】?[\\]+[cC]\[[0-9]+\])|^(【(.+)】)', finalJAString)  
+                    matchList = REGEX['bracketName'].findall(finalJAString)  
                     
                     # Handle both cases of the regex  
                     if len(matchList) != 0 and BRACKETNAMES is True:
@@ -965,41 +985,34 @@ def searchCodes(page, pbar, fillList, filename):
 
                     # Catch Vars that may break the TL
                     varString = ''
-                    matchList = re.findall(r'^[\\]+[\w]+\[[a-zA-Z0-9\\\[\]\_]+\]', finalJAString)    
+                    matchList = REGEX['startCodeAce'].findall(finalJAString)    
                     if len(matchList) != 0:
                         varString = matchList[0]
                         finalJAString = finalJAString.replace(matchList[0], '')
 
                     # Remove any textwrap
                     if FIXTEXTWRAP is True:
-                        finalJAString = re.sub(r'\n', ' ', finalJAString)
+                        finalJAString = finalJAString.replace('\n', ' ')
                         finalJAString = finalJAString.replace('<br>', ' ')
 
                     # Remove Extra Stuff bad for translation.
-                    finalJAString = finalJAString.replace('ﾞ', '')
-                    finalJAString = finalJAString.replace('・', '.')
-                    finalJAString = finalJAString.replace('―', '-')
-                    finalJAString = finalJAString.replace('ー', '-')
-                    finalJAString = finalJAString.replace('…', '...')
-                    finalJAString = finalJAString.replace('。', '.')
-                    finalJAString = re.sub(r'(\.{3}\.+)', '...', finalJAString)
-                    finalJAString = finalJAString.replace('　', '')
+                    finalJAString = normalizeText(finalJAString, 'rpgmaker')
 
                     # Remove any RPGMaker Code at start
-                    ffMatchList = re.findall(r'[\\]+[fFaA]+\[.+?\]', finalJAString)
+                    ffMatchList = REGEX['faceCode'].findall(finalJAString)
                     if len(ffMatchList) > 0:
                         finalJAString = finalJAString.replace(ffMatchList[0], '')
                         nametag += ffMatchList[0]
 
                     ### Remove format codes
                     # Furigana
-                    rcodeMatch = re.findall(r'([\\]+[r][b]?\[.+?,(.+?)\])', finalJAString)
+                    rcodeMatch = REGEX['furigana'].findall(finalJAString)
                     if len(rcodeMatch) > 0:
                         for match in rcodeMatch:
                             finalJAString = finalJAString.replace(match[0],match[1])
 
                     # Formatting
-                    formatMatch = re.findall(r'[\\]+[!><.|#^{}]', finalJAString)
+                    formatMatch = REGEX['formatCode'].findall(finalJAString)
                     if len(formatMatch) > 0:
                         for match in formatMatch:
                             finalJAString = finalJAString.replace(match, '')
@@ -1011,7 +1024,7 @@ def searchCodes(page, pbar, fillList, filename):
 
                     # If there isn't any Japanese in the text just skip
                     if IGNORETLTEXT is True:
-                        if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', finalJAString):
+                        if not isJapanese(finalJAString):
                             # Keep textHistory list at length maxHistory
                             textHistory.append('\"' + finalJAString + '\"')
                             if len(textHistory) > maxHistory:
@@ -1030,6 +1043,7 @@ def searchCodes(page, pbar, fillList, filename):
                         else:
                             docList.append(speaker)
                             textHistory.append(speaker)
+                        docLocations.append(j)
                         speaker = ''
                         match = []
                         currentGroup = []
@@ -1042,11 +1056,11 @@ def searchCodes(page, pbar, fillList, filename):
                         
                         # Remove speaker
                         if speaker != '':
-                            matchSpeakerList = re.findall(r'(^.+?)\s?[|:]\s?', translatedText)
+                            matchSpeakerList = REGEX['speakerPrefix'].findall(translatedText)
                             if len(matchSpeakerList) > 0:
                                 newSpeaker = matchSpeakerList[0]
                                 nametag = nametag.replace(speaker, newSpeaker)
-                            translatedText = re.sub(r'(^.+?)\s?[|:]\s?', '', translatedText)
+                            translatedText = REGEX['speakerPrefix'].sub('', translatedText)
 
                         # Textwrap
                         if FIXTEXTWRAP is True:
@@ -1101,7 +1115,7 @@ def searchCodes(page, pbar, fillList, filename):
                     continue
 
                 # Need to remove outside code and put it back later
-                matchList = re.findall(r"[\'\"\`](.*)[\'\"\`]", jaString)
+                matchList = REGEX['quoted'].findall(jaString)
                 
                 for match in matchList:
                     # Remove Textwrap
@@ -1140,20 +1154,20 @@ def searchCodes(page, pbar, fillList, filename):
                         continue
 
                     # If there isn't any Japanese in the text just skip
-                    if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                    if not isJapanese(jaString):
                         continue
 
                     # Need to remove outside code and put it back later
                     oldjaString = jaString
-                    startString = re.search(r'^[^一-龠ぁ-ゔァ-ヴー【】（）「」a-zA-ZＡ-Ｚ０-９\\]+', jaString)
-                    finalJAString = re.sub(r'^[^一-龠ぁ-ゔァ-ヴー【】（）「」a-zA-ZＡ-Ｚ０-９\\]+', '', jaString)
+                    startString = REGEX['leadingSymbols'].search(jaString)
+                    finalJAString = REGEX['leadingSymbols'].sub('', jaString)
                     if startString is None:
                         startString = ''
                     else:
                         startString = startString.group()
 
                     # Remove any textwrap
-                    finalJAString = re.sub(r'\n', ' ', finalJAString)
+                    finalJAString = finalJAString.replace('\n', ' ')
 
                     # Translate
                     response = translateGPT(finalJAString, '', False)
@@ -1179,14 +1193,14 @@ def searchCodes(page, pbar, fillList, filename):
                         continue
 
                     # If there isn't any Japanese in the text just skip
-                    if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                    if not isJapanese(jaString):
                         continue
 
                     # Remove outside text
-                    startString = re.search(r'^[^一-龠ぁ-ゔァ-ヴー\<\>【】\\]+', jaString)
-                    jaString = re.sub(r'^[^一-龠ぁ-ゔァ-ヴー\<\>【】\\]+', '', jaString)
-                    endString = re.search(r'[^一-龠ぁ-ゔァ-ヴー\<\>【】。！？\\]+$', jaString)
-                    jaString = re.sub(r'[^一-龠ぁ-ゔァ-ヴー\<\>【】。！？\\]+$', '', jaString)
+                    startString = REGEX['leadingCode'].search(jaString)
+                    jaString = REGEX['leadingCode'].sub('', jaString)
+                    endString = REGEX['trailingCode'].search(jaString)
+                    jaString = REGEX['trailingCode'].sub('', jaString)
                     if startString is None:
                         startString = ''
                     else:
@@ -1197,7 +1211,7 @@ def searchCodes(page, pbar, fillList, filename):
                         endString = endString.group()
 
                     # Remove any textwrap
-                    jaString = re.sub(r'\n', ' ', jaString)
+                    jaString = jaString.replace('\n', ' ')
 
                     # Translate
                     response = translateGPT(jaString, '', True)
@@ -1243,15 +1257,15 @@ def searchCodes(page, pbar, fillList, filename):
                     continue
 
                 # If there isn't any Japanese in the text just skip
-                if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                if not isJapanese(jaString):
                     speaker = jaString
                     continue
 
                 # Need to remove outside code and put it back later
-                startString = re.search(r'^[^一-龠ぁ-ゔァ-ヴー\<\>【】]+', jaString)
-                jaString = re.sub(r'^[^一-龠ぁ-ゔァ-ヴー\<\>【】]+', '', jaString)
-                endString = re.search(r'[^一-龠ぁ-ゔァ-ヴー\<\>【】。！？]+$', jaString)
-                jaString = re.sub(r'[^一-龠ぁ-ゔァ-ヴー\<\>【】。！？]+$', '', jaString)
+                startString = REGEX['leadingScript'].search(jaString)
+                jaString = REGEX['leadingScript'].sub('', jaString)
+                endString = REGEX['trailingScript'].search(jaString)
+                jaString = REGEX['trailingScript'].sub('', jaString)
                 if startString is None: startString = ''
                 else:  startString = startString.group() + ' '
                 if endString is None: endString = ''
@@ -1282,7 +1296,7 @@ def searchCodes(page, pbar, fillList, filename):
                 jaString = codeList[i]['p'][0]
 
                 # If there isn't any Japanese in the text just skip
-                # if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                # if not isJapanese(jaString):
                 #     continue
 
                 # Skip These
@@ -1296,12 +1310,12 @@ def searchCodes(page, pbar, fillList, filename):
                     continue
 
                 # Need to remove outside code and put it back later
-                matchList = re.findall(r'.+"(.*?)".*[;,]$', jaString)
+                matchList = REGEX['quotedScript'].findall(jaString)
 
                 # Translate
                 if len(matchList) > 0:
                     # If there isn't any Japanese in the text just skip
-                    # if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', matchList[0]):
+                    # if not isJapanese(matchList[0]):
                     #     continue
 
                     # Remove Textwrap
@@ -1331,18 +1345,18 @@ def searchCodes(page, pbar, fillList, filename):
                 jaString = codeList[i]['p'][0]
 
                 # If there isn't any Japanese in the text just skip
-                if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                if not isJapanese(jaString):
                     continue
 
                 if 'secretText' in jaString:
-                    regex = r'secretText:\s?(.+)'
+                    regex = REGEX['secretText']
                 elif 'title' in jaString:
-                    regex = r'title:\s?(.+)'
+                    regex = REGEX['title']
                 else:
-                    regex = r'(.+)'
+                    regex = REGEX['wholeLine']
 
                 # Need to remove outside code and put it back later
-                matchList = re.findall(regex, jaString)
+                matchList = regex.findall(jaString)
                 
                 for match in matchList:
                     # Remove Textwrap
@@ -1371,23 +1385,23 @@ def searchCodes(page, pbar, fillList, filename):
                 jaString = codeList[i]['p'][0]
 
                 # If there isn't any Japanese in the text just skip
-                if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                if not isJapanese(jaString):
                     continue
 
                 # Translate
                 if 'info:' in jaString:
-                    regex = r'info:(.*)'
+                    regex = REGEX['info']
                 elif 'ActiveMessage:' in jaString:
-                    regex = r'<ActiveMessage:(.*)>'
+                    regex = REGEX['activeMessage']
                 elif 'タイトル：' in jaString:
-                    regex = r'タイトル：(.*)'
+                    regex = REGEX['titleJA']
                 elif '内容：' in jaString:
-                    regex = r'内容：(.*)'
+                    regex = REGEX['contentJA']
                 else:
                     continue
 
                 # Need to remove outside code and put it back later
-                matchList = re.findall(regex, jaString)
+                matchList = regex.findall(jaString)
 
                 # Translate
                 if len(matchList) > 0:
@@ -1414,7 +1428,7 @@ def searchCodes(page, pbar, fillList, filename):
 
                 # Grab Speaker
                 if 'Tachie showName' in jaString:
-                    matchList = re.findall(r'Tachie showName (.+)', jaString)
+                    matchList = REGEX['tachieName'].findall(jaString)
                     if len(matchList) > 0:
                         # Translate
                         response = translateGPT(matchList[0], 'Reply with the '+ LANGUAGE +' translation of the NPC name.', False)
@@ -1431,10 +1445,10 @@ def searchCodes(page, pbar, fillList, filename):
                 # Want to translate this script
                 if 'D_TEXT ' in jaString:
                     # Remove any textwrap
-                    jaString = re.sub(r'\n', '_', jaString)
+                    jaString = jaString.replace('\n', '_')
 
                     # Capture Arguments and text
-                    dtextList = re.findall(r'D_TEXT\s(.+)\s|D_TEXT\s(.+)', jaString)
+                    dtextList = REGEX['dText'].findall(jaString)
                     if len(dtextList) > 0:
                         if dtextList[0][0] != '':
                             dtext = dtextList[0][0]
@@ -1453,7 +1467,7 @@ def searchCodes(page, pbar, fillList, filename):
                             codeList[i]['p'][0] = ''
                             i += 1
                             jaString = codeList[i]['p'][0]
-                            dtextList = re.findall(r'D_TEXT\s(.+)\s|D_TEXT\s(.+)', jaString)
+                            dtextList = REGEX['dText'].findall(jaString)
                             if len(dtextList) > 0:
                                 if dtextList[0][0] != '':
                                     dtext = dtextList[0][0]
@@ -1500,13 +1514,13 @@ def searchCodes(page, pbar, fillList, filename):
 
                 if 'ShowInfo ' in jaString:
                     # Remove any textwrap
-                    jaString = re.sub(r'\n', '_', jaString)
+                    jaString = jaString.replace('\n', '_')
 
                     # _SEItem1
                     if '_SE' in jaString:
-                        infoList = re.findall(r'\_SE\[.+?\](.+)', jaString)
+                        infoList = REGEX['infoSE'].findall(jaString)
                     else:
-                        infoList = re.findall(r'ShowInfo (.+)', jaString)
+                        infoList = REGEX['showInfo'].findall(jaString)
 
                     # Capture Arguments and text
                     if len(infoList) > 0:
@@ -1514,7 +1528,7 @@ def searchCodes(page, pbar, fillList, filename):
                         originalInfo = info
 
                         # Remove underscores
-                        info = re.sub(r'_', ' ', info)
+                        info = info.replace('_', ' ')
 
                         # Using this to keep track of 401's in a row. Throws IndexError at EndOfList (Expected Behavior)
                         currentGroup.append(info)
@@ -1528,9 +1542,9 @@ def searchCodes(page, pbar, fillList, filename):
                             i += 1
                             jaString = codeList[i]['p'][0]
                             if '_SE' in jaString:
-                                infoList = re.findall(r'\_SE\[.+?\](.+)', jaString)
+                                infoList = REGEX['infoSE'].findall(jaString)
                             else:
-                                infoList = re.findall(r'ShowInfo (.+)', jaString)
+                                infoList = REGEX['showInfo'].findall(jaString)
                             if len(infoList) > 0:
                                 dtext = infoList[0]
                                 currentGroup.append(info)
@@ -1545,7 +1559,7 @@ def searchCodes(page, pbar, fillList, filename):
                         currentGroup = [] 
                     
                         # Remove any textwrap
-                        jaString = re.sub(r'\n', '_', jaString)
+                        jaString = jaString.replace('\n', '_')
 
                         # Translate
                         response = translateGPT(finalJAString, 'Reply with the '+ LANGUAGE +' Translation.', False)
@@ -1571,16 +1585,16 @@ def searchCodes(page, pbar, fillList, filename):
 
                 if 'PushGab ' in jaString:
                     # Remove any textwrap
-                    jaString = re.sub(r'\n', '_', jaString)
+                    jaString = jaString.replace('\n', '_')
 
                     # Capture Arguments and text
-                    infoList = re.findall(r'PushGab [0-9]+ (.+)', jaString)
+                    infoList = REGEX['pushGab'].findall(jaString)
                     if len(infoList) > 0:
                         info = infoList[0]
                         originalInfo = info
 
                         # Remove underscores
-                        info = re.sub(r'_', ' ', info)
+                        info = info.replace('_', ' ')
 
                         # Using this to keep track of 401's in a row. Throws IndexError at EndOfList (Expected Behavior)
                         currentGroup.append(info)
@@ -1593,7 +1607,7 @@ def searchCodes(page, pbar, fillList, filename):
                             codeList[i]['p'][0] = ''
                             i += 1
                             jaString = codeList[i]['p'][0]
-                            infoList = re.findall(r'PushGab [0-9]+ (.+)', jaString)
+                            infoList = REGEX['pushGab'].findall(jaString)
                             if len(infoList) > 0:
                                 dtext = infoList[0]
                                 currentGroup.append(info)
@@ -1608,7 +1622,7 @@ def searchCodes(page, pbar, fillList, filename):
                         currentGroup = [] 
                     
                         # Remove any textwrap
-                        jaString = re.sub(r'\n', '_', jaString)
+                        jaString = jaString.replace('\n', '_')
 
                         # Translate
                         response = translateGPT(finalJAString, 'Reply with the '+ LANGUAGE +' Translation.', False)
@@ -1634,8 +1648,8 @@ def searchCodes(page, pbar, fillList, filename):
 
                 if 'addLog ' in jaString:
                     # Remove any textwrap
-                    jaString = re.sub(r'\n', '_', jaString)
-                    infoList = re.findall(r'addLog (.+)', jaString)
+                    jaString = jaString.replace('\n', '_')
+                    infoList = REGEX['addLog'].findall(jaString)
 
                     # Capture Arguments and text
                     if len(infoList) > 0:
@@ -1643,7 +1657,7 @@ def searchCodes(page, pbar, fillList, filename):
                         originalInfo = info
 
                         # Remove underscores
-                        info = re.sub(r'_', ' ', info)
+                        info = info.replace('_', ' ')
 
                         # Using this to keep track of 401's in a row. Throws IndexError at EndOfList (Expected Behavior)
                         currentGroup.append(info)
@@ -1656,7 +1670,7 @@ def searchCodes(page, pbar, fillList, filename):
                             codeList[i]['p'][0] = ''
                             i += 1
                             jaString = codeList[i]['p'][0]
-                            infoList = re.findall(r'addLog (.+)', jaString)
+                            infoList = REGEX['addLog'].findall(jaString)
                             if len(infoList) > 0:
                                 dtext = infoList[0]
                                 currentGroup.append(info)
@@ -1671,7 +1685,7 @@ def searchCodes(page, pbar, fillList, filename):
                         currentGroup = [] 
                     
                         # Remove any textwrap
-                        jaString = re.sub(r'\n', '_', jaString)
+                        jaString = jaString.replace('\n', '_')
 
                         # Translate
                         response = translateGPT(finalJAString, 'Reply with the '+ LANGUAGE +' Translation.', False)
@@ -1695,7 +1709,7 @@ def searchCodes(page, pbar, fillList, filename):
                     else:
                         continue
                 if 'namePop' in jaString:
-                    matchList = re.findall(r'namePop\s\d+\s(.+?)\s.+', jaString)
+                    matchList = REGEX['namePop'].findall(jaString)
                     if len(matchList) > 0:
                         # Translate
                         text = matchList[0]
@@ -1709,7 +1723,7 @@ def searchCodes(page, pbar, fillList, filename):
                         codeList[i]['p'][0] = translatedText
 
                 if 'LL_InfoPopupWIndowMV' in jaString:
-                    matchList = re.findall(r'LL_InfoPopupWIndowMV\sshowWindow\s(.+?)\s.+', jaString)
+                    matchList = REGEX['infoPopup'].findall(jaString)
                     if len(matchList) > 0:
                         # Translate
                         text = matchList[0]
@@ -1738,8 +1752,8 @@ def searchCodes(page, pbar, fillList, filename):
                     # If and En Statements
                     ifVar = ''
                     enVar = ''
-                    ifList = re.findall(r'(if\(.*\))', jaString)
-                    enList = re.findall(r'(en\(.*\))', jaString)
+                    ifList = REGEX['ifScript'].findall(jaString)
+                    enList = REGEX['enScript'].findall(jaString)
                     if len(ifList) != 0:
                         jaString = jaString.replace(ifList[0], '')
                         ifVar = ifList[0]
@@ -1791,7 +1805,7 @@ def searchCodes(page, pbar, fillList, filename):
                         continue
 
                     # Need to remove outside code and put it back later
-                    matchList = re.findall(r"'(.*?)'", jaString)
+                    matchList = REGEX['singleQuoted'].findall(jaString)
                     
                     for match in matchList:
                         response = translateGPT(match, '', False)
@@ -1821,7 +1835,7 @@ def searchCodes(page, pbar, fillList, filename):
                     continue
 
                 # If there isn't any Japanese in the text just skip
-                if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                if not isJapanese(jaString):
                     continue
                 
                 response = translateGPT(jaString, 'Reply with the '+ LANGUAGE +' translation of the NPC name.', False)
@@ -1839,6 +1853,7 @@ def searchCodes(page, pbar, fillList, filename):
 
         # End of the line
         if docList != [] and fillList != '':
+            setLineLocations(location, docLocations)
             response = translateGPT(docList, textHistory, True)
             fillList = response[0]
             totalTokens[0] += response[1][0]
@@ -1967,37 +1982,40 @@ def searchSystem(data, pbar):
     data['game_title'] = response[0].strip('.')
     pbar.update(1)
     
-    # Terms
+    # Terms, every string in a list is sent before waiting so they go out together
     for term in data['terms']:
         if term != 'messages':
             termList = data['terms'][term]
-            for i in range(len(termList)):  # Last item is a messages object
-                if termList[i] is not None:
-                    response = translateGPT(termList[i], context, False)
-                    totalTokens[0] += response[1][0]
-                    totalTokens[1] += response[1][1]
-                    termList[i] = response[0].replace('\"', '').strip()
-                    pbar.update(1)
+            futures = [[i, submitString(translateGPT, termList[i], context)] for i in range(len(termList)) if termList[i] is not None]  # Last item is a messages object
+            for i, future in futures:
+                response = future.result()
+                totalTokens[0] += response[1][0]
+                totalTokens[1] += response[1][1]
+                termList[i] = response[0].replace('\"', '').strip()
+                pbar.update(1)
 
     # Armor Types
-    for i in range(len(data['armor_types'])):
-        response = translateGPT(data['armor_types'][i], 'Reply with only the '+ LANGUAGE +' translation of the armor type', False)
+    futures = [submitString(translateGPT, text, 'Reply with only the '+ LANGUAGE +' translation of the armor type') for text in data['armor_types']]
+    for i, future in enumerate(futures):
+        response = future.result()
         totalTokens[0] += response[1][0]
         totalTokens[1] += response[1][1]
         data['armor_types'][i] = response[0].replace('\"', '').strip()
         pbar.update(1)
 
     # Skill Types
-    for i in range(len(data['skill_types'])):
-        response = translateGPT(data['skill_types'][i], 'Reply with only the '+ LANGUAGE +' translation', False)
+    futures = [submitString(translateGPT, text, 'Reply with only the '+ LANGUAGE +' translation') for text in data['skill_types']]
+    for i, future in enumerate(futures):
+        response = future.result()
         totalTokens[0] += response[1][0]
         totalTokens[1] += response[1][1]
         data['skill_types'][i] = response[0].replace('\"', '').strip()
         pbar.update(1)
 
     # Equip Types
-    for i in range(len(data['weapon_types'])):
-        response = translateGPT(data['weapon_types'][i], 'Reply with only the '+ LANGUAGE +' translation of the equipment type. No disclaimers.', False)
+    futures = [submitString(translateGPT, text, 'Reply with only the '+ LANGUAGE +' translation of the equipment type. No disclaimers.') for text in data['weapon_types']]
+    for i, future in enumerate(futures):
+        response = future.result()
         totalTokens[0] += response[1][0]
         totalTokens[1] += response[1][1]
         data['weapon_types'][i] = response[0].replace('\"', '').strip()
@@ -2035,124 +2053,14 @@ def getSpeaker(speaker):
                                
     return [speaker,[0,0]]
 
-def subVars(jaString):
-    jaString = jaString.replace('\u3000', ' ')
-
-    # Nested
-    count = 0
-    nestedList = re.findall(r'[\\]+[\w]+\[[\\]+[\w]+\[[0-9]+\]\]', jaString)
-    nestedList = set(nestedList)
-    if len(nestedList) != 0:
-        for icon in nestedList:
-            jaString = jaString.replace(icon, '[Nested_' + str(count) + ']')
-            count += 1
-
-    # Icons
-    count = 0
-    iconList = re.findall(r'[\\]+[iIkKwWaA]+\[[0-9]+\]', jaString)
-    iconList = set(iconList)
-    if len(iconList) != 0:
-        for icon in iconList:
-            jaString = jaString.replace(icon, '[Ascii_' + str(count) + ']')
-            count += 1
-
-    # Colors
-    count = 0
-    colorList = re.findall(r'[\\]+[cC]\[[0-9]+\]', jaString)
-    colorList = set(colorList)
-    if len(colorList) != 0:
-        for color in colorList:
-            jaString = jaString.replace(color, '[Color_' + str(count) + ']')
-            count += 1
-
-    # Names
-    count = 0
-    nameList = re.findall(r'[\\]+[nN]\[.+?\]+', jaString)
-    nameList = set(nameList)
-    if len(nameList) != 0:
-        for name in nameList:
-            jaString = jaString.replace(name, '[Noun_' + str(count) + ']')
-            count += 1
-
-    # Variables
-    count = 0
-    varList = re.findall(r'[\\]+[vV]\[[0-9]+\]', jaString)
-    varList = set(varList)
-    if len(varList) != 0:
-        for var in varList:
-            jaString = jaString.replace(var, '[Var_' + str(count) + ']')
-            count += 1
+# Placeholders
+PLACEHOLDERS = compileVars('[]', r'[\\]+[\w]*\[[\w\\\[\]]+\]')
 
-    # Formatting
-    count = 0
-    formatList = re.findall(r'[\\]+[\w]*\[[\w\\\[\]]+\]', jaString)
-    formatList = set(formatList)
-    if len(formatList) != 0:
-        for var in formatList:
-            jaString = jaString.replace(var, '[FCode_' + str(count) + ']')
-            count += 1
-
-    # Put all lists in list and return
-    allList = [nestedList, iconList, colorList, nameList, varList, formatList]
-    return [jaString, allList]
+def subVars(jaString):
+    return substituteVars(jaString, PLACEHOLDERS)
 
 def resubVars(translatedText, allList):
-    # Fix Spacing and ChatGPT Nonsense
-    matchList = re.findall(r'\[\s?.+?\s?\]', translatedText)
-    if len(matchList) > 0:
-        for match in matchList:
-            text = match.strip()
-            translatedText = translatedText.replace(match, text)
-
-    # Nested
-    count = 0
-    if len(allList[0]) != 0:
-        for var in allList[0]:
-            translatedText = translatedText.replace('[Nested_' + str(count) + ']', var)
-            count += 1
-
-    # Icons
-    count = 0
-    if len(allList[1]) != 0:
-        for var in allList[1]:
-            translatedText = translatedText.replace('[Ascii_' + str(count) + ']', var)
-            count += 1
-
-    # Colors
-    count = 0
-    if len(allList[2]) != 0:
-        for var in allList[2]:
-            translatedText = translatedText.replace('[Color_' + str(count) + ']', var)
-            count += 1
-
-    # Names
-    count = 0
-    if len(allList[3]) != 0:
-        for var in allList[3]:
-            translatedText = translatedText.replace('[Noun_' + str(count) + ']', var)
-            count += 1
-
-    # Vars
-    count = 0
-    if len(allList[4]) != 0:
-        for var in allList[4]:
-            translatedText = translatedText.replace('[Var_' + str(count) + ']', var)
-            count += 1
-    
-    # Formatting
-    count = 0
-    if len(allList[5]) != 0:
-        for var in allList[5]:
-            translatedText = translatedText.replace('[FCode_' + str(count) + ']', var)
-            count += 1
-
-    return translatedText
-
-def batchList(input_list, batch_size):
-    if not isinstance(batch_size, int) or batch_size <= 0:
-        raise ValueError("batch_size must be a positive integer")
-        
-    return [input_list[i:i + batch_size] for i in range(0, len(input_list), batch_size)]
+    return restoreVars(translatedText, allList, PLACEHOLDERS)
 
 def createContext(fullPromptFlag, subbedT):
     characters = 'Game Characters:\n\
@@ -2201,7 +2109,10 @@ def translateText(characters, system, user, history):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+
+    # Rate Limit and Retry
+    response = requestCompletion(
+        lambda: countTokens(characters, system, user, history),
         temperature=0.1,
         frequency_penalty=0.1,
         presence_penalty=0.1,
@@ -2211,80 +2122,95 @@ def translateText(characters, system, user, history):
     return response
 
 def cleanTranslatedText(translatedText, varResponse):
-    placeholders = {
-        f'{LANGUAGE} Translation: ': '',
-        'Translation: ': '',
-        'っ': '',
-        '〜': '~',
-        'ー': '-',
-        'ッ': '',
-        '。': '.',
-        'Placeholder Text': ''
-        # Add more replacements as needed
-    }
-    for target, replacement in placeholders.items():
-        translatedText = translatedText.replace(target, replacement)
+    translatedText = normalizeText(translatedText, 'translation')
 
     translatedText = resubVars(translatedText, varResponse[1])
     return translatedText
 
 def extractTranslation(translatedTextList, is_list):
-    pattern = r'`?<Line\d+>([\\]*.*?[\\]*?)<\/?Line\d+>`?'
+    pattern = r'`?<Line(\d+)>([\\]*.*?[\\]*?)<\/?Line\d+>`?'
     # If it's a batch (i.e., list), extract with tags; otherwise, return the single item.
     if is_list:
         matchList = re.findall(pattern, translatedTextList)
         return matchList
     else:
         matchList = re.findall(pattern, translatedTextList)
-        return matchList[0][0] if matchList else translatedTextList
+        return matchList[0][1] if matchList else translatedTextList
 
 def countTokens(characters, system, user, history):
-    inputTotalTokens = 0
-    outputTotalTokens = 0
-    enc = tiktoken.encoding_for_model(MODEL)
-    
-    # Input
-    if isinstance(history, list):
-        for line in history:
-            inputTotalTokens += len(enc.encode(line))
-    else:
-        inputTotalTokens += len(enc.encode(history))
-    inputTotalTokens += len(enc.encode(system))
-    inputTotalTokens += len(enc.encode(characters))
-    inputTotalTokens += len(enc.encode(user))
-
-    # Output
-    outputTotalTokens += round(len(enc.encode(user))/1.5)
-
-    return [inputTotalTokens, outputTotalTokens]
+    return countPrompt(MODEL, characters, system, user, history)
 
 def combineList(tlist, text):
     if isinstance(text, list):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+def translateBatch(batch, history, fullPromptFlag):
+    # Before sending to translation, add the formatting
+    payload = '\n'.join([f'`<Line{i}>{item}</Line{i}>`' for i, item in enumerate(batch)])
+    payload = payload.replace('><', '>Placeholder Text<')
+    varResponse = subVars(payload)
+    subbedT = varResponse[0]
+
+    # Things to Check before starting translation
+    if not re.search(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]+', subbedT):
+        return [dict(enumerate(batch)), [0, 0]]
+
+    # Create Message
+    characters, system, user = createContext(fullPromptFlag, subbedT)
+
+    # Calculate Estimate
+    if ESTIMATE:
+        return [dict(enumerate(batch)), calibrateEstimate(MODEL, __name__, countTokens(characters, system, user, history))]
+
+    # Translating
+    response = translateText(characters, system, user, history)
+    translatedText = response.choices[0].message.content
+    totalTokens = [response.usage.prompt_tokens, response.usage.completion_tokens]
+
+    # Formatting
+    translatedText = cleanTranslatedText(translatedText, varResponse)
+    extractedTranslations = extractTranslation(translatedText, True)
+    return [indexTranslations(extractedTranslations, len(batch)), totalTokens]
+
+# Batches recover from mismatches by resending the missing lines
+def translateChunk(batch, history, fullPromptFlag):
+    global UNTRANSLATED
+    response = bisectBatch(batch, lambda batch: translateBatch(batch, history, fullPromptFlag), None if ESTIMATE else MODEL,
+                           getPrompt(globals(), fullPromptFlag))
+
+    # Lines that never came back stay untranslated
+    extractedTranslations = response[0]
+    missing = [i for i, line in enumerate(extractedTranslations) if line is None]
+    for i in missing:
+        extractedTranslations[i] = batch[i]
+    with LOCK:
+        UNTRANSLATED += len(missing)
+    return [extractedTranslations, response[1]]
+
+@textUnits
+@translationMemory
+@coalesceStrings
 def translateGPT(text, history, fullPromptFlag):
-    mismatch = False
     
     if SKIPTRANSLATE:
         return [text, [0,0]]
     totalTokens = [0, 0]
+
+    # Batches, sent one after another or at the same time with concurrentBatches
     if isinstance(text, list):
-        tList = batchList(text, BATCHSIZE)
-    else:
-        tList = [text]
+        tList = packBatches(text, getBatchSize(MODEL, BATCHSIZE), MODEL)
+        responses = dispatchBatches(tList, history, lambda batch, history: translateChunk(batch, history, fullPromptFlag))
+        for response in responses:
+            totalTokens[0] += response[1][0]
+            totalTokens[1] += response[1][1]
+        finalList = combineList([response[0] for response in responses], text)
+        return [finalList, totalTokens]
 
+    tList = [text]
     for index, tItem in enumerate(tList):
-        # Before sending to translation, if we have a list of items, add the formatting
-        if isinstance(tItem, list):
-            payload = '\n'.join([f'`<Line{i}>{item}</Line{i}>`' for i, item in enumerate(tItem)])
-            payload = payload.replace('><', '>Placeholder Text<')
-            varResponse = subVars(payload)
-            subbedT = varResponse[0]
-        else:
-            varResponse = subVars(tItem)
-            subbedT = varResponse[0]
+        varResponse = subVars(tItem)
+        subbedT = varResponse[0]
 
         # Things to Check before starting translation
         if not re.search(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]+', subbedT):
@@ -2295,7 +2221,7 @@ def translateGPT(text, history, fullPromptFlag):
 
         # Calculate Estimate
         if ESTIMATE:
-            estimate = countTokens(characters, system, user, history)
+            estimate = calibrateEstimate(MODEL, __name__, countTokens(characters, system, user, history))
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -2306,35 +2232,14 @@ def translateGPT(text, history, fullPromptFlag):
         totalTokens[0] += response.usage.prompt_tokens
         totalTokens[1] += response.usage.completion_tokens
 
+        # Refused, keep the original text
+        if translatedText == '':
+            continue
+
         # Formatting
         translatedText = cleanTranslatedText(translatedText, varResponse)
-        if isinstance(tItem, list):
-            extractedTranslations = extractTranslation(translatedText, True)
-            tList[index] = extractedTranslations
-            if len(tItem) != len(extractedTranslations):
-                # Mismatch. Try Again
-                response = translateText(characters, system, user, history)
-                translatedText = response.choices[0].message.content
-                totalTokens[0] += response.usage.prompt_tokens
-                totalTokens[1] += response.usage.completion_tokens
-
-                # Formatting
-                translatedText = cleanTranslatedText(translatedText, varResponse)
-                if isinstance(tItem, list):
-                    extractedTranslations = extractTranslation(translatedText, True)
-                    tList[index] = extractedTranslations
-                    if len(tItem) != len(extractedTranslations):
-                        mismatch = True # Just here for breakpoint
-
-            # Create History
-            if not mismatch:
-                history = extractedTranslations[-10:]  # Update history if we have a list
-            else:
-                history = text[-10:]
-        else:
-            # Ensure we're passing a single string to extractTranslation
-            extractedTranslations = extractTranslation(translatedText, False)
-            tList[index] = extractedTranslations
+        extractedTranslations = extractTranslation(translatedText, False)
+        tList[index] = extractedTranslations
 
     finalList = combineList(tList, text)
     return [finalList, totalTokens]
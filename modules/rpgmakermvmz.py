@@ -1,11 +1,24 @@
 # Libraries
-import json, os, re, textwrap, threading, time, traceback, tiktoken, openai
+import os, re, textwrap, threading, time, traceback, openai
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from colorama import Fore
 from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.cache import getPrompt, translationMemory
+from modules.extract import setLineLocations, setLocation, textUnits
+from modules.placeholders import compileVars, restoreVars, substituteVars
+from modules.normalize import normalizeText
+from modules.tokens import countPrompt
+from modules.calibration import calibrateEstimate
+from modules.patterns import REGEX, findNametags, isJapanese
+from modules.ratelimit import requestCompletion
+from modules.batching import bisectBatch, dispatchBatches, getBatchSize, indexTranslations, packBatches
+import modules.coalesce as coalesce
+from modules.coalesce import coalesceStrings, submitString, translatePages
+from modules.jsonio import readJSON
+from modules.jsonstream import WINDOW, abortItems, finishItems, isLarge, readItems, startItems, writeItem
+from modules.writer import writeJSON
 
 # Open AI
 load_dotenv()
@@ -34,10 +47,12 @@ BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
 MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
+UNTRANSLATED = 0    # Lines that never came back from the API and were left in Japanese
 BRACKETNAMES = False
 
 # Pricing - Depends on the model https://openai.com/pricing
-# Batch Size - GPT 3.5 Struggles past 15 lines per request. GPT4 struggles past 50 lines per request
+# Batch Size - Most lines per request, batches are also kept under batchTokens in .env and adaptiveBatch tunes the size from here.
+# GPT 3.5 Struggles past 15 lines per request. GPT4 struggles past 50 lines per request
 # If you are getting a MISMATCH LENGTH error, lower the batch size.
 if 'gpt-3.5' in MODEL:
     INPUTAPICOST = .002 
@@ -87,11 +102,10 @@ def handleMVMZ(filename, estimate):
     start = time.time()
     translatedData = openFiles(filename)
     
-    # Translate
-    if not estimate:
+    # Translate, streamed files are already written
+    if not estimate and translatedData[0] is not None:
         try:
-            with open('translated/' + filename, 'w', encoding='utf-8') as outFile:
-                json.dump(translatedData[0], outFile, ensure_ascii=False)
+            writeJSON('translated/' + filename, translatedData[0])
         except Exception:
             traceback.print_exc()
             return 'Fail'
@@ -107,73 +121,77 @@ def handleMVMZ(filename, estimate):
     totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
 
     # Print any errors on maps
+    if UNTRANSLATED > 0:
+        totalString += Fore.RED + f'\nUntranslated Lines: {UNTRANSLATED}' + Fore.RESET
     if len(MISMATCH) > 0:
         return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
     else:
         return totalString
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='utf-8-sig') as f:
-        data = json.load(f)
-
-        # Map Files
-        if 'Map' in filename and filename != 'MapInfos.json':
-            translatedData = parseMap(data, filename)
-
-        # CommonEvents Files
-        elif 'CommonEvents' in filename:
-            translatedData = parseCommonEvents(data, filename)
-
-        # Actor File
-        elif 'Actors' in filename:
-            translatedData = parseNames(data, filename, 'Actors')
-
-        # Armor File
-        elif 'Armors' in filename:
-            translatedData = parseNames(data, filename, 'Armors')
-
-        # Weapons File
-        elif 'Weapons' in filename:
-            translatedData = parseNames(data, filename, 'Weapons')
-        
-        # Classes File
-        elif 'Classes' in filename:
-            translatedData = parseNames(data, filename, 'Classes')
+    # Big CommonEvents and Scenario files are never loaded whole
+    if ('CommonEvents' in filename or 'Scenario' in filename) and isLarge('files/' + filename):
+        return streamPages(filename)
+    data = readJSON('files/' + filename)
+
+    # Map Files
+    if 'Map' in filename and filename != 'MapInfos.json':
+        translatedData = parseMap(data, filename)
+
+    # CommonEvents Files
+    elif 'CommonEvents' in filename:
+        translatedData = parseCommonEvents(data, filename)
+
+    # Actor File
+    elif 'Actors' in filename:
+        translatedData = parseNames(data, filename, 'Actors')
+
+    # Armor File
+    elif 'Armors' in filename:
+        translatedData = parseNames(data, filename, 'Armors')
+
+    # Weapons File
+    elif 'Weapons' in filename:
+        translatedData = parseNames(data, filename, 'Weapons')
+    
+    # Classes File
+    elif 'Classes' in filename:
+        translatedData = parseNames(data, filename, 'Classes')
 
-        # Enemies File
-        elif 'Enemies' in filename:
-            translatedData = parseNames(data, filename, 'Enemies')
+    # Enemies File
+    elif 'Enemies' in filename:
+        translatedData = parseNames(data, filename, 'Enemies')
 
-        # Items File
-        elif 'Items' in filename:
-            translatedData = parseNames(data, filename, 'Items')
+    # Items File
+    elif 'Items' in filename:
+        translatedData = parseNames(data, filename, 'Items')
 
-        # MapInfo File
-        elif 'MapInfos' in filename:
-            translatedData = parseNames(data, filename, 'MapInfos')
+    # MapInfo File
+    elif 'MapInfos' in filename:
+        translatedData = parseNames(data, filename, 'MapInfos')
 
-        # Skills File
-        elif 'Skills' in filename:
-            translatedData = parseNames(data, filename, 'Skills')
+    # Skills File
+    elif 'Skills' in filename:
+        translatedData = parseNames(data, filename, 'Skills')
 
-        # Troops File
-        elif 'Troops' in filename:
-            translatedData = parseTroops(data, filename)
+    # Troops File
+    elif 'Troops' in filename:
+        translatedData = parseTroops(data, filename)
 
-        # States File
-        elif 'States' in filename:
-            translatedData = parseSS(data, filename)
+    # States File
+    elif 'States' in filename:
+        translatedData = parseSS(data, filename)
 
-        # System File
-        elif 'System' in filename:
-            translatedData = parseSystem(data, filename)
+    # System File
+    elif 'System' in filename:
+        translatedData = parseSystem(data, filename)
 
-        # Scenario File
-        elif 'Scenario' in filename:
-            translatedData = parseScenario(data, filename)
+    # Scenario File
+    elif 'Scenario' in filename:
+        translatedData = parseScenario(data, filename)
 
-        else:
-            raise NameError(filename + ' Not Supported')
+    else:
+        raise NameError(filename + ' Not Supported')
     
     return translatedData
 
@@ -220,6 +238,7 @@ def parseMap(data, filename):
                 totalLines += len(page['list'])
     
     # Thread for each page in file
+    deferred = [] if coalesce.COALESCE else None
     with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
@@ -232,7 +251,7 @@ def parseMap(data, filename):
                         totalTokens[0] += response[0]
                         totalTokens[1] += response[1]
 
-                    futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in event['pages'] if page is not None]
+                    futures = [executor.submit(searchCodes, page, pbar, [], filename, deferred, f'{event["id"]}/{p}') for p, page in enumerate(event['pages']) if page is not None]
                     for future in as_completed(futures):
                         try:
                             totalTokensFuture = future.result()
@@ -240,6 +259,14 @@ def parseMap(data, filename):
                             totalTokens[1] += totalTokensFuture[1]
                         except Exception as e:
                             return [data, totalTokens, e]
+
+        # Dialogue held back by searchCodes
+        try:
+            totalTokensDeferred = translateDeferred(deferred, pbar, filename)
+            totalTokens[0] += totalTokensDeferred[0]
+            totalTokens[1] += totalTokensDeferred[1]
+        except Exception as e:
+            return [data, totalTokens, e]
     return [data, totalTokens, None]
 
 def translateNote(event, regex):
@@ -291,7 +318,6 @@ def translateNoteOmitSpace(event, regex):
     return [0,0]
 
 def parseCommonEvents(data, filename):
-    totalTokens = [0, 0]
     totalLines = 0
     global LOCK
 
@@ -303,17 +329,34 @@ def parseCommonEvents(data, filename):
     with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in data if page is not None]
-            for future in as_completed(futures):
-                try:
-                    totalTokensFuture = future.result()
-                    totalTokens[0] += totalTokensFuture[0]
-                    totalTokens[1] += totalTokensFuture[1]
-                except Exception as e:
-                    traceback.print_exc()
-                    return [data, totalTokens, e]
-    return [data, totalTokens, None]
+        totalTokens, error = searchPages([[i, page] for i, page in enumerate(data) if page is not None], pbar, filename)
+    return [data, totalTokens, error]
+
+# Searches the [key, page] items on THREADS threads, then translates the dialogue they held back.
+# Returns [totalTokens, error].
+def searchPages(items, pbar, filename):
+    totalTokens = [0, 0]
+    deferred = [] if coalesce.COALESCE else None
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        futures = [executor.submit(searchCodes, page, pbar, [], filename, deferred, key) for key, page in items]
+        for future in as_completed(futures):
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                traceback.print_exc()
+                return [totalTokens, e]
+
+    # Dialogue held back by searchCodes
+    try:
+        totalTokensDeferred = translateDeferred(deferred, pbar, filename)
+        totalTokens[0] += totalTokensDeferred[0]
+        totalTokens[1] += totalTokensDeferred[1]
+    except Exception as e:
+        traceback.print_exc()
+        return [totalTokens, e]
+    return [totalTokens, None]
 
 def parseTroops(data, filename):
     totalTokens = [0, 0]
@@ -326,13 +369,14 @@ def parseTroops(data, filename):
             for page in troop['pages']:
                 totalLines += len(page['list']) + 1 # The +1 is because each page has a name.
 
+    deferred = [] if coalesce.COALESCE else None
     with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
         for troop in data:
             if troop is not None:
                 with ThreadPoolExecutor(max_workers=THREADS) as executor:
-                    futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in troop['pages'] if page is not None]
+                    futures = [executor.submit(searchCodes, page, pbar, [], filename, deferred, f'{troop["id"]}/{p}') for p, page in enumerate(troop['pages']) if page is not None]
                     for future in as_completed(futures):
                         try:
                             totalTokensFuture = future.result()
@@ -341,6 +385,15 @@ def parseTroops(data, filename):
                         except Exception as e:
                             traceback.print_exc()
                             return [data, totalTokens, e]
+
+        # Dialogue held back by searchCodes
+        try:
+            totalTokensDeferred = translateDeferred(deferred, pbar, filename)
+            totalTokens[0] += totalTokensDeferred[0]
+            totalTokens[1] += totalTokensDeferred[1]
+        except Exception as e:
+            traceback.print_exc()
+            return [data, totalTokens, e]
     return [data, totalTokens, None]
     
 def parseNames(data, filename, context):
@@ -426,7 +479,6 @@ def parseSystem(data, filename):
     return [data, totalTokens, None]
 
 def parseScenario(data, filename):
-    totalTokens = [0, 0]
     totalLines = 0
     global LOCK
 
@@ -437,16 +489,59 @@ def parseScenario(data, filename):
     with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            futures = [executor.submit(searchCodes, page[1], pbar, [], filename) for page in data.items() if page[1] is not None]
-            for future in as_completed(futures):
-                try:
-                    totalTokensFuture = future.result()
-                    totalTokens[0] += totalTokensFuture[0]
-                    totalTokens[1] += totalTokensFuture[1]
-                except Exception as e:
-                    return [data, totalTokens, e]
-    return [data, totalTokens, None]
+        totalTokens, error = searchPages([page for page in data.items() if page[1] is not None], pbar, filename)
+    return [data, totalTokens, error]
+
+# Streaming
+# CommonEvents and Scenario files over streamThreshold MB are read a window of pages at a time. Each window is
+# searched and its held back dialogue translated like a whole file would be, then written out in order and let go,
+# so only one window is ever in memory. Returns None for the data since the file is already in /translated.
+def streamPages(filename):
+    path = 'files/' + filename
+    totalTokens = [0, 0]
+    error = None
+
+    # Get total for progress bar, a first pass that keeps nothing
+    totalLines = sum(countLines(page) for key, page in readItems(path))
+
+    output = None if ESTIMATE else startItems('translated/' + filename, 'Scenario' in filename)
+    try:
+        with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
+            pbar.desc=filename
+            pbar.total=totalLines
+            window = []
+            windowLines = 0
+            for item in readItems(path):
+                window.append(item)
+                windowLines += countLines(item[1])
+                if windowLines >= WINDOW:
+                    error = streamWindow(window, pbar, filename, totalTokens, output, error)
+                    window = []
+                    windowLines = 0
+            error = streamWindow(window, pbar, filename, totalTokens, output, error)
+    except Exception:
+        if output is not None:
+            abortItems(output)
+        raise
+    if output is not None:
+        finishItems(output)
+    return [None, totalTokens, error]
+
+def countLines(page):
+    if page is None:
+        return 0
+    return len(page['list']) if 'list' in page else len(page)
+
+# After an error the rest of the file is copied untranslated, like a whole file is written with what was finished
+def streamWindow(window, pbar, filename, totalTokens, output, error):
+    if error is None:
+        tokens, error = searchPages([[key, page] for key, page in window if page is not None], pbar, filename)
+        totalTokens[0] += tokens[0]
+        totalTokens[1] += tokens[1]
+    if output is not None:
+        for key, page in window:
+            writeItem(output, key, page)
+    return error
 
 def searchThings(name, pbar):
     totalTokens = [0, 0]
@@ -778,8 +873,9 @@ def searchNames(data, pbar, context):
 
     return totalTokens
 
-def searchCodes(page, pbar, fillList, filename):
+def searchCodes(page, pbar, fillList, filename, deferred=None, location=''):
     docList = []
+    docLocations = []
     currentGroup = []
     textHistory = []
     match = []
@@ -815,6 +911,7 @@ def searchCodes(page, pbar, fillList, filename):
                     pbar.update(1)
                 if len(codeList) <= i:
                     break
+            setLocation(location, i)
 
             ## Event Code: 401 Show Text
             if codeList[i]['code'] in [401, 405, -1] and (CODE401 or CODE405):
@@ -830,9 +927,9 @@ def searchCodes(page, pbar, fillList, filename):
                     continue
 
                 # Check for Speaker
-                coloredSpeakerList = re.findall(r'^[\\]+[cC]\[[\d]+\](.+?)[\\]+[Cc]\[[\d]\]$', jaString)
+                coloredSpeakerList = REGEX['coloredSpeaker'].findall(jaString)
                 if len(coloredSpeakerList) == 0:
-                    coloredSpeakerList = re.findall(r'^【(.*?)】$', jaString)
+                    coloredSpeakerList = REGEX['bracketSpeaker'].findall(jaString)
                 if len(coloredSpeakerList) != 0 and codeList[i+1]['code'] in [401, 405, -1]:
                     # Get Speaker
                     response = getSpeaker(coloredSpeakerList[0])
@@ -885,12 +982,12 @@ def searchCodes(page, pbar, fillList, filename):
                     ### \\n<Speaker>
                     nCase = None
                     if finalJAString[0] != '\\':
-                        regex = r'(.*?)([\\]+[nN][wWcC]?<(.*?)>.*)'
+                        regex = REGEX['nametagAfter']
                         nCase = 0
                     else:
-                        regex = r'(.*[\\]+[nN][wWcC]?<(.*?)>)(.*)'
+                        regex = REGEX['nametagBefore']
                         nCase = 1
-                    matchList = re.findall(regex, finalJAString)
+                    matchList = findNametags(regex, finalJAString)
                     if len(matchList) > 0:  
                         if nCase == 0:
                             nametag = matchList[0][1]
@@ -917,8 +1014,7 @@ def searchCodes(page, pbar, fillList, filename):
                             codeList[i]['parameters'] = [nametag + finalJAString]
                             
                     ### Brackets
-                    matchList = re.findall\
-                        (r'^([\\]+[cC]\[[0-9]+\]【?(.+?)】?[\\]+[cC]\[[0-9]+\])|^(【(.+)】)', finalJAString)  
+                    matchList = REGEX['bracketName'].findall(finalJAString)  
                     
                     # Handle both cases of the regex  
                     if len(matchList) != 0 and BRACKETNAMES is True:
@@ -955,41 +1051,34 @@ def searchCodes(page, pbar, fillList, filename):
 
                     # Catch Vars that may break the TL
                     varString = ''
-                    matchList = re.findall(r'^[\\]+[\w]+\[[a-zA-Z0-9\\\[\]\_,\s-]+\]', finalJAString)    
+                    matchList = REGEX['startCode'].findall(finalJAString)    
                     if len(matchList) != 0:
                         varString = matchList[0]
                         finalJAString = finalJAString.replace(matchList[0], '')
 
                     # Remove any textwrap
                     if FIXTEXTWRAP is True:
-                        finalJAString = re.sub(r'\n', ' ', finalJAString)
+                        finalJAString = finalJAString.replace('\n', ' ')
                         finalJAString = finalJAString.replace('<br>', ' ')
 
                     # Remove Extra Stuff bad for translation.
-                    finalJAString = finalJAString.replace('ﾞ', '')
-                    finalJAString = finalJAString.replace('・', '.')
-                    finalJAString = finalJAString.replace('―', '-')
-                    finalJAString = finalJAString.replace('ー', '-')
-                    finalJAString = finalJAString.replace('…', '...')
-                    finalJAString = finalJAString.replace('。', '.')
-                    finalJAString = re.sub(r'(\.{3}\.+)', '...', finalJAString)
-                    finalJAString = finalJAString.replace('　', '')
+                    finalJAString = normalizeText(finalJAString, 'rpgmaker')
 
                     # Remove any RPGMaker Code at start
-                    ffMatchList = re.findall(r'[\\]+[fFaA]+\[.+?\]', finalJAString)
+                    ffMatchList = REGEX['faceCode'].findall(finalJAString)
                     if len(ffMatchList) > 0:
                         finalJAString = finalJAString.replace(ffMatchList[0], '')
                         nametag += ffMatchList[0]
 
                     ### Remove format codes
                     # Furigana
-                    rcodeMatch = re.findall(r'([\\]+[r][b]?\[.+?,(.+?)\])', finalJAString)
+                    rcodeMatch = REGEX['furigana'].findall(finalJAString)
                     if len(rcodeMatch) > 0:
                         for match in rcodeMatch:
                             finalJAString = finalJAString.replace(match[0],match[1])
 
                     # Formatting
-                    formatMatch = re.findall(r'[\\]+[!><.|#^{}]', finalJAString)
+                    formatMatch = REGEX['formatCode'].findall(finalJAString)
                     if len(formatMatch) > 0:
                         for match in formatMatch:
                             finalJAString = finalJAString.replace(match, '')
@@ -1001,7 +1090,7 @@ def searchCodes(page, pbar, fillList, filename):
 
                     # If there isn't any Japanese in the text just skip
                     if IGNORETLTEXT is True:
-                        if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', finalJAString):
+                        if not isJapanese(finalJAString):
                             # Keep textHistory list at length maxHistory
                             textHistory.append('\"' + finalJAString + '\"')
                             if len(textHistory) > maxHistory:
@@ -1020,6 +1109,7 @@ def searchCodes(page, pbar, fillList, filename):
                         else:
                             docList.append(speaker)
                             textHistory.append(speaker)
+                        docLocations.append(j)
                         speaker = ''
                         match = []
                         currentGroup = []
@@ -1032,11 +1122,11 @@ def searchCodes(page, pbar, fillList, filename):
                         
                         # Remove speaker
                         if speaker != '':
-                            matchSpeakerList = re.findall(r'(^.+?)\s?[|:]\s?', translatedText)
+                            matchSpeakerList = REGEX['speakerPrefix'].findall(translatedText)
                             if len(matchSpeakerList) > 0:
                                 newSpeaker = matchSpeakerList[0]
                                 nametag = nametag.replace(speaker, newSpeaker)
-                            translatedText = re.sub(r'(^.+?)\s?[|:]\s?', '', translatedText)
+                            translatedText = REGEX['speakerPrefix'].sub('', translatedText)
 
                         # Textwrap
                         if FIXTEXTWRAP is True:
@@ -1091,7 +1181,7 @@ def searchCodes(page, pbar, fillList, filename):
                     continue
 
                 # Need to remove outside code and put it back later
-                matchList = re.findall(r"[\'\"\`](.*)[\'\"\`]", jaString)
+                matchList = REGEX['quoted'].findall(jaString)
                 
                 for match in matchList:
                     # Remove Textwrap
@@ -1130,20 +1220,20 @@ def searchCodes(page, pbar, fillList, filename):
                         continue
 
                     # If there isn't any Japanese in the text just skip
-                    if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                    if not isJapanese(jaString):
                         continue
 
                     # Need to remove outside code and put it back later
                     oldjaString = jaString
-                    startString = re.search(r'^[^一-龠ぁ-ゔァ-ヴー【】（）「」a-zA-ZＡ-Ｚ０-９\\]+', jaString)
-                    finalJAString = re.sub(r'^[^一-龠ぁ-ゔァ-ヴー【】（）「」a-zA-ZＡ-Ｚ０-９\\]+', '', jaString)
+                    startString = REGEX['leadingSymbols'].search(jaString)
+                    finalJAString = REGEX['leadingSymbols'].sub('', jaString)
                     if startString is None:
                         startString = ''
                     else:
                         startString = startString.group()
 
                     # Remove any textwrap
-                    finalJAString = re.sub(r'\n', ' ', finalJAString)
+                    finalJAString = finalJAString.replace('\n', ' ')
 
                     # Translate
                     response = translateGPT(finalJAString, '', False)
@@ -1169,14 +1259,14 @@ def searchCodes(page, pbar, fillList, filename):
                         continue
 
                     # If there isn't any Japanese in the text just skip
-                    if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                    if not isJapanese(jaString):
                         continue
 
                     # Remove outside text
-                    startString = re.search(r'^[^一-龠ぁ-ゔァ-ヴー\<\>【】\\]+', jaString)
-                    jaString = re.sub(r'^[^一-龠ぁ-ゔァ-ヴー\<\>【】\\]+', '', jaString)
-                    endString = re.search(r'[^一-龠ぁ-ゔァ-ヴー\<\>【】。！？\\]+$', jaString)
-                    jaString = re.sub(r'[^一-龠ぁ-ゔァ-ヴー\<\>【】。！？\\]+$', '', jaString)
+                    startString = REGEX['leadingCode'].search(jaString)
+                    jaString = REGEX['leadingCode'].sub('', jaString)
+                    endString = REGEX['trailingCode'].search(jaString)
+                    jaString = REGEX['trailingCode'].sub('', jaString)
                     if startString is None:
                         startString = ''
                     else:
@@ -1187,7 +1277,7 @@ def searchCodes(page, pbar, fillList, filename):
                         endString = endString.group()
 
                     # Remove any textwrap
-                    jaString = re.sub(r'\n', ' ', jaString)
+                    jaString = jaString.replace('\n', ' ')
 
                     # Translate
                     response = translateGPT(jaString, '', True)
@@ -1233,15 +1323,15 @@ def searchCodes(page, pbar, fillList, filename):
                     continue
 
                 # If there isn't any Japanese in the text just skip
-                if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                if not isJapanese(jaString):
                     speaker = jaString
                     continue
 
                 # Need to remove outside code and put it back later
-                startString = re.search(r'^[^一-龠ぁ-ゔァ-ヴー\<\>【】]+', jaString)
-                jaString = re.sub(r'^[^一-龠ぁ-ゔァ-ヴー\<\>【】]+', '', jaString)
-                endString = re.search(r'[^一-龠ぁ-ゔァ-ヴー\<\>【】。！？]+$', jaString)
-                jaString = re.sub(r'[^一-龠ぁ-ゔァ-ヴー\<\>【】。！？]+$', '', jaString)
+                startString = REGEX['leadingScript'].search(jaString)
+                jaString = REGEX['leadingScript'].sub('', jaString)
+                endString = REGEX['trailingScript'].search(jaString)
+                jaString = REGEX['trailingScript'].sub('', jaString)
                 if startString is None: startString = ''
                 else:  startString = startString.group() + ' '
                 if endString is None: endString = ''
@@ -1273,7 +1363,7 @@ def searchCodes(page, pbar, fillList, filename):
                 jaString = codeList[i]['parameters'][0]
 
                 # If there isn't any Japanese in the text just skip
-                # if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                # if not isJapanese(jaString):
                 #     continue
 
                 # Skip These
@@ -1281,7 +1371,7 @@ def searchCodes(page, pbar, fillList, filename):
                 #     continue
 
                 # Need to remove outside code and put it back later
-                # matchList = re.findall(r'.+"(.*?)".*[;,]$', jaString)
+                # matchList = REGEX['quotedScript'].findall(jaString)
 
                 if 'console.' in jaString:
                     continue
@@ -1291,12 +1381,12 @@ def searchCodes(page, pbar, fillList, filename):
                 #     continue
 
                 if '_subject=' in jaString:
-                    matchList = re.findall(r'.*?subject=(.*?)\".*?', jaString)
+                    matchList = REGEX['subject'].findall(jaString)
 
                 # Translate
                 if len(matchList) > 0:
                     # If there isn't any Japanese in the text just skip
-                    # if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', matchList[0]):
+                    # if not isJapanese(matchList[0]):
                     #     continue
 
                     # Remove Textwrap
@@ -1327,18 +1417,18 @@ def searchCodes(page, pbar, fillList, filename):
                 jaString = codeList[i]['parameters'][0]
 
                 # If there isn't any Japanese in the text just skip
-                if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                if not isJapanese(jaString):
                     continue
 
                 if 'secretText' in jaString:
-                    regex = r'secretText:\s?(.+)'
+                    regex = REGEX['secretText']
                 elif 'title' in jaString:
-                    regex = r'title:\s?(.+)'
+                    regex = REGEX['title']
                 else:
-                    regex = r'(.+)'
+                    regex = REGEX['wholeLine']
 
                 # Need to remove outside code and put it back later
-                matchList = re.findall(regex, jaString)
+                matchList = regex.findall(jaString)
                 
                 for match in matchList:
                     # Remove Textwrap
@@ -1367,19 +1457,19 @@ def searchCodes(page, pbar, fillList, filename):
                 jaString = codeList[i]['parameters'][0]
 
                 # If there isn't any Japanese in the text just skip
-                if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                if not isJapanese(jaString):
                     continue
 
                 # Translate
                 if 'info:' in jaString:
-                    regex = r'info:(.*)'
+                    regex = REGEX['info']
                 elif 'ActiveMessage:' in jaString:
-                    regex = r'<ActiveMessage:(.*)>?'
+                    regex = REGEX['activeMessageOpen']
                 else:
                     continue
 
                 # Need to remove outside code and put it back later
-                matchList = re.findall(regex, jaString)
+                matchList = regex.findall(jaString)
 
                 # Translate
                 if len(matchList) > 0:
@@ -1406,7 +1496,7 @@ def searchCodes(page, pbar, fillList, filename):
 
                 # Grab Speaker
                 if 'Tachie showName' in jaString:
-                    matchList = re.findall(r'Tachie showName (.+)', jaString)
+                    matchList = REGEX['tachieName'].findall(jaString)
                     if len(matchList) > 0:
                         # Translate
                         response = translateGPT(matchList[0], 'Reply with the '+ LANGUAGE +' translation of the NPC name.', False)
@@ -1423,10 +1513,10 @@ def searchCodes(page, pbar, fillList, filename):
                 # Want to translate this script
                 if 'D_TEXT ' in jaString:
                     # Remove any textwrap
-                    jaString = re.sub(r'\n', '_', jaString)
+                    jaString = jaString.replace('\n', '_')
 
                     # Capture Arguments and text
-                    dtextList = re.findall(r'D_TEXT\s(.+)\s|D_TEXT\s(.+)', jaString)
+                    dtextList = REGEX['dText'].findall(jaString)
                     if len(dtextList) > 0:
                         if dtextList[0][0] != '':
                             dtext = dtextList[0][0]
@@ -1445,7 +1535,7 @@ def searchCodes(page, pbar, fillList, filename):
                             codeList[i]['parameters'][0] = ''
                             i += 1
                             jaString = codeList[i]['parameters'][0]
-                            dtextList = re.findall(r'D_TEXT\s(.+)\s|D_TEXT\s(.+)', jaString)
+                            dtextList = REGEX['dText'].findall(jaString)
                             if len(dtextList) > 0:
                                 if dtextList[0][0] != '':
                                     dtext = dtextList[0][0]
@@ -1492,13 +1582,13 @@ def searchCodes(page, pbar, fillList, filename):
 
                 if 'ShowInfo ' in jaString:
                     # Remove any textwrap
-                    jaString = re.sub(r'\n', '_', jaString)
+                    jaString = jaString.replace('\n', '_')
 
                     # _SEItem1
                     if '_SE' in jaString:
-                        infoList = re.findall(r'\_SE\[.+?\](.+)', jaString)
+                        infoList = REGEX['infoSE'].findall(jaString)
                     else:
-                        infoList = re.findall(r'ShowInfo (.+)', jaString)
+                        infoList = REGEX['showInfo'].findall(jaString)
 
                     # Capture Arguments and text
                     if len(infoList) > 0:
@@ -1506,7 +1596,7 @@ def searchCodes(page, pbar, fillList, filename):
                         originalInfo = info
 
                         # Remove underscores
-                        info = re.sub(r'_', ' ', info)
+                        info = info.replace('_', ' ')
 
                         # Using this to keep track of 401's in a row. Throws IndexError at EndOfList (Expected Behavior)
                         currentGroup.append(info)
@@ -1520,9 +1610,9 @@ def searchCodes(page, pbar, fillList, filename):
                             i += 1
                             jaString = codeList[i]['parameters'][0]
                             if '_SE' in jaString:
-                                infoList = re.findall(r'\_SE\[.+?\](.+)', jaString)
+                                infoList = REGEX['infoSE'].findall(jaString)
                             else:
-                                infoList = re.findall(r'ShowInfo (.+)', jaString)
+                                infoList = REGEX['showInfo'].findall(jaString)
                             if len(infoList) > 0:
                                 dtext = infoList[0]
                                 currentGroup.append(info)
@@ -1537,7 +1627,7 @@ def searchCodes(page, pbar, fillList, filename):
                         currentGroup = [] 
                     
                         # Remove any textwrap
-                        jaString = re.sub(r'\n', '_', jaString)
+                        jaString = jaString.replace('\n', '_')
 
                         # Translate
                         response = translateGPT(finalJAString, 'Reply with the '+ LANGUAGE +' Translation.', False)
@@ -1563,16 +1653,16 @@ def searchCodes(page, pbar, fillList, filename):
 
                 if 'PushGab ' in jaString:
                     # Remove any textwrap
-                    jaString = re.sub(r'\n', '_', jaString)
+                    jaString = jaString.replace('\n', '_')
 
                     # Capture Arguments and text
-                    infoList = re.findall(r'PushGab [0-9]+ (.+)', jaString)
+                    infoList = REGEX['pushGab'].findall(jaString)
                     if len(infoList) > 0:
                         info = infoList[0]
                         originalInfo = info
 
                         # Remove underscores
-                        info = re.sub(r'_', ' ', info)
+                        info = info.replace('_', ' ')
 
                         # Using this to keep track of 401's in a row. Throws IndexError at EndOfList (Expected Behavior)
                         currentGroup.append(info)
@@ -1585,7 +1675,7 @@ def searchCodes(page, pbar, fillList, filename):
                             codeList[i]['parameters'][0] = ''
                             i += 1
                             jaString = codeList[i]['parameters'][0]
-                            infoList = re.findall(r'PushGab [0-9]+ (.+)', jaString)
+                            infoList = REGEX['pushGab'].findall(jaString)
                             if len(infoList) > 0:
                                 dtext = infoList[0]
                                 currentGroup.append(info)
@@ -1600,7 +1690,7 @@ def searchCodes(page, pbar, fillList, filename):
                         currentGroup = [] 
                     
                         # Remove any textwrap
-                        jaString = re.sub(r'\n', '_', jaString)
+                        jaString = jaString.replace('\n', '_')
 
                         # Translate
                         response = translateGPT(finalJAString, 'Reply with the '+ LANGUAGE +' Translation.', False)
@@ -1626,8 +1716,8 @@ def searchCodes(page, pbar, fillList, filename):
 
                 if 'addLog ' in jaString:
                     # Remove any textwrap
-                    jaString = re.sub(r'\n', '_', jaString)
-                    infoList = re.findall(r'addLog (.+)', jaString)
+                    jaString = jaString.replace('\n', '_')
+                    infoList = REGEX['addLog'].findall(jaString)
 
                     # Capture Arguments and text
                     if len(infoList) > 0:
@@ -1635,7 +1725,7 @@ def searchCodes(page, pbar, fillList, filename):
                         originalInfo = info
 
                         # Remove underscores
-                        info = re.sub(r'_', ' ', info)
+                        info = info.replace('_', ' ')
 
                         # Using this to keep track of 401's in a row. Throws IndexError at EndOfList (Expected Behavior)
                         currentGroup.append(info)
@@ -1648,7 +1738,7 @@ def searchCodes(page, pbar, fillList, filename):
                             codeList[i]['parameters'][0] = ''
                             i += 1
                             jaString = codeList[i]['parameters'][0]
-                            infoList = re.findall(r'addLog (.+)', jaString)
+                            infoList = REGEX['addLog'].findall(jaString)
                             if len(infoList) > 0:
                                 dtext = infoList[0]
                                 currentGroup.append(info)
@@ -1663,7 +1753,7 @@ def searchCodes(page, pbar, fillList, filename):
                         currentGroup = [] 
                     
                         # Remove any textwrap
-                        jaString = re.sub(r'\n', '_', jaString)
+                        jaString = jaString.replace('\n', '_')
 
                         # Translate
                         response = translateGPT(finalJAString, 'Reply with the '+ LANGUAGE +' Translation.', False)
@@ -1687,7 +1777,7 @@ def searchCodes(page, pbar, fillList, filename):
                     else:
                         continue
                 if 'namePop' in jaString:
-                    matchList = re.findall(r'namePop\s\d+\s(.+?)\s.+', jaString)
+                    matchList = REGEX['namePop'].findall(jaString)
                     if len(matchList) > 0:
                         # Translate
                         text = matchList[0]
@@ -1701,7 +1791,7 @@ def searchCodes(page, pbar, fillList, filename):
                         codeList[i]['parameters'][0] = translatedText
 
                 if 'LL_InfoPopupWIndowMV' in jaString:
-                    matchList = re.findall(r'LL_InfoPopupWIndowMV\sshowWindow\s(.+?)\s.+', jaString)
+                    matchList = REGEX['infoPopup'].findall(jaString)
                     if len(matchList) > 0:
                         # Translate
                         text = matchList[0]
@@ -1730,8 +1820,8 @@ def searchCodes(page, pbar, fillList, filename):
                     # If and En Statements
                     ifVar = ''
                     enVar = ''
-                    ifList = re.findall(r'(if\(.*\))', jaString)
-                    enList = re.findall(r'(en\(.*\))', jaString)
+                    ifList = REGEX['ifScript'].findall(jaString)
+                    enList = REGEX['enScript'].findall(jaString)
                     if len(ifList) != 0:
                         jaString = jaString.replace(ifList[0], '')
                         ifVar = ifList[0]
@@ -1783,7 +1873,7 @@ def searchCodes(page, pbar, fillList, filename):
                         continue
 
                     # Need to remove outside code and put it back later
-                    matchList = re.findall(r"'(.*?)'", jaString)
+                    matchList = REGEX['singleQuoted'].findall(jaString)
                     
                     for match in matchList:
                         response = translateGPT(match, '', False)
@@ -1813,7 +1903,7 @@ def searchCodes(page, pbar, fillList, filename):
                     continue
 
                 # If there isn't any Japanese in the text just skip
-                if not re.search(r'[一-龠]+|[ぁ-ゔ]+|[ァ-ヴー]+', jaString):
+                if not isJapanese(jaString):
                     continue
                 
                 response = translateGPT(jaString, 'Reply with the '+ LANGUAGE +' translation of the NPC name.', False)
@@ -1830,7 +1920,13 @@ def searchCodes(page, pbar, fillList, filename):
                 codeList[i]['parameters'][1] = translatedText
 
         # End of the line
-        if docList != [] and fillList != '':
+        if docList != [] and fillList != '' and deferred is not None:
+            # Translated later together with other pages, -1 codes are removed in the second pass
+            with LOCK:
+                deferred.append([page, docList, textHistory])
+            return totalTokens
+        elif docList != [] and fillList != '':
+            setLineLocations(location, docLocations)
             response = translateGPT(docList, textHistory, True)
             fillList = response[0]
             totalTokens[0] += response[1][0]
@@ -1844,18 +1940,7 @@ def searchCodes(page, pbar, fillList, filename):
                 searchCodes(page, pbar, fillList, filename)
 
         # Delete all -1 codes
-        codeListFinal = []
-        for i in range(len(codeList)):
-            if codeList[i]['code'] != -1:
-                codeListFinal.append(codeList[i])
-
-        # Normal Format
-        if 'list' in page:
-            page['list'] = codeListFinal
-
-        # Special Format (Scenario)
-        else:
-            page = codeListFinal
+        deleteCodes(page)
 
     except IndexError as e:
         traceback.print_exc()
@@ -1866,6 +1951,37 @@ def searchCodes(page, pbar, fillList, filename):
 
     return totalTokens
 
+# The first pass joins each group of 401's into its last code and marks the rest -1
+def deleteCodes(page):
+    # Normal Format
+    if 'list' in page:
+        page['list'] = [code for code in page['list'] if code['code'] != -1]
+
+    # Special Format (Scenario), the page is the list so it is changed in place
+    else:
+        page[:] = [code for code in page if code['code'] != -1]
+
+# Second pass for the pages searchCodes held back. Their dialogue is sent with the pages of every other file
+# translating at the time and each page is filled in with its own lines.
+def translateDeferred(deferred, pbar, filename):
+    totalTokens = [0, 0]
+    if not deferred:
+        return totalTokens
+
+    responses = translatePages(translateGPT, [[docList, textHistory] for page, docList, textHistory in deferred])
+    for [page, docList, textHistory], response in zip(deferred, responses):
+        totalTokens[0] += response[1][0]
+        totalTokens[1] += response[1][1]
+        # The page keeps its joined Japanese lines like it does when translated on its own
+        if len(response[0]) != len(docList):
+            with LOCK:
+                if filename not in MISMATCH:
+                    MISMATCH.append(filename)
+            deleteCodes(page)
+        else:
+            searchCodes(page, pbar, response[0], filename)
+    return totalTokens
+
 def searchSS(state, pbar):
     totalTokens = [0, 0]
 
@@ -1959,37 +2075,40 @@ def searchSystem(data, pbar):
     data['gameTitle'] = response[0].strip('.')
     pbar.update(1)
     
-    # Terms
+    # Terms, every string in a list is sent before waiting so they go out together
     for term in data['terms']:
         if term != 'messages':
             termList = data['terms'][term]
-            for i in range(len(termList)):  # Last item is a messages object
-                if termList[i] is not None:
-                    response = translateGPT(termList[i], context, False)
-                    totalTokens[0] += response[1][0]
-                    totalTokens[1] += response[1][1]
-                    termList[i] = response[0].replace('\"', '').strip()
-                    pbar.update(1)
+            futures = [[i, submitString(translateGPT, termList[i], context)] for i in range(len(termList)) if termList[i] is not None]  # Last item is a messages object
+            for i, future in futures:
+                response = future.result()
+                totalTokens[0] += response[1][0]
+                totalTokens[1] += response[1][1]
+                termList[i] = response[0].replace('\"', '').strip()
+                pbar.update(1)
 
     # Armor Types
-    for i in range(len(data['armorTypes'])):
-        response = translateGPT(data['armorTypes'][i], 'Reply with only the '+ LANGUAGE +' translation of the armor type', False)
+    futures = [submitString(translateGPT, text, 'Reply with only the '+ LANGUAGE +' translation of the armor type') for text in data['armorTypes']]
+    for i, future in enumerate(futures):
+        response = future.result()
         totalTokens[0] += response[1][0]
         totalTokens[1] += response[1][1]
         data['armorTypes'][i] = response[0].replace('\"', '').strip()
         pbar.update(1)
 
     # Skill Types
-    for i in range(len(data['skillTypes'])):
-        response = translateGPT(data['skillTypes'][i], 'Reply with only the '+ LANGUAGE +' translation', False)
+    futures = [submitString(translateGPT, text, 'Reply with only the '+ LANGUAGE +' translation') for text in data['skillTypes']]
+    for i, future in enumerate(futures):
+        response = future.result()
         totalTokens[0] += response[1][0]
         totalTokens[1] += response[1][1]
         data['skillTypes'][i] = response[0].replace('\"', '').strip()
         pbar.update(1)
 
     # Equip Types
-    for i in range(len(data['equipTypes'])):
-        response = translateGPT(data['equipTypes'][i], 'Reply with only the '+ LANGUAGE +' translation of the equipment type. No disclaimers.', False)
+    futures = [submitString(translateGPT, text, 'Reply with only the '+ LANGUAGE +' translation of the equipment type. No disclaimers.') for text in data['equipTypes']]
+    for i, future in enumerate(futures):
+        response = future.result()
         totalTokens[0] += response[1][0]
         totalTokens[1] += response[1][1]
         data['equipTypes'][i] = response[0].replace('\"', '').strip()
@@ -2005,8 +2124,9 @@ def searchSystem(data, pbar):
 
     # Messages
     messages = (data['terms']['messages'])
-    for key, value in messages.items():
-        response = translateGPT(value, 'Reply with only the '+ LANGUAGE +' translation of the battle text.\nTranslate "常時ダッシュ" as "Always Dash"\nTranslate "次の%1まで" as Next %1.', False)
+    futures = {key: submitString(translateGPT, value, 'Reply with only the '+ LANGUAGE +' translation of the battle text.\nTranslate "常時ダッシュ" as "Always Dash"\nTranslate "次の%1まで" as Next %1.') for key, value in messages.items()}
+    for key, future in futures.items():
+        response = future.result()
         translatedText = response[0]
 
         # Remove characters that may break scripts
@@ -2044,124 +2164,14 @@ def getSpeaker(speaker):
                                
     return [speaker,[0,0]]
 
-def subVars(jaString):
-    jaString = jaString.replace('\u3000', ' ')
-
-    # Nested
-    count = 0
-    nestedList = re.findall(r'[\\]+[\w]+\[[\\]+[\w]+\[[0-9]+\]\]', jaString)
-    nestedList = set(nestedList)
-    if len(nestedList) != 0:
-        for icon in nestedList:
-            jaString = jaString.replace(icon, '[Nested_' + str(count) + ']')
-            count += 1
-
-    # Icons
-    count = 0
-    iconList = re.findall(r'[\\]+[iIkKwWaA]+\[[0-9]+\]', jaString)
-    iconList = set(iconList)
-    if len(iconList) != 0:
-        for icon in iconList:
-            jaString = jaString.replace(icon, '[Ascii_' + str(count) + ']')
-            count += 1
-
-    # Colors
-    count = 0
-    colorList = re.findall(r'[\\]+[cC]\[[0-9]+\]', jaString)
-    colorList = set(colorList)
-    if len(colorList) != 0:
-        for color in colorList:
-            jaString = jaString.replace(color, '[Color_' + str(count) + ']')
-            count += 1
-
-    # Names
-    count = 0
-    nameList = re.findall(r'[\\]+[nN]\[.+?\]+', jaString)
-    nameList = set(nameList)
-    if len(nameList) != 0:
-        for name in nameList:
-            jaString = jaString.replace(name, '[Noun_' + str(count) + ']')
-            count += 1
-
-    # Variables
-    count = 0
-    varList = re.findall(r'[\\]+[vV]\[[0-9]+\]', jaString)
-    varList = set(varList)
-    if len(varList) != 0:
-        for var in varList:
-            jaString = jaString.replace(var, '[Var_' + str(count) + ']')
-            count += 1
+# Placeholders
+PLACEHOLDERS = compileVars('[]', r'[\\]+[\w]+\[[a-zA-Z0-9\\\[\]\_,\s-]+\]')
 
-    # Formatting
-    count = 0
-    formatList = re.findall(r'[\\]+[\w]+\[[a-zA-Z0-9\\\[\]\_,\s-]+\]', jaString)
-    formatList = set(formatList)
-    if len(formatList) != 0:
-        for var in formatList:
-            jaString = jaString.replace(var, '[FCode_' + str(count) + ']')
-            count += 1
-
-    # Put all lists in list and return
-    allList = [nestedList, iconList, colorList, nameList, varList, formatList]
-    return [jaString, allList]
+def subVars(jaString):
+    return substituteVars(jaString, PLACEHOLDERS)
 
 def resubVars(translatedText, allList):
-    # Fix Spacing and ChatGPT Nonsense
-    matchList = re.findall(r'\[\s?.+?\s?\]', translatedText)
-    if len(matchList) > 0:
-        for match in matchList:
-            text = match.strip()
-            translatedText = translatedText.replace(match, text)
-
-    # Nested
-    count = 0
-    if len(allList[0]) != 0:
-        for var in allList[0]:
-            translatedText = translatedText.replace('[Nested_' + str(count) + ']', var)
-            count += 1
-
-    # Icons
-    count = 0
-    if len(allList[1]) != 0:
-        for var in allList[1]:
-            translatedText = translatedText.replace('[Ascii_' + str(count) + ']', var)
-            count += 1
-
-    # Colors
-    count = 0
-    if len(allList[2]) != 0:
-        for var in allList[2]:
-            translatedText = translatedText.replace('[Color_' + str(count) + ']', var)
-            count += 1
-
-    # Names
-    count = 0
-    if len(allList[3]) != 0:
-        for var in allList[3]:
-            translatedText = translatedText.replace('[Noun_' + str(count) + ']', var)
-            count += 1
-
-    # Vars
-    count = 0
-    if len(allList[4]) != 0:
-        for var in allList[4]:
-            translatedText = translatedText.replace('[Var_' + str(count) + ']', var)
-            count += 1
-    
-    # Formatting
-    count = 0
-    if len(allList[5]) != 0:
-        for var in allList[5]:
-            translatedText = translatedText.replace('[FCode_' + str(count) + ']', var)
-            count += 1
-
-    return translatedText
-
-def batchList(input_list, batch_size):
-    if not isinstance(batch_size, int) or batch_size <= 0:
-        raise ValueError("batch_size must be a positive integer")
-        
-    return [input_list[i:i + batch_size] for i in range(0, len(input_list), batch_size)]
+    return restoreVars(translatedText, allList, PLACEHOLDERS)
 
 def createContext(fullPromptFlag, subbedT):
     characters = 'Game Characters:\n\
@@ -2202,7 +2212,10 @@ def translateText(characters, system, user, history):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+
+    # Rate Limit and Retry
+    response = requestCompletion(
+        lambda: countTokens(characters, system, user, history),
         temperature=0.1,
         frequency_penalty=0.1,
         presence_penalty=0.1,
@@ -2212,77 +2225,92 @@ def translateText(characters, system, user, history):
     return response
 
 def cleanTranslatedText(translatedText, varResponse):
-    placeholders = {
-        f'{LANGUAGE} Translation: ': '',
-        'Translation: ': '',
-        'っ': '',
-        '〜': '~',
-        'ー': '-',
-        'ッ': '',
-        '。': '.',
-        'Placeholder Text': ''
-        # Add more replacements as needed
-    }
-    for target, replacement in placeholders.items():
-        translatedText = translatedText.replace(target, replacement)
+    translatedText = normalizeText(translatedText, 'translation')
 
     translatedText = resubVars(translatedText, varResponse[1])
     return translatedText
 
 def extractTranslation(translatedTextList, is_list):
-    pattern = r'`?<Line\d+>([\\]*.*?[\\]*?)<\/?Line\d+>`?'
+    pattern = r'`?<Line(\d+)>([\\]*.*?[\\]*?)<\/?Line\d+>`?'
     # If it's a batch (i.e., list), extract with tags; otherwise, return the single item.
     if is_list:
         matchList = re.findall(pattern, translatedTextList)
         return matchList
     else:
         matchList = re.findall(pattern, translatedTextList)
-        return matchList[0][0] if matchList else translatedTextList
+        return matchList[0][1] if matchList else translatedTextList
 
 def countTokens(characters, system, user, history):
-    inputTotalTokens = 0
-    outputTotalTokens = 0
-    enc = tiktoken.encoding_for_model(MODEL)
-    
-    # Input
-    if isinstance(history, list):
-        for line in history:
-            inputTotalTokens += len(enc.encode(line))
-    else:
-        inputTotalTokens += len(enc.encode(history))
-    inputTotalTokens += len(enc.encode(system))
-    inputTotalTokens += len(enc.encode(characters))
-    inputTotalTokens += len(enc.encode(user))
-
-    # Output
-    outputTotalTokens += round(len(enc.encode(user))/1.5)
-
-    return [inputTotalTokens, outputTotalTokens]
+    return countPrompt(MODEL, characters, system, user, history)
 
 def combineList(tlist, text):
     if isinstance(text, list):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+def translateBatch(batch, history, fullPromptFlag):
+    # Before sending to translation, add the formatting
+    payload = '\n'.join([f'`<Line{i}>{item}</Line{i}>`' for i, item in enumerate(batch)])
+    payload = payload.replace('><', '>Placeholder Text<')
+    varResponse = subVars(payload)
+    subbedT = varResponse[0]
+
+    # Things to Check before starting translation
+    if not re.search(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]+', subbedT):
+        return [dict(enumerate(batch)), [0, 0]]
+
+    # Create Message
+    characters, system, user = createContext(fullPromptFlag, subbedT)
+
+    # Calculate Estimate
+    if ESTIMATE:
+        return [dict(enumerate(batch)), calibrateEstimate(MODEL, __name__, countTokens(characters, system, user, history))]
+
+    # Translating
+    response = translateText(characters, system, user, history)
+    translatedText = response.choices[0].message.content
+    totalTokens = [response.usage.prompt_tokens, response.usage.completion_tokens]
+
+    # Formatting
+    translatedText = cleanTranslatedText(translatedText, varResponse)
+    extractedTranslations = extractTranslation(translatedText, True)
+    return [indexTranslations(extractedTranslations, len(batch)), totalTokens]
+
+# Batches recover from mismatches by resending the missing lines
+def translateChunk(batch, history, fullPromptFlag):
+    global UNTRANSLATED
+    response = bisectBatch(batch, lambda batch: translateBatch(batch, history, fullPromptFlag), None if ESTIMATE else MODEL,
+                           getPrompt(globals(), fullPromptFlag))
+
+    # Lines that never came back stay untranslated
+    extractedTranslations = response[0]
+    missing = [i for i, line in enumerate(extractedTranslations) if line is None]
+    for i in missing:
+        extractedTranslations[i] = batch[i]
+    with LOCK:
+        UNTRANSLATED += len(missing)
+    return [extractedTranslations, response[1]]
+
+@textUnits
+@translationMemory
+@coalesceStrings
 def translateGPT(text, history, fullPromptFlag):
-    mismatch = False
     totalTokens = [0, 0]
+
+    # Batches, sent one after another or at the same time with concurrentBatches
     if isinstance(text, list):
-        tList = batchList(text, BATCHSIZE)
-    else:
-        tList = [text]
+        tList = packBatches(text, getBatchSize(MODEL, BATCHSIZE), MODEL)
+        responses = dispatchBatches(tList, history, lambda batch, history: translateChunk(batch, history, fullPromptFlag))
+        for response in responses:
+            totalTokens[0] += response[1][0]
+            totalTokens[1] += response[1][1]
+        finalList = combineList([response[0] for response in responses], text)
+        return [finalList, totalTokens]
 
+    tList = [text]
     for index, tItem in enumerate(tList):
-        # Before sending to translation, if we have a list of items, add the formatting
-        if isinstance(tItem, list):
-            payload = '\n'.join([f'`<Line{i}>{item}</Line{i}>`' for i, item in enumerate(tItem)])
-            payload = payload.replace('><', '>Placeholder Text<')
-            varResponse = subVars(payload)
-            subbedT = varResponse[0]
-        else:
-            varResponse = subVars(tItem)
-            subbedT = varResponse[0]
+        varResponse = subVars(tItem)
+        subbedT = varResponse[0]
 
         # Things to Check before starting translation
         if not re.search(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]+', subbedT):
@@ -2293,7 +2321,7 @@ def translateGPT(text, history, fullPromptFlag):
 
         # Calculate Estimate
         if ESTIMATE:
-            estimate = countTokens(characters, system, user, history)
+            estimate = calibrateEstimate(MODEL, __name__, countTokens(characters, system, user, history))
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -2304,35 +2332,14 @@ def translateGPT(text, history, fullPromptFlag):
         totalTokens[0] += response.usage.prompt_tokens
         totalTokens[1] += response.usage.completion_tokens
 
+        # Refused, keep the original text
+        if translatedText == '':
+            continue
+
         # Formatting
         translatedText = cleanTranslatedText(translatedText, varResponse)
-        if isinstance(tItem, list):
-            extractedTranslations = extractTranslation(translatedText, True)
-            tList[index] = extractedTranslations
-            if len(tItem) != len(extractedTranslations):
-                # Mismatch. Try Again
-                response = translateText(characters, system, user, history)
-                translatedText = response.choices[0].message.content
-                totalTokens[0] += response.usage.prompt_tokens
-                totalTokens[1] += response.usage.completion_tokens
-
-                # Formatting
-                translatedText = cleanTranslatedText(translatedText, varResponse)
-                if isinstance(tItem, list):
-                    extractedTranslations = extractTranslation(translatedText, True)
-                    tList[index] = extractedTranslations
-                    if len(tItem) != len(extractedTranslations):
-                        mismatch = True # Just here for breakpoint
-
-            # Create History
-            if not mismatch:
-                history = extractedTranslations[-10:]  # Update history if we have a list
-            else:
-                history = text[-10:]
-        else:
-            # Ensure we're passing a single string to extractTranslation
-            extractedTranslations = extractTranslation(translatedText, False)
-            tList[index] = extractedTranslations
+        extractedTranslations = extractTranslation(translatedText, False)
+        tList[index] = extractedTranslations
 
     finalList = combineList(tList, text)
     return [finalList, totalTokens]
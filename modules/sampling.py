@@ -0,0 +1,141 @@
+# Libraries
+import math, os, random, re, time
+from colorama import Fore
+from modules.batching import BATCHTOKENS, HISTORYLINES, LINEOVERHEAD
+from modules.calibration import getRatios
+from modules.coalesce import COALESCESTRINGS, MAXSTRINGS
+from modules.jsonio import readJSON
+from modules.patterns import isJapanese
+from modules.tokens import countList, countStatic
+
+# Sampled Estimate
+# Instead of running every file through its parser, the files are split into strata by type and a random sample of
+# files is read from each. Every Japanese string in a sampled file is a translation unit, a random sample of units is
+# counted and the per byte rate of the sampled files is scaled up to the whole stratum (ratio estimator).
+# Prompt overhead is shared out over the units by how many fit in a request. The interval covers both the files
+# that weren't read and the units that weren't counted.
+FILESPERSTRATUM = 30    # Files read per stratum
+UNITSPERFILE = 300      # Units counted per file
+Z = 1.96                # 95% interval
+SHORTPROMPT = ['Database', 'System']    # Strata sent as single strings with the short prompt, coalesced into lists
+
+def getStratum(filename):
+    name, extension = os.path.splitext(os.path.basename(filename))
+    if re.fullmatch(r'Map\d+', name):
+        return 'Maps'
+    if name in ['CommonEvents', 'Troops', 'System']:
+        return name
+    if extension in ['.json', '.yaml']:
+        return 'Database'
+    return 'Scripts'
+
+# Every string with Japanese in it, JSON is walked, anything else is read line by line in the engine's ENCODING
+def extractUnits(path, encoding='utf-8-sig'):
+    if not path.endswith('.json'):
+        with open(path, 'r', encoding=encoding, errors='ignore') as f:
+            return [line.strip() for line in f if isJapanese(line)]
+    try:
+        stack = [readJSON(path)]
+    except ValueError:
+        return []
+    units = []
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            if isJapanese(item):
+                units.append(item)
+        elif isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, dict):
+            stack.extend(item.values())
+    return units
+
+# Returns [bytes, units, mean tokens per unit, variance of the mean] for one file
+def sampleFile(path, model, rng, encoding):
+    units = extractUnits(path, encoding)
+    if len(units) == 0:
+        return [os.path.getsize(path), 0, 0, 0]
+    sample = units if len(units) <= UNITSPERFILE else rng.sample(units, UNITSPERFILE)
+    counts = countList(model, sample)
+    mean = sum(counts) / len(counts)
+    variance = 0
+    if len(counts) > 1:
+        variance = sum((c - mean) ** 2 for c in counts) / (len(counts) - 1) / len(counts) * (1 - len(counts) / len(units))
+    return [os.path.getsize(path), len(units), mean, variance]
+
+# Returns [inputTokens, outputTokens, cost, costVariance, filesRead] for one stratum
+def estimateStratum(paths, stratum, module, rng):
+    model = module.MODEL
+    sample = rng.sample(paths, min(FILESPERSTRATUM, len(paths)))
+    encoding = getattr(module, 'ENCODING', 'utf-8-sig')
+    rows = [sampleFile(path, model, rng, encoding) for path in sample]
+    units = sum(row[1] for row in rows)
+    if units == 0:
+        return [0, 0, 0, 0, len(sample)]
+
+    # Prompt overhead per unit
+    meanTokens = sum(row[1] * row[2] for row in rows) / units
+    if hasattr(module, 'createContext'):
+        characters, system, _ = module.createContext(stratum not in SHORTPROMPT, '')
+    else:
+        characters, system = '', module.PROMPT
+    if stratum in SHORTPROMPT:
+        linesPerRequest = MAXSTRINGS if COALESCESTRINGS else 1
+    else:
+        linesPerRequest = getattr(module, 'BATCHSIZE', 1)
+    if BATCHTOKENS > 0:
+        linesPerRequest = max(1, min(linesPerRequest, int(BATCHTOKENS / (meanTokens + LINEOVERHEAD))))
+    overhead = countStatic(model, system) + countStatic(model, characters) + HISTORYLINES * meanTokens
+    perUnit = LINEOVERHEAD + overhead / linesPerRequest
+
+    # Per file totals, costs are per 1k tokens and scaled by the calibration from real runs
+    inputRatio, outputRatio = getRatios(model, module.__name__)
+    inputCost = module.INPUTAPICOST * .001 * inputRatio
+    outputCost = module.OUTPUTAPICOST * .001 * outputRatio
+    files = []
+    for size, count, mean, variance in rows:
+        inputTokens = count * (mean + perUnit) * inputRatio
+        outputTokens = count * mean / 1.5 * outputRatio
+        cost = inputTokens * module.INPUTAPICOST * .001 + outputTokens * module.OUTPUTAPICOST * .001
+        files.append([size, inputTokens, outputTokens, cost, count ** 2 * variance * (inputCost + outputCost / 1.5) ** 2])
+
+    # Ratio estimator over bytes
+    totalBytes = sum(os.path.getsize(path) for path in paths)
+    sampleBytes = sum(f[0] for f in files) or 1
+    scale = totalBytes / sampleBytes
+    inputTokens = sum(f[1] for f in files) * scale
+    outputTokens = sum(f[2] for f in files) * scale
+    cost = sum(f[3] for f in files) * scale
+    variance = scale ** 2 * sum(f[4] for f in files)
+    n, N = len(files), len(paths)
+    if 1 < n < N:
+        rate = cost / totalBytes
+        spread = sum((f[3] - rate * f[0]) ** 2 for f in files) / (n - 1)
+        variance += totalBytes ** 2 * (1 - n / N) * spread / (n * (sampleBytes / n) ** 2)
+    return [round(inputTokens), round(outputTokens), cost, variance, n]
+
+# module is the engine module, its MODEL, pricing, prompt, ENCODING and getResultString are used
+def estimateSample(paths, module, seed=None):
+    rng = random.Random(seed)
+    strata = {}
+    for path in paths:
+        strata.setdefault(getStratum(path), []).append(path)
+
+    lines = []
+    total = [0, 0]
+    cost = 0
+    variance = 0
+    start = time.time()
+    for stratum, stratumPaths in sorted(strata.items()):
+        stratumStart = time.time()
+        result = estimateStratum(stratumPaths, stratum, module, rng)
+        total = [total[0] + result[0], total[1] + result[1]]
+        cost += result[2]
+        variance += result[3]
+        label = f'{stratum} ({result[4]} of {len(stratumPaths)} files)'
+        lines.append(module.getResultString(['', result[:2], None], time.time() - stratumStart, label))
+
+    margin = Z * math.sqrt(variance)
+    lines.append(module.getResultString(['', total, None], time.time() - start, 'TOTAL (sampled)'))
+    lines.append(Fore.YELLOW + f'95% interval: ${max(0, cost - margin):,.4f} - ${cost + margin:,.4f}' + Fore.RESET)
+    return '\n'.join(lines)
@@ -0,0 +1,49 @@
+# Libraries
+import concurrent.futures, os, signal, threading, time
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+# Graceful Shutdown
+# The first Ctrl-C or SIGTERM stops new requests from going out. Requests that were already sent get until the
+# deadline to come back, anything left after that is answered like a refusal and keeps its original text. The parsers
+# then run through the rest of their files without waiting and every file is written to /translated with what was
+# finished. Finished requests are in the journal so the next run picks up from there. A second Ctrl-C quits at once.
+load_dotenv()
+TIMEOUT = float(os.getenv('shutdownTimeout', '30') or 0)    # Seconds to wait for requests in flight
+STOPPING = threading.Event()
+DEADLINE = None
+
+def requestStop(signum, frame):
+    global DEADLINE
+    if STOPPING.is_set():
+        os._exit(1)
+    DEADLINE = time.monotonic() + TIMEOUT
+    STOPPING.set()
+    tqdm.write(f'Stopping, waiting up to {round(TIMEOUT)}s for requests in flight. Press Ctrl-C again to quit now')
+
+# Only works from the main thread
+def installHandlers():
+    signal.signal(signal.SIGINT, requestStop)
+    signal.signal(signal.SIGTERM, requestStop)
+
+def isStopping():
+    return STOPPING.is_set()
+
+# Sleeps like time.sleep but wakes up when stopping, returns True if it did
+def sleep(seconds):
+    return STOPPING.wait(seconds)
+
+# Waits on a request future, returns None if it was given up on at the deadline
+def waitFor(future):
+    while True:
+        if STOPPING.is_set():
+            remaining = DEADLINE - time.monotonic()
+            if remaining <= 0:
+                future.cancel()
+                return None
+        else:
+            remaining = 1
+        try:
+            return future.result(timeout=remaining)
+        except concurrent.futures.TimeoutError:
+            continue
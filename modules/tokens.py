@@ -0,0 +1,108 @@
+# Libraries
+import functools, json, math, os, re
+import tiktoken
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+# Token Counting
+# Used for estimates, rate limiting and packing batches. The encoder is loaded once per model and counts for text that
+# gets sent over and over (the prompt with the vocab, the character list, history lines) are remembered, so each
+# request only encodes what is new. Special tokens are counted as plain text, game text can contain them.
+load_dotenv()
+CACHESIZE = 4096        # Distinct strings whose counts are kept
+BATCHTHRESHOLD = 64     # Lists at least this long go through tiktoken's thread pool
+TOKENIZER = os.getenv('tokenizer', 'tiktoken').lower()     # tiktoken or approximate
+ENCODING = os.getenv('tokenizerEncoding', '')               # Encoding for models tiktoken doesn't know, cl100k_base if blank
+RATIOFILE = os.getenv('tokenRatios', 'cache/tokenratios.json')
+
+# tiktoken downloads its BPE files the first time an encoding is used and keeps them in TIKTOKEN_CACHE_DIR.
+# Pointing that at a folder copied from a machine that has run the tool once lets it load without a connection.
+if os.getenv('tokenizerCache', '') != '':
+    os.environ['TIKTOKEN_CACHE_DIR'] = os.getenv('tokenizerCache')
+
+# Approximate Counter
+# Counts characters by class and multiplies by tokens per character. The defaults are rough cl100k_base figures
+# for Japanese game text, calibrateRatios() measures them against a real encoder and saves them to tokenRatios.
+KANA = re.compile(r'[぀-ヿｦ-ﾟ]+')
+KANJI = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+ASCII = re.compile(r'[\x00-\x7f]+')
+OTHER = re.compile(r'[^\x00-\x7f぀-ヿｦ-ﾟ㐀-䶿一-鿿豈-﫿]+')
+RATIOS = {'ascii': 0.27, 'kana': 0.8, 'kanji': 1.4, 'other': 1.0}
+try:
+    with open(RATIOFILE, 'r', encoding='utf-8') as f:
+        RATIOS.update(json.load(f))
+except (OSError, ValueError):
+    pass
+
+@functools.lru_cache(maxsize=None)
+def getEncoding(model):
+    if TOKENIZER == 'approximate':
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model) if ENCODING == '' else tiktoken.get_encoding(ENCODING)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    # No connection and nothing in the cache
+    except Exception as e:
+        tqdm.write(f'Could not load the tokenizer for {model}, using approximate token counts ({e})')
+        return None
+
+def approximateCount(text):
+    if text.isascii():
+        return math.ceil(len(text) * RATIOS['ascii'])
+    asciiChars = len(text.encode('ascii', 'ignore'))
+    rest = KANA.sub('', text)
+    kana = len(text) - len(rest)
+    other = KANJI.sub('', rest)
+    kanji = len(rest) - len(other)
+    other = len(other) - asciiChars
+    return math.ceil(asciiChars * RATIOS['ascii'] + kana * RATIOS['kana'] + kanji * RATIOS['kanji'] + other * RATIOS['other'])
+
+def countText(model, text):
+    enc = getEncoding(model)
+    if enc is None:
+        return approximateCount(text)
+    return len(enc.encode_ordinary(text))
+
+@functools.lru_cache(maxsize=CACHESIZE)
+def countStatic(model, text):
+    return countText(model, text)
+
+# encode_ordinary_batch starts a thread pool on every call, which costs more than it saves on a handful of lines.
+def countList(model, textList):
+    enc = getEncoding(model)
+    if enc is None:
+        return [approximateCount(text) for text in textList]
+    if len(textList) >= BATCHTHRESHOLD:
+        return [len(tokens) for tokens in enc.encode_ordinary_batch(textList)]
+    return [len(enc.encode_ordinary(text)) for text in textList]
+
+# Returns [inputTokens, outputTokens] for one request. Output is estimated from the text being translated.
+def countPrompt(model, characters, system, user, history):
+    if not isinstance(history, list):
+        history = [history]
+    inputTokens = countStatic(model, system) + countStatic(model, characters)
+    inputTokens += sum(countStatic(model, line) for line in history)
+    userTokens = countText(model, user)
+    return [inputTokens + userTokens, round(userTokens / 1.5)]
+
+# Measures tokens per character for each class with the real encoder on the given text and saves them for later
+# approximate runs. Each run of one class is encoded on its own.
+def calibrateRatios(model, texts):
+    enc = getEncoding(model)
+    if enc is None:
+        raise RuntimeError('Calibrating needs the tokenizer, set tokenizer to tiktoken and check tokenizerCache')
+    ratios = {}
+    for name, pattern in [('ascii', ASCII), ('kana', KANA), ('kanji', KANJI), ('other', OTHER)]:
+        runs = [run for text in texts for run in pattern.findall(text)]
+        chars = sum(len(run) for run in runs)
+        if chars > 0:
+            ratios[name] = round(sum(countList(model, runs)) / chars, 4)
+    RATIOS.update(ratios)
+    os.makedirs(os.path.dirname(RATIOFILE) or '.', exist_ok=True)
+    tmpFile = f'{RATIOFILE}.tmp'
+    with open(tmpFile, 'w', encoding='utf-8') as f:
+        json.dump(RATIOS, f, indent=4)
+    os.replace(tmpFile, RATIOFILE)
+    return RATIOS
@@ -0,0 +1,70 @@
+# Libraries
+import atexit, os, queue, threading, traceback
+from pathlib import Path
+from tqdm import tqdm
+from modules.jsonio import dumpJSON
+
+# Output Writer
+# Translated files are handed to one background thread that serializes and writes them, so the thread that parsed a
+# file moves straight on to the next one. Every file is written to a temporary file next to it, flushed to disk and
+# renamed over the old one, a file in /translated is either the old one or the whole new one, never half of either.
+# JSON is dumped by jsonio, the same bytes json.dump wrote before.
+QUEUE = queue.Queue()
+LOCK = threading.Lock()
+THREAD = None
+FAILED = []         # Files that couldn't be written
+
+# Text mode turns \n into the platform's line ending unless newline='' like csv wants
+def encodeText(text, encoding, errors, newline):
+    if newline is None and os.linesep != '\n':
+        text = text.replace('\n', os.linesep)
+    return text.encode(encoding, errors)
+
+def writeAtomic(path, data):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmpFile = f'{path}.tmp'
+    with open(tmpFile, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpFile, path)
+
+def writeLoop():
+    while True:
+        path, serialize = QUEUE.get()
+        try:
+            writeAtomic(path, serialize())
+        except Exception:
+            traceback.print_exc()
+            with LOCK:
+                FAILED.append(path)
+        finally:
+            QUEUE.task_done()
+
+# serialize() returns the bytes of the file and runs on the writer thread
+def queueWrite(path, serialize):
+    global THREAD
+    with LOCK:
+        if THREAD is None:
+            THREAD = threading.Thread(target=writeLoop, name='Writer', daemon=True)
+            THREAD.start()
+    QUEUE.put([path, serialize])
+
+def writeJSON(path, data):
+    queueWrite(path, lambda: dumpJSON(data))
+
+def writeText(path, text, encoding='utf-8', errors='strict', newline=None):
+    queueWrite(path, lambda: encodeText(text, encoding, errors, newline))
+
+# Blocks until everything queued so far is on disk, returns the files that failed since the last call
+def flushWrites():
+    QUEUE.join()
+    with LOCK:
+        failed = list(FAILED)
+        FAILED.clear()
+    if len(failed) > 0:
+        tqdm.write(f'Could not write {", ".join(failed)}')
+    return failed
+
+# Anything still queued when the program ends is written first
+atexit.register(QUEUE.join)
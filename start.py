@@ -1,3 +1,5 @@
 from modules.main import main
 
-main()
+# Guarded so worker processes (text extraction) can import this file without starting the menu
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# Test Setup
+# The modules read .env, prompt.txt and vocab.txt when they are imported. Tests run from a scratch folder with
+# settings that never reach an API: the translation memory and the journal are off and tokens are approximated.
+import os, sys, tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(tempfile.mkdtemp(prefix='tests-'))
+Path('prompt.txt').write_text('Translate the Japanese text to English.', encoding='utf-8')
+Path('vocab.txt').write_text('', encoding='utf-8')
+os.environ.update({
+    'api': 'http://127.0.0.1:9/v1',
+    'key': 'test',
+    'org': '',
+    'model': 'gpt-4-1106-preview',
+    'language': 'English',
+    'timeout': '30',
+    'fileThreads': '1',
+    'threads': '1',
+    'width': '60',
+    'listWidth': '80',
+    'noteWidth': '60',
+    'cache': 'false',
+    'journal': 'false',
+    'tokenizer': 'approximate',
+})
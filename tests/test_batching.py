@@ -0,0 +1,81 @@
+import threading, time
+from concurrent.futures import Future
+import modules.batching as batching
+import modules.ratelimit as ratelimit
+from modules.client import createResponse
+
+LATENCY = 0.2
+
+# Answers every request after LATENCY seconds and counts how many were out at once
+def fakeServer(monkeypatch):
+    state = {'inFlight': 0, 'most': 0, 'sent': 0}
+    lock = threading.Lock()
+
+    def submitCompletion(**kwargs):
+        future = Future()
+        with lock:
+            state['inFlight'] += 1
+            state['sent'] += 1
+            state['most'] = max(state['most'], state['inFlight'])
+
+        def answer():
+            with lock:
+                state['inFlight'] -= 1
+            future.set_result(createResponse(kwargs['model'], kwargs['messages'][-1]['content'].upper()))
+        threading.Timer(LATENCY, answer).start()
+        return future
+
+    monkeypatch.setattr(ratelimit, 'submitCompletion', submitCompletion)
+    monkeypatch.setattr(ratelimit, 'createCompletion', lambda **kwargs: submitCompletion(**kwargs).result())
+    return state
+
+def estimateTokens():
+    return [10, 10]
+
+def translateChunk(batch, history):
+    response = ratelimit.requestCompletion(estimateTokens, model='gpt-4', messages=[
+        {'role': 'system', 'content': ' '.join(history)},
+        {'role': 'user', 'content': ' '.join(batch)},
+    ])
+    return [response.choices[0].message.content.split(' '), [10, 10]]
+
+def test_concurrent_batches_share_one_thread(monkeypatch):
+    state = fakeServer(monkeypatch)
+    monkeypatch.setattr(batching, 'CONCURRENTBATCHES', 5)
+    batches = [[f'b{i}l{j}' for j in range(3)] for i in range(10)]
+    threads = threading.active_count()
+
+    start = time.monotonic()
+    responses = batching.dispatchBatches(batches, [], translateChunk)
+    assert time.monotonic() - start < LATENCY * 4
+    assert [r[0] for r in responses] == [[line.upper() for line in batch] for batch in batches]
+    assert state['sent'] == 10 and state['most'] == 5
+    assert threading.active_count() <= threads + 5     # Only the timers of the fake server
+    assert len(ratelimit.PREFETCHED) == 0
+
+def test_dispatch_together_sets_the_limit(monkeypatch):
+    state = fakeServer(monkeypatch)
+    batches = [[f'b{i}'] for i in range(6)]
+    responses = batching.dispatchTogether(3, batching.dispatchBatches, batches, [], translateChunk)
+    assert [r[0] for r in responses] == [['B0'], ['B1'], ['B2'], ['B3'], ['B4'], ['B5']]
+    assert state['most'] == 3
+
+    # Back to one at a time, each batch gets the one before as history
+    state['most'] = 0
+    batching.dispatchBatches(batches, [], translateChunk)
+    assert state['most'] == 1
+
+def test_instructions_reach_every_batch(monkeypatch):
+    histories = []
+    def translateChunk(batch, history):
+        histories.append(history)
+        return [[line.upper() for line in batch], [1, 1]]
+
+    batches = [['a', 'b'], ['c'], ['d']]
+    batching.keepInstructions(['Names'], batching.dispatchBatches, batches, [], translateChunk)
+    assert histories == [['Names'], ['Names', 'A', 'B'], ['Names', 'C']]
+
+    histories.clear()
+    monkeypatch.setattr(batching, 'CONCURRENTBATCHES', 3)
+    batching.keepInstructions(['Names'], batching.dispatchBatches, batches, [], translateChunk)
+    assert histories == [['Names'], ['Names', 'a', 'b'], ['Names', 'c']]
@@ -0,0 +1,85 @@
+import json, re
+from pathlib import Path
+import modules.batchjob as batchjob
+import modules.rpgmakermvmz as mvmz
+from modules.patterns import isJapanese
+
+PAGES = 8
+LINES = 50      # More than a batch, so adaptive sizing would have full batches to grow from
+
+# Every line is its own 401 group, the wait command between them keeps searchCodes from joining them
+def writeGame():
+    events = [None]
+    for p in range(PAGES):
+        codeList = []
+        for i in range(LINES):
+            codeList.append({'code': 401, 'indent': 0, 'parameters': [f'イベント{p}の{i}行目です。']})
+            codeList.append({'code': 230, 'indent': 0, 'parameters': [1]})
+        codeList.append({'code': 0, 'indent': 0, 'parameters': []})
+        events.append({'id': p + 1, 'list': codeList, 'name': f'Event {p}', 'switchId': 1, 'trigger': 0})
+    Path('files').mkdir()
+    Path('files/CommonEvents.json').write_text(json.dumps(events, ensure_ascii=False), encoding='utf-8')
+
+# What the Batch API would send back for every request in path. With drop the last line of every batch is left out.
+def writeResults(path, output, drop=False):
+    results = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            request = json.loads(line)
+            user = request['body']['messages'][-1]['content']
+            lines = re.findall(r'<Line(\d+)>(.*?)</Line\d+>', user)
+            if drop and len(lines) > 1:
+                lines = lines[:-1]
+            content = '\n'.join(f'<Line{i}>Line {i} of the batch.</Line{i}>' for i, text in lines) or 'A string.'
+            results.append({'custom_id': request['custom_id'], 'error': None, 'response': {'status_code': 200, 'body': {
+                'id': 'batch', 'object': 'chat.completion', 'created': 0, 'model': request['body']['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+                'usage': {'prompt_tokens': 100, 'completion_tokens': 50, 'total_tokens': 150},
+            }}})
+    Path(batchjob.RESULTFOLDER, output).write_text(''.join(json.dumps(r) + '\n' for r in results), encoding='utf-8')
+    return len(results)
+
+def getDialogue():
+    events = json.loads(Path('translated/CommonEvents.json').read_text(encoding='utf-8'))
+    return [code['parameters'][0] for event in events if event is not None for code in event['list'] if code['code'] == 401]
+
+# Imports run in spawned worker processes with the engine imported fresh, like from the menu
+def test_export_then_import_twice(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path('prompt.txt').write_text('Translate the Japanese text to English.', encoding='utf-8')
+    Path('vocab.txt').write_text('', encoding='utf-8')
+    writeGame()
+
+    assert 'Failed' not in batchjob.runExport(mvmz.handleMVMZ, ['CommonEvents.json'])
+    assert writeResults(batchjob.REQUESTFILE, 'output.jsonl') >= PAGES * 2     # Two batches a page, nothing coalesced
+
+    for _ in range(2):
+        Path('translated/CommonEvents.json').unlink(missing_ok=True)
+        summary = batchjob.runImport(mvmz.handleMVMZ, ['CommonEvents.json'])
+        assert 'no response' not in summary and 'Failed' not in summary
+        dialogue = getDialogue()
+        assert len(dialogue) == PAGES * LINES
+        assert not any(isJapanese(line) for line in dialogue)
+    assert not Path('cache/batchprofile.json').exists()
+
+# Batches that come back short are split up on import, those smaller requests go out in a follow-up batch
+def test_import_writes_follow_up_requests(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path('prompt.txt').write_text('Translate the Japanese text to English.', encoding='utf-8')
+    Path('vocab.txt').write_text('', encoding='utf-8')
+    writeGame()
+    batchjob.runExport(mvmz.handleMVMZ, ['CommonEvents.json'])
+    writeResults(batchjob.REQUESTFILE, 'output.jsonl', drop=True)
+
+    summary = batchjob.runImport(mvmz.handleMVMZ, ['CommonEvents.json'])
+    assert batchjob.FOLLOWUPFILE in summary
+    assert any(isJapanese(line) for line in getDialogue())
+
+    # Each round answers what the last one split off, until nothing is missing
+    for i in range(10):
+        if not Path(batchjob.FOLLOWUPFILE).exists():
+            break
+        writeResults(batchjob.FOLLOWUPFILE, f'followup{i}.jsonl')
+        summary = batchjob.runImport(mvmz.handleMVMZ, ['CommonEvents.json'])
+    assert 'no response' not in summary and not Path(batchjob.FOLLOWUPFILE).exists()
+    assert not any(isJapanese(line) for line in getDialogue())
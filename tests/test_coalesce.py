@@ -0,0 +1,18 @@
+import modules.batching as batching
+import modules.coalesce as coalesce
+
+# Records the size of every list and how many batches it was allowed to send at once
+def fakeTranslateGPT(calls):
+    def translateGPT(text, history, fullPromptFlag):
+        calls.append([len(text), batching.LOCAL.limit])
+        return [[line.upper() for line in text], [len(text), len(text)]]
+    return translateGPT
+
+def test_queue_is_split_into_lists_of_maxlines(monkeypatch):
+    monkeypatch.setattr(coalesce, 'THREADS', 10)
+    calls = []
+    pages = [[[f'p{p}l{i}' for i in range(80)], []] for p in range(10)] + [[['big'] * 500, []]]
+    results = coalesce.translatePages(fakeTranslateGPT(calls), pages)
+    assert calls == [[400, 10], [400, 10], [500, 10]]
+    assert results[3] == [[f'P3L{i}' for i in range(80)], [80, 80]]
+    assert results[10][0] == ['BIG'] * 500
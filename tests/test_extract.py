@@ -0,0 +1,42 @@
+import modules.coalesce as coalesce
+import modules.extract as extract
+from modules.batching import HISTORYLINES
+
+def test_units_keep_the_last_history_lines(monkeypatch):
+    monkeypatch.setattr(extract, 'MODE', 'extract')
+    monkeypatch.setattr(extract, 'FILENAME', 'Map001.json')
+    monkeypatch.setattr(extract, 'UNITS', [])
+    translateGPT = extract.textUnits(lambda text, history, fullPromptFlag: None)
+    history = [f'{i}行目' for i in range(800)]
+    assert translateGPT(['こんにちは'], history, True) == [['こんにちは'], [0, 0]]
+    assert extract.UNITS[0]['context'] == history[-HISTORYLINES:]
+
+# start.py imports every engine before the initializer runs, the switches have to be changed on the modules
+def test_workers_turn_coalescing_off(monkeypatch):
+    monkeypatch.setattr(extract, 'MODE', None)
+    monkeypatch.setattr(coalesce, 'COALESCE', True)
+    monkeypatch.setattr(coalesce, 'COALESCESTRINGS', True)
+    extract.initWorker('extract')
+    assert extract.MODE == 'extract'
+    assert not coalesce.COALESCE and not coalesce.COALESCESTRINGS
+
+# Pages run one at a time in the workers and units say where in the file they came from
+def test_units_have_their_location(monkeypatch):
+    import modules.rpgmakermvmz as mvmz
+    from tqdm import tqdm
+    monkeypatch.setattr(extract, 'MODE', 'extract')
+    monkeypatch.setattr(extract, 'UNITS', [])
+    monkeypatch.setattr(extract, 'SEEN', {})
+    monkeypatch.setattr(mvmz, 'THREADS', 4)
+    monkeypatch.setattr(mvmz, 'handleMVMZ', lambda filename, estimate: mvmz.searchCodes({'list': [
+        {'code': 230, 'indent': 0, 'parameters': [1]},
+        {'code': 401, 'indent': 0, 'parameters': ['こんにちは']},
+        {'code': 230, 'indent': 0, 'parameters': [1]},
+        {'code': 401, 'indent': 0, 'parameters': ['さようなら']},
+        {'code': 0, 'indent': 0, 'parameters': []},
+    ]}, tqdm(disable=True), [], filename, None, '3/0'))
+    units = extract.runFile('modules.rpgmakermvmz', 'handleMVMZ', 'Map001.json')
+    assert mvmz.THREADS == 1
+    assert [[unit['location'], unit['source']] for unit in units] == [['3/0/1', 'こんにちは'], ['3/0/3', 'さようなら']]
+    extract.SEEN.clear()
+    assert units[0]['id'] == extract.getUnitId('Map001.json', '3/0/1', 'こんにちは')
@@ -0,0 +1,59 @@
+import codecs, json
+import pytest
+import modules.jsonio as jsonio
+import modules.jsonstream as jsonstream
+from modules.jsonio import BACKENDS, dumpJSON, parseJSON
+from modules.jsonstream import finishItems, readItems, startItems, writeItem
+
+DATA = [None, {
+    'id': 1,
+    'name': 'テスト 😀',
+    'list': [{'code': 401, 'parameters': ['\\n<アリス>「こんにちは」\n"quoted" / \\C[2]\t\x01']}],
+    'floats': [1.5e300, 0.1, -0.0, 1e-7, 100.0],
+    'big': 2 ** 70,
+    'flags': [True, False, None, ''],
+}]
+INSTALLED = [name for name, backend in BACKENDS.items() if backend is not None]
+
+def test_dump_is_the_old_json_dump():
+    assert dumpJSON(DATA) == json.dumps(DATA, ensure_ascii=False).encode('utf-8')
+
+@pytest.mark.parametrize('backend', INSTALLED)
+def test_default_dump_ignores_the_backend(backend):
+    assert dumpJSON(DATA, backend) == json.dumps(DATA, ensure_ascii=False).encode('utf-8')
+
+# Integers over 64 bits are read through json
+@pytest.mark.parametrize('backend', INSTALLED)
+def test_backends_read_the_same_data(backend):
+    raw = codecs.BOM_UTF8 + json.dumps(DATA, ensure_ascii=False, indent=2).encode('utf-8')
+    assert parseJSON(raw, backend) == DATA
+
+@pytest.mark.parametrize('backend', INSTALLED)
+def test_compact_dump_is_opt_in(backend, monkeypatch):
+    monkeypatch.setattr(jsonio, 'COMPACT', True)
+    data = DATA[1]['list']
+    assert dumpJSON(data, backend) == json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    assert json.loads(dumpJSON(DATA, backend)) == DATA
+
+def test_streamed_file_is_the_same_as_a_whole_dump(tmp_path):
+    path = tmp_path / 'CommonEvents.json'
+    path.write_bytes(codecs.BOM_UTF8 + json.dumps(DATA, ensure_ascii=False, indent=2).encode('utf-8'))
+    stream = startItems(str(tmp_path / 'out.json'), False)
+    for key, value in readItems(str(path)):
+        writeItem(stream, key, value)
+    finishItems(stream)
+    assert (tmp_path / 'out.json').read_bytes() == dumpJSON(DATA)
+
+# One character at a time puts a chunk boundary inside every number
+@pytest.mark.parametrize('data', [
+    [0.5, 1.5e10, -2.25E-3, 10, 0, 3.0, 1e5, DATA[1]['floats']],
+    {'a': 0.5, 'b': 1.5e10, 'c': [-2.25E-3, 7], 'd': 1e-7, 'e': 12},
+    [DATA[1], 1.25, {'x': 2e2}, 42],
+])
+def test_numbers_split_across_chunks(data, tmp_path, monkeypatch):
+    monkeypatch.setattr(jsonstream, 'CHUNKSIZE', 1)
+    for text in [json.dumps(data), json.dumps(data, indent=2), json.dumps(data, separators=(',', ':'))]:
+        path = tmp_path / 'data.json'
+        path.write_text(text, encoding='utf-8')
+        items = list(readItems(str(path)))
+        assert (dict(items) if isinstance(data, dict) else [value for key, value in items]) == data
@@ -0,0 +1,33 @@
+from tqdm import tqdm
+import modules.rpgmakermvmz as mvmz
+
+def getPage():
+    return {'list': [
+        {'code': 101, 'indent': 0, 'parameters': ['', 0, 0, 2]},
+        {'code': 401, 'indent': 0, 'parameters': ['こんにちは']},
+        {'code': 401, 'indent': 0, 'parameters': ['元気ですか']},
+        {'code': 0, 'indent': 0, 'parameters': []},
+    ]}
+
+# Runs the first pass with coalescing and answers the held back dialogue with translatePages
+def translatePage(monkeypatch, translatePages):
+    monkeypatch.setattr(mvmz, 'translatePages', translatePages)
+    page = getPage()
+    deferred = []
+    with tqdm(disable=True) as pbar:
+        mvmz.searchCodes(page, pbar, [], 'CommonEvents.json', deferred)
+        assert len(deferred) == 1
+        mvmz.translateDeferred(deferred, pbar, 'CommonEvents.json')
+    return page
+
+def test_deferred_page_is_filled_in(monkeypatch):
+    page = translatePage(monkeypatch, lambda translateGPT, pages: [[['Hello, how are you?'], [1, 1]] for _ in pages])
+    assert [code['code'] for code in page['list']] == [101, 401, 0]
+    assert 'Hello' in page['list'][1]['parameters'][0]
+
+def test_deferred_mismatch_leaves_no_placeholders(monkeypatch):
+    mvmz.MISMATCH.clear()
+    page = translatePage(monkeypatch, lambda translateGPT, pages: [[[], [1, 1]] for _ in pages])
+    assert [code['code'] for code in page['list']] == [101, 401, 0]
+    assert page['list'][1]['parameters'] == ['こんにちは元気ですか']
+    assert 'CommonEvents.json' in mvmz.MISMATCH
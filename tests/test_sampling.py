@@ -0,0 +1,16 @@
+import modules.kansen as kansen
+from modules.sampling import estimateSample, extractUnits
+
+SCRIPT = '*start\n「こんにちは、元気ですか？」\n今日はいい天気ですね。\n@wait time=100\n'
+
+def test_units_are_read_in_the_engine_encoding(tmp_path):
+    path = tmp_path / 'script.ks'
+    path.write_text(SCRIPT, encoding='cp932')
+    assert extractUnits(str(path), kansen.ENCODING) == ['「こんにちは、元気ですか？」', '今日はいい天気ですね。']
+
+def test_sampled_estimate_of_cp932_script(tmp_path):
+    path = tmp_path / 'script.ks'
+    path.write_text(SCRIPT, encoding='cp932')
+    result = estimateSample([str(path)], kansen, seed=1)
+    assert '[Input: 0]' not in result
+    assert '$0.0000 - $0.0000' not in result